@@ -0,0 +1,141 @@
+# http_client (kept-alive connections, cached DNS) against a connection
+# per request as urequests makes, on a local stand-in for the APIs
+# iot/2, iot/3 and iot/4 call.
+#
+#   python bench/http_client.py [--n 200] [--setup-ms 0,40]
+#
+# The stand-in is an HTTP/1.1 keep-alive server answering the CheerLights
+# GET with JSON and the IFTTT POST. It is reached as "localhost", so each
+# lookup goes through getaddrinfo. Over loopback a connect is almost
+# free; --setup-ms makes the server hold each new connection for that
+# long first, as the TCP (and TLS) handshake round trips do over Wi-Fi.
+# For each: time per request, p50/p99, and the client's counters. Then
+# the server's idle timeout is set shorter than the client's, to show a
+# request on a connection the server has dropped being sent again.
+# The Host header each request carried is checked to include the port.
+import argparse
+import http.server
+import json
+import socket
+import threading
+import time
+
+import upy_host
+import http_client
+
+BODY = json.dumps({"created_at": "2024-01-01T00:00:00Z", "entry_id": 1, "field2": "#ff00ff"}).encode()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    setup_ms = 0
+    idle_s = 30
+    hosts = set()
+
+    def setup(self):
+        super().setup()
+        self.connection.settimeout(self.idle_s)
+        # Headers and body go out in separate writes
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.setup_ms:
+            time.sleep(self.setup_ms / 1000)
+
+    def do_GET(self):
+        Handler.hosts.add(self.headers.get("Host"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(n)
+        body = b"Congratulations! You've fired the SecurityWarning event"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        # Chunked, as IFTTT answers
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+
+    def log_message(self, *a):
+        pass
+
+
+def serve():
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def run(name, port, n, pooled):
+    get_url = "http://localhost:%d/channels/1417/field/2/last.json" % port
+    post_url = "http://localhost:%d/trigger/SecurityWarning/with/key/abc" % port
+    s = http_client.Session()
+    lat = []
+    for i in range(n):
+        if not pooled:
+            # What urequests does: look up, connect, request, close
+            s = http_client.Session(dns_ttl_ms=0)
+        t0 = time.perf_counter()
+        if i % 4 == 3:
+            r = s.post(post_url, json={"value1": "motion"})
+            assert r.status_code == 200 and r.text.startswith("Congratulations")
+        else:
+            r = s.get(get_url)
+            assert r.json()["field2"] == "#ff00ff"
+        if not pooled:
+            s.close()
+        lat.append(time.perf_counter() - t0)
+    s.close()
+    print(
+        "%-26s %7.2f ms/req  p50 %6.2f ms  p99 %6.2f ms | %s"
+        % (
+            name,
+            sum(lat) / n * 1e3,
+            upy_host.percentile(lat, 50) * 1e3,
+            upy_host.percentile(lat, 99) * 1e3,
+            "connects %d, reused %d, lookups %d" % (s.connects, s.reused, s.lookups) if pooled else "connect each time",
+        )
+    )
+
+
+def stale(port):
+    Handler.idle_s = 0.2
+    s = http_client.Session(idle_ms=30000)
+    url = "http://localhost:%d/channels/1417/field/2/last.json" % port
+    s.get(url)
+    time.sleep(0.5)
+    r = s.get(url)
+    print(
+        "server dropped the idle connection: status %d, connects %d, reused %d, retried %d"
+        % (r.status_code, s.connects, s.reused, s.retried)
+    )
+    s.close()
+    Handler.idle_s = 30
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--setup-ms", default="0,40")
+    args = ap.parse_args()
+    srv = serve()
+    port = srv.server_address[1]
+    for ms in [int(x) for x in args.setup_ms.split(",")]:
+        Handler.setup_ms = ms
+        n = args.n if ms == 0 else max(20, args.n // 10)
+        print("connection setup %d ms:" % ms)
+        run("  new connection each", port, n, False)
+        run("  kept alive", port, n, True)
+    Handler.setup_ms = 0
+    stale(port)
+    want = {"localhost:%d" % port}
+    print("Host header %s  %s" % (", ".join(sorted(Handler.hosts)), "ok" if Handler.hosts == want else "FAIL"))
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
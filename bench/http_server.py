@@ -0,0 +1,252 @@
+# libs/http_server.py against the accept/recv/close loop of
+# iot/7_web_page.py serve(), with concurrent local clients.
+#
+#   python bench/http_server.py [--clients 8] [--duration 3] [--stall-ms 200]
+#
+# Both serve the iot/7 page (temperature from a fixed ADC reading through
+# the same math). Each client thread sends GET / back to back and times
+# each request: over one kept-alive connection for HTTPServer, and with
+# a new connection per request for the loop, which closes after every
+# response (HTTPServer is also run that way, to separate the two).
+#
+# Then the same with one more client that opens a connection and only
+# sends its request --stall-ms later, as browsers do when they connect
+# ahead of time; its own requests are not counted.
+#
+# Last, a client that sends a 60 KB request line (then a header line)
+# with no newline, 1 KB at a time: the status it gets and how much it
+# had sent when the answer came.
+import argparse
+import asyncio
+import math
+import socket
+import threading
+import time
+
+import upy_host
+from http_server import HTTPServer
+
+
+def temperature():
+    Vr = 3.3 * float(23000) / 65535
+    Rt = 10000 * Vr / (3.3 - Vr)
+    temp = 1 / (((math.log(Rt / 10000)) / 3950) + (1 / (273.15 + 25)))
+    return temp - 273.15
+
+
+def webpage(value):
+    return f"""
+            <!DOCTYPE html>
+            <html>
+            <body>
+            <form action="./red">
+            <input type="submit" value="red " />
+            </form>
+            <form action="./green">
+            <input type="submit" value="green" />
+            </form>
+            <form action="./blue">
+            <input type="submit" value="blue" />
+            </form>
+            <form action="./off">
+            <input type="submit" value="off" />
+            </form>
+            <p>Temperature is {value} degrees Celsius</p>
+            </body>
+            </html>
+            """
+
+
+# iot/7_web_page.py serve(), without the LEDs
+def legacy_serve(connection, stop):
+    connection.settimeout(0.2)
+    while not stop.is_set():
+        try:
+            client = connection.accept()[0]
+        except socket.timeout:
+            continue
+        request = client.recv(1024)
+        request = str(request)
+        try:
+            request = request.split()[1]
+        except IndexError:
+            pass
+        value = "%.2f" % temperature()
+        html = webpage(value)
+        client.send(html.encode())
+        client.close()
+
+
+def app_thread(port_box, stop):
+    app = HTTPServer(max_conns=16)
+    app.add("/", lambda req: webpage("%.2f" % temperature()))
+
+    async def main():
+        task = asyncio.create_task(app.serve("127.0.0.1", 0, backlog=16))
+        while app.server is None:
+            await asyncio.sleep(0.01)
+        port_box.append(app.server.sockets[0].getsockname()[1])
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        app.close()
+        await task
+
+    asyncio.run(main())
+
+
+REQ = b"GET / HTTP/1.1\r\nHost: pico\r\nUser-Agent: bench\r\nAccept: text/html\r\n\r\n"
+REQ_CLOSE = b"GET / HTTP/1.1\r\nHost: pico\r\nUser-Agent: bench\r\nConnection: close\r\n\r\n"
+
+
+def read_response(s, buf):
+    while b"\r\n\r\n" not in buf:
+        d = s.recv(4096)
+        if not d:
+            return None, buf
+        buf += d
+    head, _, rest = buf.partition(b"\r\n\r\n")
+    n = 0
+    for line in head.split(b"\r\n")[1:]:
+        k, _, v = line.partition(b":")
+        if k.lower() == b"content-length":
+            n = int(v)
+    while len(rest) < n:
+        d = s.recv(4096)
+        if not d:
+            break
+        rest += d
+    return rest[:n], rest[n:]
+
+
+def client(port, mode, stop, lat, stall=0):
+    s = None
+    buf = b""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        if stall:
+            c = socket.create_connection(("127.0.0.1", port))
+            time.sleep(stall)
+            c.sendall(REQ_CLOSE)
+            while c.recv(4096):
+                pass
+            c.close()
+            continue
+        if mode == "keep-alive":
+            if s is None:
+                s = socket.create_connection(("127.0.0.1", port))
+            s.sendall(REQ)
+            body, buf = read_response(s, buf)
+            if body is None:
+                s.close()
+                s = None
+                continue
+        else:
+            c = socket.create_connection(("127.0.0.1", port))
+            c.sendall(REQ_CLOSE if mode == "close" else REQ)
+            while c.recv(4096):
+                pass
+            c.close()
+        lat.append(time.perf_counter() - t0)
+    if s:
+        s.close()
+
+
+def run(name, port, mode, nclients, duration, stall=0):
+    stop = threading.Event()
+    lats = [[] for _ in range(nclients)]
+    ts = [threading.Thread(target=client, args=(port, mode, stop, lats[i])) for i in range(nclients)]
+    if stall:
+        name += ", 1 stalling"
+        ts.append(threading.Thread(target=client, args=(port, mode, stop, [], stall)))
+    for t in ts:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in ts:
+        t.join()
+    lat = [x for l in lats for x in l]
+    print(
+        "%-46s %6.0f req/s  p50 %6.2f ms  p99 %6.2f ms  max %7.2f ms"
+        % (
+            name,
+            len(lat) / duration,
+            upy_host.percentile(lat, 50) * 1e3,
+            upy_host.percentile(lat, 99) * 1e3,
+            max(lat) * 1e3,
+        )
+    )
+
+
+def long_line(port, head):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.setblocking(False)
+    sent = 0
+    resp = b""
+    try:
+        s.sendall(head)
+        while sent < 60000 and not resp:
+            s.sendall(b"x" * 1000)
+            sent += 1000
+            time.sleep(0.002)
+            try:
+                resp = s.recv(1024)
+            except BlockingIOError:
+                pass
+    except OSError:
+        # The server answered and closed while the rest was on its way
+        pass
+    s.setblocking(True)
+    s.settimeout(5)
+    if not resp:
+        try:
+            s.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        resp = s.recv(1024)
+    s.close()
+    return int(resp.split()[1]), sent
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=3)
+    ap.add_argument("--stall-ms", type=float, default=200)
+    args = ap.parse_args()
+    stall = args.stall_ms / 1000
+
+    stop = threading.Event()
+    ls = socket.socket()
+    ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ls.bind(("127.0.0.1", 0))
+    ls.listen(1)
+    t = threading.Thread(target=legacy_serve, args=(ls, stop))
+    t.start()
+    for st in (0, stall):
+        run("serve() loop, connection per req", ls.getsockname()[1], "legacy", args.clients, args.duration, st)
+    stop.set()
+    t.join()
+    ls.close()
+
+    stop = threading.Event()
+    port = []
+    t = threading.Thread(target=app_thread, args=(port, stop))
+    t.start()
+    while not port:
+        time.sleep(0.01)
+    for st in (0, stall):
+        run("HTTPServer, connection per req", port[0], "close", args.clients, args.duration, st)
+        run("HTTPServer, keep-alive", port[0], "keep-alive", args.clients, args.duration, st)
+    for name, head, want in (
+        ("request line", b"GET /", 414),
+        ("header line", b"GET / HTTP/1.1\r\nX-Junk: ", 431),
+    ):
+        status, sent = long_line(port[0], head)
+        print("60 KB %-13s with no newline: %d after %d B sent" % (name, status, sent))
+        assert status == want and sent < 60000
+    stop.set()
+    t.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# http_static.StaticFiles under HTTPServer, fetched with a local HTTP
+# client (http.client, keep-alive).
+#
+#   python bench/http_static.py [--n 300] [--chunk 1024]
+#
+# A dashboard of the kind the request has in mind is written to a temp
+# directory: an HTML page, a stylesheet and a ~100 KB script, each with
+# a .gz copy. Each file is fetched --n times plain, with gzip, and as a
+# browser revalidating it (If-None-Match), for the bytes on the wire and
+# the time per request (a 304 is checked to carry no Content-Type or
+# Content-Length). Then the server's peak extra memory while it sends
+# the script, against a handler that reads the whole file and returns
+# it. On the host that includes asyncio's transport buffer,
+# which holds up to 64 KB before drain() waits; uasyncio writes
+# straight to the socket. asyncio's 256 KB receive buffer, which would
+# hide both, is cut to 4 KB for this.
+import argparse
+import asyncio
+from asyncio import selector_events
+import gzip
+import http.client
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import upy_host
+from http_server import HTTPServer
+from http_static import StaticFiles
+
+
+def dashboard(root):
+    random.seed(1)
+    rows = "".join('<tr><td id="s%d">-</td><td>sensor %d</td></tr>\n' % (i, i) for i in range(60))
+    files = {
+        "index.html": "<!DOCTYPE html><html><head><link rel=stylesheet href=app.css>"
+        "<script src=app.js></script></head><body><table>\n%s</table></body></html>" % rows,
+        "app.css": "".join("#s%d { color: #%06x; padding: 2px; }\n" % (i, random.randrange(1 << 24)) for i in range(300)),
+        "app.js": "".join(
+            "function update%d(v) { document.getElementById('s%d').textContent = v.toFixed(2); }\n" % (i % 60, i % 60)
+            + "var series%d = [%s];\n" % (i, ",".join(str(random.randint(0, 999)) for _ in range(12)))
+            for i in range(800)
+        ),
+    }
+    for name, text in files.items():
+        data = text.encode()
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(data)
+        with open(os.path.join(root, name + ".gz"), "wb") as f:
+            f.write(gzip.compress(data, 9))
+    return list(files)
+
+
+def serve(app, port_box, stop, mem):
+    async def main():
+        task = asyncio.create_task(app.serve("127.0.0.1", 0))
+        while app.server is None:
+            await asyncio.sleep(0.01)
+        port_box.append(app.server.sockets[0].getsockname()[1])
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        app.close()
+        await task
+
+    asyncio.run(main())
+
+
+def fetch(conn, path, headers):
+    conn.request("GET", path, headers=headers)
+    r = conn.getresponse()
+    body = r.read()
+    # Status line and headers as sent, roughly
+    head = 17 + sum(len(k) + len(v) + 4 for k, v in r.getheaders()) + 2
+    if r.status == 304:
+        # A bare 304: the validators and nothing about a body
+        names = sorted(k.lower() for k, _ in r.getheaders())
+        assert names == ["cache-control", "connection", "etag", "vary"], names
+    return r.status, r.getheader("ETag"), head + len(body), body
+
+
+def measure(port, names, n):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    print("%-11s %-13s %8s %10s %6s" % ("file", "request", "bytes", "per req", "status"))
+    for name in names:
+        path = "/static/" + name
+        _, etag, _, plain = fetch(conn, path, {})
+        _, etag_gz, _, _ = fetch(conn, path, {"Accept-Encoding": "gzip, deflate"})
+        for label, headers in (
+            ("plain", {}),
+            ("gzip", {"Accept-Encoding": "gzip, deflate"}),
+            ("revalidate", {"Accept-Encoding": "gzip, deflate", "If-None-Match": etag_gz}),
+        ):
+            t0 = time.perf_counter()
+            for _ in range(n):
+                status, _, nbytes, body = fetch(conn, path, headers)
+            dt = (time.perf_counter() - t0) / n
+            if label == "gzip":
+                assert gzip.decompress(body) == plain
+            print("%-11s %-13s %8d %7.0f us %6d" % (name, label, nbytes, dt * 1e6, status))
+    conn.close()
+
+
+def peak(app_factory, path, tag):
+    app = app_factory()
+    stop = threading.Event()
+    port = []
+    t = threading.Thread(target=serve, args=(app, port, stop, None))
+    t.start()
+    while not port:
+        time.sleep(0.01)
+    selector_events._SelectorSocketTransport.max_size = 4096
+    # A client that allocates nothing while it reads, so the peak is the
+    # server's
+    s = socket.create_connection(("127.0.0.1", port[0]))
+    buf = bytearray(1 << 16)
+    req = b"GET %s HTTP/1.1\r\nHost: pico\r\nConnection: close\r\n\r\n" % path.encode()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    s.sendall(req)
+    nbytes = 0
+    while True:
+        n = s.recv_into(buf)
+        if not n:
+            break
+        nbytes += n
+    extra = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    s.close()
+    stop.set()
+    t.join()
+    print("%-36s %7d B sent, server peak extra memory %7d B" % (tag, nbytes, extra))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=300)
+    ap.add_argument("--chunk", type=int, default=1024)
+    args = ap.parse_args()
+    root = tempfile.mkdtemp()
+    names = dashboard(root)
+    files = StaticFiles(root, "/static/", chunk=args.chunk)
+
+    def app_static():
+        app = HTTPServer()
+        app.add("/static/*", files.handler)
+        return app
+
+    def app_whole():
+        def whole(req):
+            with open(root + "/" + req.path[len("/static/") :], "rb") as f:
+                return 200, f.read(), {"Content-Type": "application/javascript"}
+
+        app = HTTPServer()
+        app.add("/static/*", whole)
+        return app
+
+    app = app_static()
+    stop = threading.Event()
+    port = []
+    t = threading.Thread(target=serve, args=(app, port, stop, None))
+    t.start()
+    while not port:
+        time.sleep(0.01)
+    measure(port[0], names, args.n)
+    stop.set()
+    t.join()
+    print("%d files sent, %d answered 304" % (files.sent, files.not_modified))
+    peak(app_whole, "/static/app.js", "app.js, whole file read and returned")
+    peak(app_static, "/static/app.js", "app.js, StaticFiles %d B chunks" % args.chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# Blocking simple_umqtt vs uasyncio async_umqtt against a local broker.
+#
+#   python bench/mqtt_async.py [--count 2000] [--latency-ms 2] [--tasks 16]
+#
+# Reports msgs/sec and p50/p99 QoS 1 publish latency (call to PUBACK),
+# then checks async_umqtt's error paths: inbound QoS 2 under packet loss,
+# a callback that raises, publishes whose PUBACK never comes, and a
+# connection the broker closes.
+import argparse
+import asyncio
+import sys
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+
+from simple_umqtt import MQTTClient
+import async_umqtt
+
+TOPIC = b"bench/async"
+PAYLOAD = b'{"temp": 23.5, "hum": 41}'
+
+
+def run_blocking(port, count):
+    c = MQTTClient(b"blocking", "127.0.0.1", port)
+    c.connect()
+    lat = []
+    t0 = time.perf_counter()
+    for _ in range(count):
+        t = time.perf_counter()
+        c.publish(TOPIC, PAYLOAD, qos=1)
+        lat.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t0
+    c.disconnect()
+    return count / elapsed, lat
+
+
+async def run_async(port, count, tasks):
+    c = async_umqtt.MQTTClient(b"async", "127.0.0.1", port)
+    await c.connect()
+    lat = []
+
+    async def worker(n):
+        for _ in range(n):
+            t = time.perf_counter()
+            await c.publish(TOPIC, PAYLOAD, qos=1)
+            lat.append(time.perf_counter() - t)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(count // tasks) for _ in range(tasks)))
+    elapsed = time.perf_counter() - t0
+    await c.disconnect()
+    return len(lat) / elapsed, lat
+
+
+async def qos2_inbound(broker, n):
+    got = []
+    sub = async_umqtt.MQTTClient(b"async-sub", "127.0.0.1", broker.port)
+    sub.set_callback(lambda t, m: got.append(bytes(m)))
+    await sub.connect()
+    await sub.subscribe(TOPIC, qos=2)
+    broker.loss = 0.2
+    # async_umqtt publishes up to QoS 1, so the sender is simple_umqtt
+    pub = MQTTClient(b"async-pub2", "127.0.0.1", broker.port, window=8, retry_ms=50)
+    pub.connect()
+    for i in range(n):
+        pub.publish(TOPIC, b"%d" % i, qos=2)
+        await asyncio.sleep(0)
+    pub.flush()
+    # Until all have arrived, then long enough for the broker's retries
+    # to show up any duplicate
+    t = time.time()
+    while len(got) < n and time.time() - t < 5:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    broker.loss = 0
+    pub.disconnect()
+    await sub.disconnect()
+    ok = sorted(got) == sorted(b"%d" % i for i in range(n))
+    print("inbound QoS 2, 20%% loss: %d/%d delivered once  %s" % (len(got), n, "ok" if ok else "FAIL"))
+    return ok
+
+
+async def callback_error(broker):
+    def cb(t, m):
+        raise ValueError("bad message")
+
+    sub = async_umqtt.MQTTClient(b"async-bad", "127.0.0.1", broker.port)
+    sub.set_callback(cb)
+    await sub.connect()
+    await sub.subscribe(TOPIC)
+    loop = asyncio.get_running_loop()
+    handler = loop.get_exception_handler()
+    loop.set_exception_handler(lambda loop, ctx: None)
+    pub = async_umqtt.MQTTClient(b"async-pub", "127.0.0.1", broker.port)
+    await pub.connect()
+    await pub.publish(TOPIC, b"x")
+    t = time.time()
+    while sub.isconnected() and time.time() - t < 1:
+        await asyncio.sleep(0.01)
+    ok = not sub.isconnected()
+    await pub.disconnect()
+    await sub.disconnect()
+    loop.set_exception_handler(handler)
+    print("callback raises: connection closed %s" % ("ok" if ok else "FAIL"))
+    return ok
+
+
+async def ack_timeout(broker, n):
+    c = async_umqtt.MQTTClient(b"async-noack", "127.0.0.1", broker.port, timeout=0.05)
+    await c.connect()
+    broker.block = {0x40}
+    c.pid = 65535 - n // 2
+    errors = 0
+    for _ in range(n):
+        try:
+            await c.publish(TOPIC, PAYLOAD, qos=1)
+        except OSError:
+            errors += 1
+    broker.block = set()
+    left = len(c._acks)
+    await c.disconnect()
+    ok = errors == n and left == 0
+    print("PUBACK lost: %d timeouts, %d acks left pending  %s" % (errors, left, "ok" if ok else "FAIL"))
+    return ok
+
+
+def client_tasks(c):
+    return [t for t in asyncio.all_tasks() if not t.done() and t.get_coro().cr_frame.f_locals.get("self") is c]
+
+
+async def broker_close(broker):
+    c = async_umqtt.MQTTClient(b"async-kicked", "127.0.0.1", broker.port, keepalive=1)
+    c.set_callback(lambda t, m: None)
+    await c.connect()
+    await c.connect()
+    twice = len(client_tasks(c))
+    loop = asyncio.get_running_loop()
+    handler = loop.get_exception_handler()
+    errors = []
+    loop.set_exception_handler(lambda loop, ctx: errors.append(ctx.get("exception")))
+    broker.loop.call_soon_threadsafe(broker.kick)
+    t = time.time()
+    while c.isconnected() and time.time() - t < 1:
+        await asyncio.sleep(0.01)
+    raised = []
+    for f in (
+        lambda: c.publish(TOPIC, b"x"),
+        lambda: c.publish(TOPIC, b"x", qos=1),
+        lambda: c.subscribe(TOPIC),
+        c.ping,
+    ):
+        try:
+            await f()
+            raised.append(None)
+        except Exception as e:
+            raised.append(type(e).__name__)
+    # Past the keepalive period, when a leftover keepalive task would ping
+    await asyncio.sleep(0.7)
+    left = len(client_tasks(c))
+    loop.set_exception_handler(handler)
+    ok = twice == 2 and all(e == "OSError" for e in raised) and left == 0 and not errors
+    print(
+        "broker closes: tasks after two connects %d, calls raise %s, tasks left %d, task errors %d  %s"
+        % (twice, "/".join(str(e) for e in raised), left, len(errors), "ok" if ok else "FAIL")
+    )
+    return ok
+
+
+async def checks(broker):
+    ok = await qos2_inbound(broker, 100)
+    ok &= await callback_error(broker)
+    ok &= await ack_timeout(broker, 20)
+    ok &= await broker_close(broker)
+    return ok
+
+
+def report(name, rate, lat):
+    print(
+        "%-22s %10.0f msg/s   p50 %7.2f ms   p99 %7.2f ms"
+        % (name, rate, upy_host.percentile(lat, 50) * 1e3, upy_host.percentile(lat, 99) * 1e3)
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=2000)
+    ap.add_argument("--latency-ms", type=float, default=2.0)
+    ap.add_argument("--tasks", type=int, default=16)
+    args = ap.parse_args()
+    with BrokerThread(latency=args.latency_ms / 1000) as broker:
+        print("broker latency %.1f ms, %d QoS 1 publishes" % (args.latency_ms, args.count))
+        report("simple_umqtt (block)", *run_blocking(broker.port, args.count))
+        report("async_umqtt x1 task", *asyncio.run(run_async(broker.port, args.count, 1)))
+        report("async_umqtt x%d tasks" % args.tasks, *asyncio.run(run_async(broker.port, args.count, args.tasks)))
+    with BrokerThread(retry=0.05) as broker:
+        ok = asyncio.run(checks(broker))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# Minimal MQTT 3.1.1 broker stand-in for host benchmarks.
+#
+# Handles CONNECT, PUBLISH at QoS 0/1/2 in both directions, SUBSCRIBE,
+# PINGREQ and DISCONNECT and fans publishes out to matching subscribers.
+# Sessions opened with clean_session=0 keep their subscriptions and
+# in-flight state across reconnects.
+#
+#   latency  seconds added to every packet the broker sends
+#   loss     probability of dropping a PUBLISH/PUBACK/PUBREC/PUBREL/PUBCOMP,
+#            in either direction
+#   retry    seconds before the broker resends an unacknowledged delivery
+#   block    set of packet types (0x50, 0x70, ...) to drop unconditionally,
+#            for staging a failure at a given step of a handshake
+#
+# Run on its own to point a board or another host at it:
+#
+#   python bench/mqtt_broker.py [--port 1883] [--latency-ms 0] [--loss 0]
+import argparse
+import asyncio
+import random
+import struct
+import threading
+
+
+def topic_matches(flt, topic):
+    f = flt.split(b"/")
+    t = topic.split(b"/")
+    for i, level in enumerate(f):
+        if level == b"#":
+            return True
+        if i >= len(t):
+            return False
+        if level != b"+" and level != t[i]:
+            return False
+    return len(f) == len(t)
+
+
+def encode_len(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _lossy(op):
+    return 0x30 <= op & 0xF0 <= 0x70
+
+
+def _drop(broker, op):
+    if op & 0xF0 in broker.block or _lossy(op) and broker.rng.random() < broker.loss:
+        broker.stats["dropped"] += 1
+        return True
+    return False
+
+
+class ClientState:
+    # Per client id; outlives the connection unless clean_session is set
+    def __init__(self):
+        self.subs = {}
+        self.pid = 0
+        self.outbound = {}  # pid -> [packet, waiting for (0x40/0x50/0x70), sent_at]
+        self.inbound = set()  # QoS 2 pids received but not yet released
+
+
+class Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = b""
+        self.state = ClientState()
+        self.out = asyncio.Queue()
+        self.tasks = []
+
+    @property
+    def subs(self):
+        return self.state.subs
+
+    def send(self, pkt):
+        b = self.broker
+        if _drop(b, pkt[0]):
+            return
+        b.stats["tx"] += 1
+        if b.latency:
+            loop = asyncio.get_running_loop()
+            self.out.put_nowait((loop.time() + b.latency, pkt))
+        else:
+            self.writer.write(pkt)
+
+    async def _send_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, pkt = await self.out.get()
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.writer.write(pkt)
+            if self.out.empty():
+                await self.writer.drain()
+
+    async def _retry_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.broker.retry / 2)
+            now = loop.time()
+            for pid, m in list(self.state.outbound.items()):
+                if now - m[2] >= self.broker.retry:
+                    self._resend(pid, m)
+
+    def _resend(self, pid, m):
+        if m[1] == 0x70:
+            self.send(b"\x62\x02" + struct.pack("!H", pid))
+        else:
+            self.send(bytes([m[0][0] | 0x08]) + m[0][1:])
+        m[2] = asyncio.get_running_loop().time()
+
+    async def _read_packet(self):
+        hdr = await self.reader.readexactly(1)
+        n = 0
+        sh = 0
+        while True:
+            b = (await self.reader.readexactly(1))[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        body = await self.reader.readexactly(n) if n else b""
+        return hdr[0], body
+
+    def deliver(self, topic, msg, qos, retain=False):
+        st = self.state
+        qos = min(qos, max(q for f, q in st.subs.items() if topic_matches(f, topic)))
+        var = struct.pack("!H", len(topic)) + topic
+        if qos:
+            st.pid = st.pid % 65535 + 1
+            while st.pid in st.outbound:
+                st.pid = st.pid % 65535 + 1
+            var += struct.pack("!H", st.pid)
+        body = var + msg
+        pkt = bytes([0x30 | qos << 1 | retain]) + encode_len(len(body)) + body
+        if qos:
+            st.outbound[st.pid] = [pkt, 0x40 if qos == 1 else 0x50, asyncio.get_running_loop().time()]
+        self.broker.stats["delivered"] += 1
+        self.send(pkt)
+
+    async def run(self):
+        if self.broker.latency:
+            self.tasks.append(asyncio.create_task(self._send_loop()))
+        if self.broker.retry:
+            self.tasks.append(asyncio.create_task(self._retry_loop()))
+        try:
+            while True:
+                op, body = await self._read_packet()
+                if _drop(self.broker, op):
+                    continue
+                self.broker.stats["rx"] += 1
+                self.handle(op, body)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.broker.sessions.discard(self)
+            for t in self.tasks:
+                t.cancel()
+            self.writer.close()
+
+    def handle(self, op, body):
+        b = self.broker
+        kind = op & 0xF0
+        if kind == 0x10:
+            # protocol name, level, flags, keepalive, then client id
+            n = struct.unpack_from("!H", body, 0)[0]
+            flags = body[2 + n + 1]
+            i = 2 + n + 4
+            n = struct.unpack_from("!H", body, i)[0]
+            self.client_id = bytes(body[i + 2 : i + 2 + n])
+            clean = flags & 2
+            present = 0
+            if clean:
+                b.states.pop(self.client_id, None)
+            elif self.client_id in b.states:
+                self.state = b.states[self.client_id]
+                present = 1
+            else:
+                b.states[self.client_id] = self.state
+            for s in list(b.sessions):
+                if s is not self and s.client_id == self.client_id:
+                    s.writer.close()
+            b.stats["connects"] += 1
+            self.send(bytes((0x20, 2, present, 0)))
+            for pid, m in list(self.state.outbound.items()):
+                self._resend(pid, m)
+        elif kind == 0x30:
+            qos = op >> 1 & 3
+            n = struct.unpack_from("!H", body, 0)[0]
+            topic = bytes(body[2 : 2 + n])
+            i = 2 + n
+            if qos:
+                pid = body[i : i + 2]
+                i += 2
+            if qos < 2 or pid not in self.state.inbound:
+                b.stats["publish"] += 1
+                b.route(topic, bytes(body[i:]), qos)
+            if qos == 1:
+                self.send(b"\x40\x02" + pid)
+            elif qos == 2:
+                self.state.inbound.add(pid)
+                self.send(b"\x50\x02" + pid)
+        elif kind == 0x60:
+            self.state.inbound.discard(bytes(body[:2]))
+            self.send(b"\x70\x02" + body[:2])
+        elif kind in (0x40, 0x50, 0x70):
+            pid = struct.unpack_from("!H", body, 0)[0]
+            m = self.state.outbound.get(pid)
+            if kind == 0x50:
+                if m is not None:
+                    m[1] = 0x70
+                    m[2] = asyncio.get_running_loop().time()
+                self.send(b"\x62\x02" + body[:2])
+            elif m is not None and m[1] == kind:
+                del self.state.outbound[pid]
+        elif kind == 0x80:
+            pid = body[:2]
+            i = 2
+            codes = bytearray()
+            while i < len(body):
+                n = struct.unpack_from("!H", body, i)[0]
+                flt = bytes(body[i + 2 : i + 2 + n])
+                qos = body[i + 2 + n] & 3
+                self.subs[flt] = qos
+                codes.append(qos)
+                i += 3 + n
+            self.send(b"\x90" + encode_len(2 + len(codes)) + pid + codes)
+        elif kind == 0xC0:
+            self.send(b"\xd0\x00")
+        elif kind == 0xE0:
+            self.writer.close()
+
+
+class Broker:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, loss=0.0, retry=0.0, seed=1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.loss = loss
+        self.retry = retry
+        self.rng = random.Random(seed)
+        self.block = set()
+        self.sessions = set()
+        self.states = {}
+        self.server = None
+        self.loop = None
+        self.stats = {"connects": 0, "publish": 0, "delivered": 0, "rx": 0, "tx": 0, "dropped": 0}
+        self.routed = []
+
+    def route(self, topic, msg, qos):
+        self.routed.append((topic, msg))
+        for s in list(self.sessions):
+            if any(topic_matches(f, topic) for f in s.subs):
+                s.deliver(topic, msg, qos)
+
+    async def _client(self, reader, writer):
+        s = Session(self, reader, writer)
+        self.sessions.add(s)
+        await s.run()
+
+    # Drop every connection, as a broker restart or Wi-Fi outage would.
+    # Call on the broker's loop: broker.loop.call_soon_threadsafe(broker.kick)
+    def kick(self):
+        for s in list(self.sessions):
+            s.writer.close()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for s in list(self.sessions):
+            s.writer.close()
+        await self.server.wait_closed()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class BrokerThread:
+    # Runs a Broker on its own event loop so blocking clients can use it.
+    def __init__(self, **kw):
+        self.broker = Broker(**kw)
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.broker.start())
+        self._ready.set()
+        self.loop.run_forever()
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait()
+        return self.broker
+
+    def __exit__(self, *exc):
+        fut = asyncio.run_coroutine_threadsafe(self.broker.stop(), self.loop)
+        fut.result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+
+
+async def _serve(args):
+    b = Broker(args.host, args.port, args.latency_ms / 1000, args.loss, args.retry_ms / 1000)
+    await b.start()
+    print("MQTT broker stand-in on %s:%d" % (b.host, b.port))
+    try:
+        while True:
+            await asyncio.sleep(args.stats or 3600)
+            if args.stats:
+                print(b.stats)
+    finally:
+        await b.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--latency-ms", type=float, default=0)
+    ap.add_argument("--loss", type=float, default=0)
+    ap.add_argument("--retry-ms", type=float, default=0)
+    ap.add_argument("--stats", type=float, default=0, help="print stats every N seconds")
+    try:
+        asyncio.run(_serve(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
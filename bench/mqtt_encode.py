@@ -0,0 +1,152 @@
+# Writes and heap use per PUBLISH: legacy multi-write encoder vs the
+# single-write encoder in simple_umqtt.
+#
+#   python bench/mqtt_encode.py [--count 20000]
+#
+# Frames go to a counting sink rather than a socket, so "writes" is the
+# number of sock.write calls (each a potential TCP segment on lwIP).
+# Then writes per frame for larger payloads: one up to 1 KB frames.
+# Heap use is total gc.mem_alloc() growth per message under MicroPython.
+# CPython can only report the tracemalloc peak less that of an empty call,
+# which hides how many short-lived objects the legacy path creates and
+# still counts the slice objects CPython makes for buf[i:j] = ...;
+# MicroPython 1.23+ subscripts built-in buffers without allocating.
+import argparse
+import gc
+import struct
+import time
+
+import upy_host
+from simple_umqtt import MQTTClient
+
+TOPIC = b"sensors/gps"
+PAYLOAD = b'{"fleetNo": "SM-002", "latitude": -1.2921, "longitude": 36.8219}'
+
+
+class Sink:
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, buf, n=None):
+        n = len(buf) if n is None else n
+        self.writes += 1
+        self.bytes += n
+        return n
+
+
+class LegacyClient:
+    # The encoder simple_umqtt.publish() used before the single-write change
+    def __init__(self, sock):
+        self.sock = sock
+        self.pid = 0
+
+    def _send_str(self, s):
+        self.sock.write(struct.pack("!H", len(s)))
+        self.sock.write(s)
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        pkt = bytearray(b"\x30\0\0\0")
+        pkt[0] |= qos << 1 | retain
+        sz = 2 + len(topic) + len(msg)
+        if qos > 0:
+            sz += 2
+        i = 1
+        while sz > 0x7F:
+            pkt[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        self.sock.write(pkt, i + 1)
+        self._send_str(topic)
+        if qos > 0:
+            self.pid += 1
+            struct.pack_into("!H", pkt, 0, self.pid)
+            self.sock.write(pkt, 2)
+        self.sock.write(msg)
+
+
+def new_client(sock):
+    c = MQTTClient(b"bench", "127.0.0.1")
+    c.sock = sock
+    return c
+
+
+def _nop():
+    pass
+
+
+def heap_per_call(fn, count):
+    if hasattr(gc, "mem_alloc"):
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(count):
+            fn()
+        used = gc.mem_alloc() - before
+        gc.enable()
+        return used / count
+    import tracemalloc
+
+    def peak(f):
+        f()
+        base = tracemalloc.get_traced_memory()[0]
+        total = 0
+        for _ in range(count):
+            tracemalloc.reset_peak()
+            f()
+            total += tracemalloc.get_traced_memory()[1] - base
+        return total / count
+
+    tracemalloc.start()
+    used = peak(fn) - peak(_nop)
+    tracemalloc.stop()
+    return used
+
+
+def run(name, make, qos, count):
+    sink = Sink()
+    c = make(sink)
+    # qos 1 is timed on the encoder alone, without waiting for a PUBACK
+    pid = [0]
+
+    def pub():
+        if isinstance(c, MQTTClient):
+            pid[0] = pid[0] % 65535 + 1
+            c._send_publish(TOPIC, PAYLOAD, False, qos, pid[0])
+        else:
+            c.publish(TOPIC, PAYLOAD, qos=qos)
+
+    t0 = time.perf_counter()
+    for _ in range(count):
+        pub()
+    us = (time.perf_counter() - t0) / count * 1e6
+    writes = sink.writes / count
+    heap = heap_per_call(pub, min(count, 2000))
+    kind = "heap" if hasattr(gc, "mem_alloc") else "peak"
+    print("%-8s qos%d  %4.1f writes/msg  %6.1f %s B/msg  %6.2f us/msg" % (name, qos, writes, heap, kind, us))
+
+
+def sizes():
+    sink = Sink()
+    c = new_client(sink)
+    got = []
+    for n in (100, 200, 1006, 1007, 4000):
+        sink.writes = 0
+        c._send_publish(TOPIC, b"x" * n, False, 1, 1)
+        got.append("%d B %d" % (n, sink.writes))
+    print("writes per frame by payload: " + ", ".join(got))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=20000)
+    args = ap.parse_args()
+    for qos in (0, 1):
+        run("legacy", LegacyClient, qos, args.count)
+        run("single", new_client, qos, args.count)
+    sizes()
+
+
+if __name__ == "__main__":
+    main()
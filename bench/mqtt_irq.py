@@ -0,0 +1,177 @@
+# Button presses published from interrupt context through
+# umqtt_irq.IRQPublisher.
+#
+#   python bench/mqtt_irq.py [--presses 2000] [--buttons 4] [--slots 8]
+#
+# Host threads stand in for the Pin.irq handlers of iot/5_mqtt_publish.py
+# while the main loop drains the ring with pub.check_msg(). They cannot
+# reproduce an interrupt landing half way through a socket write, so this
+# checks the accounting instead: every post() is published, coalesced or
+# dropped, and the broker stand-in sees exactly the published ones.
+#
+#   bounce  each press posts 3 times back to back, presses 2 ms apart
+#   flood   presses as fast as the threads can post, to overrun the ring
+#   outage  presses while the broker is unreachable, with the main loop
+#           of iot/5 catching OSError until the keepalive reconnects
+#   repeat  the same press twice with room in the ring (both published),
+#           and once more while drain() is sending the first
+#
+# Heap per post() is only meaningful under MicroPython (see
+# mqtt_encode.py), where it should be 0.
+import argparse
+import gc
+import sys
+import threading
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+from mqtt_encode import heap_per_call
+
+from simple_umqtt import MQTTClient
+from umqtt_irq import IRQPublisher
+
+TOPIC = b"SunFounder MQTT Test"
+
+
+def run(broker, name, buttons, presses, slots, bounce, gap):
+    broker.routed.clear()
+    c = MQTTClient(name.encode(), "127.0.0.1", broker.port)
+    c.connect()
+    pub = IRQPublisher(c, slots=slots)
+
+    def press(b):
+        msg = b"button %d is pressed" % b
+        for _ in range(presses // buttons):
+            for _ in range(bounce):
+                pub.post(TOPIC, msg)
+            time.sleep(gap)
+
+    threads = [threading.Thread(target=press, args=(b + 1,)) for b in range(buttons)]
+    for t in threads:
+        t.start()
+    while any(t.is_alive() for t in threads):
+        pub.check_msg()
+    pub.check_msg()
+    t = time.time()
+    while len(broker.routed) < pub.posted and time.time() - t < 2:
+        time.sleep(0.01)
+    posts = presses // buttons * buttons * bounce
+    ok = len(broker.routed) == pub.posted and pub.posted + pub.coalesced + pub.dropped == posts
+    print(
+        "%-6s %5d posts: %5d published, %5d coalesced, %5d dropped, broker saw %5d  %s"
+        % (name, posts, pub.posted, pub.coalesced, pub.dropped, len(broker.routed), "ok" if ok else "FAIL")
+    )
+    c.disconnect()
+    return ok
+
+
+def outage(broker, presses):
+    broker.routed.clear()
+    c = MQTTClient(b"outage", "127.0.0.1", broker.port, keepalive=1)
+    c.ping_timeout_ms = 200
+    c.connect()
+    pub = IRQPublisher(c)
+    broker.block = {op << 4 for op in range(1, 15)}
+    while c.sock is not None:
+        pub.check_msg()
+        time.sleep(0.01)
+    for b in range(presses):
+        pub.post(TOPIC, b"button %d is pressed" % (b + 1))
+    errors = 0
+    t = time.time()
+    while (time.time() - t < 0.5 or c.sock is None or pub.pending()) and time.time() - t < 10:
+        if time.time() - t >= 0.5:
+            broker.block = set()
+        try:
+            pub.check_msg()
+        except OSError:
+            errors += 1
+        time.sleep(0.01)
+    t = time.time()
+    while len(broker.routed) < presses and time.time() - t < 2:
+        time.sleep(0.01)
+    ok = len(broker.routed) == presses
+    print(
+        "outage %5d posts while down: %d reconnects, %d errors caught, broker saw %5d  %s"
+        % (presses, c.reconnects, errors, len(broker.routed), "ok" if ok else "FAIL")
+    )
+    c.disconnect()
+    return ok
+
+
+# Stands in for the client, posting from "interrupt context" while
+# publish() is in progress
+class _Client:
+    sock = True
+    pid = 0
+
+    def __init__(self):
+        self.sent = []
+        self.during = None
+
+    def publish(self, topic, msg, retain, qos):
+        self.sent.append(bytes(msg))
+        if self.during:
+            f, self.during = self.during, None
+            f()
+
+
+def repeat():
+    msg = b"button 1 is pressed"
+    c = _Client()
+    pub = IRQPublisher(c)
+    pub.post(TOPIC, msg)
+    pub.post(TOPIC, msg)
+    queued = pub.pending()
+    c.during = lambda: pub.post(TOPIC, msg)
+    pub.drain()
+    pub.drain()
+    # A one-slot ring is full while its only message is being sent
+    one = IRQPublisher(c, slots=1)
+    one.post(TOPIC, msg)
+    c.during = lambda: one.post(TOPIC, msg)
+    one.drain()
+    ok = queued == 2 and pub.coalesced == 0 and len(c.sent) == 4 and one.coalesced == 0 and one.dropped == 1
+    print(
+        "repeat 2 posts with room: %d queued, %d coalesced; 1 more during drain(): %d published in all; "
+        "1-slot ring: %d coalesced into the message being sent  %s"
+        % (queued, pub.coalesced, len(c.sent) - 1, one.coalesced, "ok" if ok else "FAIL")
+    )
+    return ok
+
+
+def post_cost():
+    pub = IRQPublisher(None)
+    msg = b"button 1 is pressed"
+
+    def post():
+        pub._tail = pub._head
+        pub.post(TOPIC, msg)
+
+    t0 = time.perf_counter()
+    for _ in range(10000):
+        post()
+    us = (time.perf_counter() - t0) / 10000 * 1e6
+    kind = "heap" if hasattr(gc, "mem_alloc") else "peak"
+    print("post() %.2f us/call  %.1f %s B/call" % (us, heap_per_call(post, 2000), kind))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--presses", type=int, default=2000)
+    ap.add_argument("--buttons", type=int, default=4)
+    ap.add_argument("--slots", type=int, default=8)
+    args = ap.parse_args()
+    ok = True
+    with BrokerThread() as broker:
+        ok &= run(broker, "bounce", args.buttons, args.presses // 4, args.slots, 3, 0.002)
+        ok &= run(broker, "flood", args.buttons, args.presses, args.slots, 1, 0)
+        ok &= outage(broker, min(args.slots, 4))
+    ok &= repeat()
+    post_cost()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
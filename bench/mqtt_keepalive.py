@@ -0,0 +1,144 @@
+# Keepalive engine in simple_umqtt: pings sent by an idle and by a busy
+# client, and how long a connection that stops answering takes to be
+# detected and restored.
+#
+#   python bench/mqtt_keepalive.py [--keepalive 2] [--latency 0.02]
+#
+# The dead link is a black hole: the broker stand-in drops every packet in
+# both directions, so the socket stays open and only missed PINGRESPs can
+# reveal it. It is lifted after the reconnect attempts have started, and
+# the client must be subscribed again to receive the next message.
+#
+# Then the broker closes the connection instead: check_msg() must return
+# None, not raise, while the client notices the EOF and reconnects.
+import argparse
+import sys
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+
+from simple_umqtt import MQTTClient
+
+TOPIC = b"plant/cmd"
+ALL = {op << 4 for op in range(1, 15)}
+
+
+def loop(c, secs, every=None):
+    t = time.time()
+    n = 0
+    while time.time() - t < secs:
+        if every and time.time() - t >= n * every:
+            c.publish(b"plant/moisture", b"41", qos=1)
+            n += 1
+        c.check_msg()
+        time.sleep(0.01)
+
+
+def client(broker, name, keepalive, timeout_ms):
+    c = MQTTClient(name, "127.0.0.1", broker.port, keepalive=keepalive)
+    c.ping_timeout_ms = timeout_ms
+    return c
+
+
+def idle(broker, keepalive, timeout_ms):
+    for name, every in (("idle", None), ("busy", 0.1)):
+        c = client(broker, name.encode(), keepalive, timeout_ms)
+        c.connect()
+        loop(c, keepalive * 2, every)
+        print("%-5s %d pings in %ds  last rtt %d ms" % (name, c.pings, keepalive * 2, c.last_rtt))
+        c.disconnect()
+
+
+def dead_link(broker, keepalive, timeout_ms):
+    got = []
+    c = client(broker, b"sub", keepalive, timeout_ms)
+    c.set_callback(lambda t, m: got.append(bytes(m)))
+    c.connect()
+    c.subscribe(TOPIC)
+    loop(c, 0.2)
+    broker.block = ALL
+    t0 = time.time()
+    while c.sock is not None:
+        c.check_msg()
+        time.sleep(0.01)
+    detected = time.time() - t0
+    # Until it is restored, publishing fails as a network error would
+    lost_ok = True
+    for f in (lambda: c.publish(b"plant/moisture", b"41", qos=1), c.ping):
+        try:
+            f()
+            lost_ok = False
+        except OSError:
+            pass
+    lost_ok = lost_ok and not c.inflight()
+    loop(c, timeout_ms / 1000 * 1.5)
+    broker.block = set()
+    while not c.reconnects:
+        c.check_msg()
+        time.sleep(0.01)
+    restored = time.time() - t0
+    pub = MQTTClient(b"pub", "127.0.0.1", broker.port)
+    pub.connect()
+    pub.publish(TOPIC, b"water")
+    pub.disconnect()
+    t = time.time()
+    while not got and time.time() - t < 2:
+        c.check_msg()
+    bound = keepalive / 2 + c.max_missed * timeout_ms / 1000
+    print(
+        "dead link detected in %.2fs (bound %.2fs), restored after %.2fs, %d misses, "
+        "publish while down %s, resubscribed %s"
+        % (detected, bound, restored, c.ping_misses, "OSError" if lost_ok else "FAIL", "ok" if got == [b"water"] else "FAIL")
+    )
+    c.disconnect()
+    return detected <= bound + 0.2 and lost_ok and got == [b"water"]
+
+
+def eof(broker, keepalive, timeout_ms):
+    got = []
+    c = client(broker, b"sub", keepalive, timeout_ms)
+    c.set_callback(lambda t, m: got.append(bytes(m)))
+    c.connect()
+    c.subscribe(TOPIC)
+    loop(c, 0.2)
+    broker.loop.call_soon_threadsafe(broker.kick)
+    t0 = time.time()
+    raised = 0
+    while not c.reconnects and time.time() - t0 < keepalive * 4:
+        try:
+            c.check_msg()
+        except OSError:
+            raised += 1
+        time.sleep(0.01)
+    restored = time.time() - t0
+    pub = MQTTClient(b"pub", "127.0.0.1", broker.port)
+    pub.connect()
+    pub.publish(TOPIC, b"water")
+    pub.disconnect()
+    t = time.time()
+    while not got and time.time() - t < 2:
+        c.check_msg()
+    print(
+        "broker closed the connection: restored after %.2fs, check_msg raised %d times, resubscribed %s"
+        % (restored, raised, "ok" if got == [b"water"] else "FAIL")
+    )
+    c.disconnect()
+    return c.reconnects and not raised and restored <= timeout_ms / 1000 + 0.2 and got == [b"water"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keepalive", type=int, default=2)
+    ap.add_argument("--timeout-ms", type=int, default=500)
+    ap.add_argument("--latency", type=float, default=0.02)
+    args = ap.parse_args()
+    with BrokerThread(latency=args.latency) as broker:
+        idle(broker, args.keepalive, args.timeout_ms)
+        ok = dead_link(broker, args.keepalive, args.timeout_ms)
+        ok = eof(broker, args.keepalive, args.timeout_ms) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Load generator for simple_umqtt: N simulated devices replaying the
+# training/mqqt.py publishRoute pattern against the broker stand-in.
+#
+#   python bench/mqtt_loadgen.py [--devices 20] [--duration 10]
+#       [--interval-ms 50] [--qos 1] [--latency-ms 2] [--loss 0]
+#       [--kick-every 0] [--keepalive 0] [--broker HOST:PORT]
+#
+# Each device is a blocking MQTTClient on its own thread that walks a
+# route of GPS stages, publishing a JSON fix per stage every --interval-ms
+# (publishRoute waits 60 s) and reversing at the end. A monitor client
+# subscribed to sensors/# timestamps arrivals, giving end-to-end latency.
+# --kick-every drops every connection periodically, and --loss drops
+# packets, to exercise reconnects and retransmission. Run it before and
+# after a client change and compare the summary line.
+import argparse
+import json
+import sys
+import threading
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+
+from simple_umqtt import MQTTClient
+
+TOPIC = b"sensors/gps"
+
+
+def route(n, stages=12):
+    # A straight run of stages out of Nairobi, offset per device
+    return [(-1.2921 + 0.002 * i + 0.0001 * n, 36.8219 + 0.003 * i) for i in range(stages)]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.published = 0
+        self.delivered = 0
+        self.latency = []
+        self.reconnects = 0
+        self.errors = 0
+
+
+def connect(c, stop):
+    while not stop.is_set():
+        try:
+            c.connect()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def device(n, host, port, args, st, stop):
+    c = MQTTClient(b"SM-%03d" % n, host, port, keepalive=args.keepalive, window=args.window, retry_ms=200)
+    if not connect(c, stop):
+        return
+    stages = route(n)
+    seq = 0
+    while not stop.is_set():
+        for lat, lon in stages:
+            if stop.is_set():
+                break
+            payload = json.dumps({"fleetNo": "SM-%03d" % n, "latitude": lat, "longitude": lon, "seq": seq}).encode()
+            with st.lock:
+                st.sent[payload] = time.perf_counter()
+            try:
+                c.publish(TOPIC, payload, qos=args.qos)
+                c.check_msg()
+                with st.lock:
+                    st.published += 1
+            except OSError:
+                with st.lock:
+                    st.errors += 1
+                    st.reconnects += 1
+                connect(c, stop)
+            seq += 1
+            time.sleep(args.interval_ms / 1000)
+        stages.reverse()
+    st.reconnects += c.reconnects
+    try:
+        c.flush()
+        c.disconnect()
+    except OSError:
+        pass
+
+
+def monitor(host, port, args, st, stop, ready):
+    def cb(topic, msg):
+        now = time.perf_counter()
+        with st.lock:
+            t = st.sent.pop(bytes(msg), None)
+            if t is not None:
+                st.delivered += 1
+                st.latency.append(now - t)
+
+    c = MQTTClient(b"monitor", host, port, keepalive=args.keepalive)
+    c.set_callback(cb)
+    while not stop.is_set():
+        if not connect(c, stop):
+            break
+        try:
+            c.subscribe(b"sensors/#", args.qos)
+            ready.set()
+            while not stop.is_set():
+                if c.check_msg() is None:
+                    time.sleep(0.001)
+        except OSError:
+            with st.lock:
+                st.reconnects += 1
+    try:
+        c.disconnect()
+    except OSError:
+        pass
+
+
+def run(host, port, args, broker=None):
+    st = Stats()
+    stop = threading.Event()
+    ready = threading.Event()
+    mon = threading.Thread(target=monitor, args=(host, port, args, st, stop, ready))
+    mon.start()
+    ready.wait(5)
+    devs = [threading.Thread(target=device, args=(n, host, port, args, st, stop)) for n in range(args.devices)]
+    t0 = time.perf_counter()
+    for d in devs:
+        d.start()
+    next_kick = args.kick_every
+    while time.perf_counter() - t0 < args.duration:
+        time.sleep(0.05)
+        if broker and args.kick_every and time.perf_counter() - t0 >= next_kick:
+            broker.loop.call_soon_threadsafe(broker.kick)
+            next_kick += args.kick_every
+    stop.set()
+    for d in devs:
+        d.join()
+    elapsed = time.perf_counter() - t0
+    time.sleep(0.3)
+    stop.set()
+    mon.join()
+    lat = st.latency
+    print(
+        "%d devices, qos %d, %.0f s: %d published, %d delivered, %.0f msg/s, "
+        "p50 %.2f ms, p99 %.2f ms, %d reconnects, %d publish errors"
+        % (
+            args.devices,
+            args.qos,
+            elapsed,
+            st.published,
+            st.delivered,
+            st.delivered / elapsed,
+            upy_host.percentile(lat, 50) * 1000,
+            upy_host.percentile(lat, 99) * 1000,
+            st.reconnects,
+            st.errors,
+        )
+    )
+    return st
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--interval-ms", type=float, default=50)
+    ap.add_argument("--qos", type=int, default=1)
+    ap.add_argument("--window", type=int, default=1)
+    ap.add_argument("--keepalive", type=int, default=0)
+    ap.add_argument("--latency-ms", type=float, default=2)
+    ap.add_argument("--loss", type=float, default=0)
+    ap.add_argument("--kick-every", type=float, default=0)
+    ap.add_argument("--broker", help="HOST:PORT of a running broker instead of the stand-in")
+    args = ap.parse_args()
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        run(host, int(port), args)
+        return
+    retry = 0.2 if args.loss else 0
+    with BrokerThread(latency=args.latency_ms / 1000, loss=args.loss, retry=retry) as broker:
+        st = run("127.0.0.1", broker.port, args, broker)
+        print("broker stats:", broker.stats)
+    sys.exit(0 if st.delivered else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Offline publish queue: enqueue and drain rate of umqtt_queue.PublishQueue
+# on the host filesystem, and a broker outage that loses nothing.
+#
+#   python bench/mqtt_offline_queue.py [--count 5000] [--size 16384]
+#
+# "index/put" is how often the pointer index is rewritten per enqueue,
+# which is what `sync` trades against the number of records that must be
+# rescanned on load. Drain is timed against the broker stand-in with
+# interval_ms=0 so only the batch size limits it.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+
+from simple_umqtt import MQTTClient
+from umqtt_queue import PublishQueue
+
+TOPIC = b"plant/moisture"
+
+
+def payload(i):
+    return b'{"n": %d, "moisture": 41.5, "temp": 23.1}' % i
+
+
+def enqueue(path, count, size, sync):
+    q = PublishQueue(path, size=size, sync=sync)
+    gen = q._gen
+    t0 = time.perf_counter()
+    for i in range(count):
+        q.put(TOPIC, payload(i))
+    elapsed = time.perf_counter() - t0
+    idx = (q._gen - gen) / count
+    # Reopen without close(), as after a power cut: the records appended
+    # since the last index write must be found again by the scan.
+    kept, dropped = len(q), q.dropped
+    last = q.peek(kept)[-1][1]
+    q2 = PublishQueue(path, size=size, sync=sync)
+    ok = len(q2) == kept and q2.peek(kept)[-1][1] == last
+    q2.close()
+    print(
+        "enqueue sync=%-3d %8.0f put/s  %5.3f index/put  kept %d dropped %d  reload %s"
+        % (sync, count / elapsed, idx, kept, dropped, "ok" if ok else "FAIL")
+    )
+    return ok
+
+
+def drain(broker, path, count, batch):
+    broker.routed.clear()
+    q = PublishQueue(path, size=count * 96, batch=batch, interval_ms=0)
+    for i in range(count):
+        q.put(TOPIC, payload(i), qos=1)
+    c = MQTTClient(b"drain", "127.0.0.1", broker.port, window=16, queue=q)
+    c.connect()
+    t0 = time.perf_counter()
+    while len(q):
+        c.check_msg()
+    c.flush()
+    elapsed = time.perf_counter() - t0
+    c.disconnect()
+    q.close()
+    ok = [m for t, m in broker.routed] == [payload(i) for i in range(count)]
+    print("drain   batch=%-3d %8.0f msg/s  in order %s" % (batch, count / elapsed, "ok" if ok else "FAIL"))
+    return ok
+
+
+def outage(broker, path, count):
+    broker.routed.clear()
+    q = PublishQueue(path, size=count * 96, batch=8, interval_ms=0)
+    c = MQTTClient(b"outage", "127.0.0.1", broker.port, queue=q)
+    c.connect()
+    for i in range(count):
+        if i == count // 4:
+            c.sock.close()  # link drops: the next publish fails and is queued
+        c.publish(TOPIC, payload(i))
+    queued = len(q)
+    c.connect()
+    while len(q):
+        c.check_msg()
+    c.disconnect()
+    q.close()
+    ok = sorted(m for t, m in broker.routed) == sorted(payload(i) for i in range(count))
+    print("outage  %d queued while down, all %d routed after reconnect: %s" % (queued, count, "ok" if ok else "FAIL"))
+    return ok
+
+
+# The link drops half way through a batch of QoS 2 publishes: after
+# reconnect each must reach the broker once, either resent from flight
+# or drained from the queue, not both.
+def cut(broker, path):
+    broker.routed.clear()
+    q = PublishQueue(path, batch=8, interval_ms=0)
+    for i in range(8):
+        q.put(TOPIC, payload(i), qos=2)
+    c = MQTTClient(b"cut", "127.0.0.1", broker.port, window=16, queue=q)
+    c.connect(clean_session=False)
+    send = c._send_publish
+    sent = []
+
+    def send_cut(*a):
+        if len(sent) == 3:
+            c.sock.close()
+        sent.append(a)
+        send(*a)
+
+    c._send_publish = send_cut
+    c.drain()
+    c._send_publish = send
+    c.connect(clean_session=False)
+    while len(q) or c.inflight():
+        c.check_msg()
+    c.disconnect()
+    q.close()
+    ok = sorted(m for t, m in broker.routed) == sorted(payload(i) for i in range(8))
+    print("cut     batch of 8 QoS 2 cut after 3, %d routed (8 expected): %s" % (len(broker.routed), "ok" if ok else "FAIL"))
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=5000)
+    ap.add_argument("--size", type=int, default=16384)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    ok = True
+    for sync in (1, 8, 32):
+        ok &= enqueue(os.path.join(tmp, "q%d" % sync), args.count, args.size, sync)
+    with BrokerThread() as broker:
+        for batch in (1, 8, 32):
+            ok &= drain(broker, os.path.join(tmp, "d%d" % batch), min(args.count, 2000), batch)
+        ok &= cut(broker, os.path.join(tmp, "cut"))
+        ok &= outage(broker, os.path.join(tmp, "outage"), 400)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
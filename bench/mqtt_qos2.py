@@ -0,0 +1,208 @@
+# QoS 2 exactly-once checks for simple_umqtt against the broker stand-in.
+#
+#   python bench/mqtt_qos2.py [--count 200] [--loss 0.2]
+#
+# Each scenario drops packets (at random, or a chosen handshake step) and
+# checks every message is routed by the broker, or delivered to the
+# subscriber callback, exactly once. "Reboots" abandon the client without
+# a DISCONNECT and build a new one on the same umqtt_store file.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+
+from simple_umqtt import MQTTClient
+from umqtt_store import InflightStore
+
+TOPIC = b"plant/pump"
+
+
+def msgs(n):
+    return [b"pump %d" % i for i in range(n)]
+
+
+def drain(c, until, timeout=10):
+    t = time.time()
+    while not until():
+        if time.time() - t > timeout:
+            raise AssertionError("timed out")
+        c.check_msg()
+        time.sleep(0.001)
+
+
+def crash(c):
+    c.sock.close()
+    c.store.close()
+
+
+def check(name, got, want):
+    ok = sorted(got) == sorted(want)
+    print("%-40s %s  (%d/%d)" % (name, "PASS" if ok else "FAIL", len(got), len(want)))
+    return ok
+
+
+def lossy_publish(broker, n, loss):
+    broker.loss = loss
+    broker.routed.clear()
+    c = MQTTClient(b"pub-lossy", "127.0.0.1", broker.port, window=8, retry_ms=50)
+    c.connect()
+    for m in msgs(n):
+        c.publish(TOPIC, m, qos=2)
+    c.flush()
+    c.disconnect()
+    broker.loss = 0
+    return check("outbound, %d%% loss" % (loss * 100), [m for t, m in broker.routed], msgs(n))
+
+
+def lossy_subscribe(broker, n, loss):
+    got = []
+    sub = MQTTClient(b"sub-lossy", "127.0.0.1", broker.port)
+    sub.set_callback(lambda t, m: got.append(m), copy=True)
+    sub.connect()
+    sub.subscribe(TOPIC, qos=2)
+    broker.loss = loss
+    pub = MQTTClient(b"pub-lossy2", "127.0.0.1", broker.port, window=8, retry_ms=50)
+    pub.connect()
+    for m in msgs(n):
+        pub.publish(TOPIC, m, qos=2)
+        sub.check_msg()
+    pub.flush()
+    drain(sub, lambda: len(got) >= n)
+    # let the broker's retries settle, then make sure nothing came twice
+    t = time.time()
+    while time.time() - t < 0.5:
+        sub.check_msg()
+    broker.loss = 0
+    pub.disconnect()
+    sub.disconnect()
+    return check("inbound, %d%% loss" % (loss * 100), got, msgs(n))
+
+
+# More messages than the store has slots, with a window asking for more:
+# the client waits for slots instead of failing or dropping the link.
+def small_store(broker, path, n, loss):
+    broker.loss = loss
+    broker.routed.clear()
+    c = MQTTClient(b"pub-small", "127.0.0.1", broker.port, window=8, retry_ms=50, store=InflightStore(path, slots=2))
+    c.connect(clean_session=False)
+    for m in msgs(n):
+        c.publish(TOPIC, m, qos=2)
+    c.flush()
+    up = c.sock is not None and c.window == 2
+    c.disconnect()
+    c.store.close()
+    broker.loss = 0
+    return check("outbound, 2-slot store, window 8", [m for t, m in broker.routed], msgs(n)) and up
+
+
+def reboot_publisher(broker, path, block):
+    broker.routed.clear()
+    broker.block = {block}
+    c = MQTTClient(b"pub-reboot", "127.0.0.1", broker.port, window=16, store=InflightStore(path, slots=16))
+    c.connect(clean_session=False)
+    for m in msgs(8):
+        c.publish(TOPIC, m, qos=2)
+    time.sleep(0.1)
+    while c._poll.poll(0):
+        c.wait_msg()
+    crash(c)
+    broker.block = set()
+    c = MQTTClient(b"pub-reboot", "127.0.0.1", broker.port, window=16, store=InflightStore(path, slots=16))
+    pending = c.inflight()
+    c.connect(clean_session=False)
+    c.flush()
+    left = len(c.store.load())
+    c.disconnect()
+    c.store.close()
+    name = "publisher reboot, %s lost (%d resumed)" % ("PUBREC" if block == 0x50 else "PUBCOMP", pending)
+    return check(name, [m for t, m in broker.routed], msgs(8)) and left == 0
+
+
+def reboot_subscriber(broker, path):
+    got = []
+    cb = lambda t, m: got.append(m)
+    sub = MQTTClient(b"sub-reboot", "127.0.0.1", broker.port, store=InflightStore(path))
+    sub.set_callback(cb, copy=True)
+    sub.connect(clean_session=False)
+    sub.subscribe(TOPIC, qos=2)
+    # The broker never hears the PUBREC, so it will resend every PUBLISH
+    broker.block = {0x50}
+    pub = MQTTClient(b"pub-sub-reboot", "127.0.0.1", broker.port, window=16)
+    pub.connect()
+    for m in msgs(8):
+        pub.publish(TOPIC, m, qos=2)
+    drain(sub, lambda: len(got) >= 8)
+    crash(sub)
+    broker.block = set()
+    sub = MQTTClient(b"sub-reboot", "127.0.0.1", broker.port, store=InflightStore(path))
+    sub.set_callback(cb, copy=True)
+    sub.connect(clean_session=False)
+    pub.flush()
+    drain(sub, lambda: not broker.states[b"sub-reboot"].outbound)
+    left = len(sub.store.load())
+    sub.disconnect()
+    sub.store.close()
+    pub.disconnect()
+    return check("subscriber reboot, PUBREC lost", got, msgs(8)) and left == 0
+
+
+# The subscriber resets inside its callback, before the PUBREC is sent;
+# the broker's resend after reboot must not reach the callback again.
+def reboot_in_callback(broker, path):
+    got = []
+
+    def cb(t, m):
+        got.append(m)
+        if len(got) == 3:
+            raise KeyboardInterrupt  # the reset
+
+    sub = MQTTClient(b"sub-cb", "127.0.0.1", broker.port, store=InflightStore(path))
+    sub.set_callback(cb, copy=True)
+    sub.connect(clean_session=False)
+    sub.subscribe(TOPIC, qos=2)
+    pub = MQTTClient(b"pub-cb", "127.0.0.1", broker.port, window=16)
+    pub.connect()
+    for m in msgs(8):
+        pub.publish(TOPIC, m, qos=2)
+    try:
+        drain(sub, lambda: len(got) >= 8)
+    except KeyboardInterrupt:
+        pass
+    crash(sub)
+    sub = MQTTClient(b"sub-cb", "127.0.0.1", broker.port, store=InflightStore(path))
+    sub.set_callback(cb, copy=True)
+    sub.connect(clean_session=False)
+    pub.flush()
+    drain(sub, lambda: len(got) >= 8 and not broker.states[b"sub-cb"].outbound)
+    left = len(sub.store.load())
+    sub.disconnect()
+    sub.store.close()
+    pub.disconnect()
+    return check("subscriber reset in callback", got, msgs(8)) and left == 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=200)
+    ap.add_argument("--loss", type=float, default=0.2)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp()
+    ok = True
+    with BrokerThread(retry=0.05) as broker:
+        ok &= lossy_publish(broker, args.count, args.loss)
+        ok &= lossy_subscribe(broker, args.count, args.loss)
+        ok &= reboot_publisher(broker, os.path.join(tmp, "pub1.inf"), 0x50)
+        ok &= reboot_publisher(broker, os.path.join(tmp, "pub2.inf"), 0x70)
+        ok &= reboot_subscriber(broker, os.path.join(tmp, "sub.inf"))
+        ok &= small_store(broker, os.path.join(tmp, "small.inf"), args.count // 4, args.loss)
+        ok &= reboot_in_callback(broker, os.path.join(tmp, "cb.inf"))
+        print("broker stats:", broker.stats)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
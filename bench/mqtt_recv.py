@@ -0,0 +1,115 @@
+# Inbound PUBLISH parsing: legacy read()-per-field path vs the readinto
+# receive buffer in simple_umqtt.MQTTClient.wait_msg.
+#
+#   python bench/mqtt_recv.py [--count 20000] [--payload 48]
+#
+# A socketpair is preloaded with QoS 0 PUBLISH frames and drained with
+# check_msg(), as a subscribed node's main loop does. Reports socket read
+# calls and heap use per message (see mqtt_encode.py for what the heap
+# column means on CPython) and messages per second.
+import argparse
+import socket
+import threading
+import time
+
+import upy_host
+from mqtt_encode import heap_per_call
+from simple_umqtt import MQTTClient, encode_publish_header, publish_header_size
+
+TOPIC = b"sensors/plant/1/moisture"
+
+
+class CountingSocket(upy_host._Socket):
+    reads = 0
+
+    def read(self, n=-1):
+        CountingSocket.reads += 1
+        return super().read(n)
+
+    def readinto(self, buf, n=None):
+        CountingSocket.reads += 1
+        return super().readinto(buf, n)
+
+
+class LegacyClient(MQTTClient):
+    # wait_msg()/_recv_len() as they were before the receive buffer
+    def _recv_len(self):
+        n = 0
+        sh = 0
+        while 1:
+            b = self.sock.read(1)[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return n
+            sh += 7
+
+    def wait_msg(self):
+        res = self.sock.read(1)
+        self.sock.setblocking(True)
+        if res is None:
+            return None
+        if res == b"":
+            raise OSError(-1)
+        op = res[0]
+        if op & 0xF0 != 0x30:
+            return op
+        sz = self._recv_len()
+        topic_len = self.sock.read(2)
+        topic_len = (topic_len[0] << 8) | topic_len[1]
+        topic = self.sock.read(topic_len)
+        sz -= topic_len + 2
+        msg = self.sock.read(sz)
+        self.cb(topic, msg)
+        return op
+
+    def check_msg(self):
+        self.sock.setblocking(False)
+        return self.wait_msg()
+
+
+def frame(payload):
+    buf = bytearray(publish_header_size(TOPIC, len(payload), 0) + len(payload))
+    i = encode_publish_header(buf, TOPIC, len(payload))
+    buf[i:] = payload
+    return bytes(buf)
+
+
+def run(name, cls, count, payload):
+    a, b = socket.socketpair()
+    data = frame(payload) * count
+    feeder = threading.Thread(target=a.sendall, args=(data,), daemon=True)
+    c = cls(b"bench", "127.0.0.1")
+    c.sock = CountingSocket(sock=b)
+    got = [0]
+
+    def cb(topic, msg):
+        got[0] += 1
+
+    c.set_callback(cb)
+    CountingSocket.reads = 0
+    feeder.start()
+    t0 = time.perf_counter()
+    while got[0] < count // 2:
+        c.check_msg()
+    elapsed = time.perf_counter() - t0
+    reads = CountingSocket.reads / got[0]
+    # the rest of the stream is already queued in the socketpair
+    heap = heap_per_call(c.check_msg, count - got[0] - 10)
+    feeder.join()
+    a.close()
+    b.close()
+    print("%-8s %5.2f reads/msg  %6.1f heap B/msg  %8.0f msg/s" % (name, reads, heap, got[0] / elapsed))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=20000)
+    ap.add_argument("--payload", type=int, default=48)
+    args = ap.parse_args()
+    payload = b"x" * args.payload
+    run("legacy", LegacyClient, args.count, payload)
+    run("readinto", MQTTClient, args.count, payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Dispatch rate of umqtt_router.TopicRouter against a linear scan of
+# every filter, for 10k messages across 100 filters.
+#
+#   python bench/mqtt_router.py [--count 10000] [--filters 100] [--topics 500]
+#
+# Filters mix exact topics, + and #. Messages are spread over --topics
+# distinct topics; "trie" is the router with its per-topic cache turned
+# off, "trie+cache" the default. Every dispatcher must call the same
+# handlers as the linear scan.
+import argparse
+import random
+import time
+
+import upy_host
+from mqtt_broker import topic_matches
+
+from umqtt_router import TopicRouter
+
+KINDS = (b"moisture", b"temp", b"humidity", b"light", b"pump")
+
+
+def make_filters(n, rng):
+    out = []
+    while len(out) < n:
+        site = b"site%d" % rng.randrange(10)
+        node = b"node%d" % rng.randrange(20)
+        kind = rng.choice(KINDS)
+        flt = rng.choice(
+            (
+                site + b"/" + node + b"/" + kind,
+                site + b"/+/" + kind,
+                site + b"/" + node + b"/#",
+                b"+/" + node + b"/" + kind,
+                site + b"/#",
+            )
+        )
+        if flt not in out:
+            out.append(flt)
+    return out
+
+
+def make_topics(n, rng):
+    return [
+        b"site%d/node%d/%s" % (rng.randrange(10), rng.randrange(20), rng.choice(KINDS))
+        for _ in range(n)
+    ]
+
+
+class Linear:
+    # What a single set_callback() callback does: test every filter
+    def __init__(self, filters, handlers):
+        self.pairs = list(zip(filters, handlers))
+
+    def dispatch(self, topic, msg):
+        n = 0
+        for flt, h in self.pairs:
+            if topic_matches(flt, topic):
+                h(topic, msg)
+                n += 1
+        return n
+
+
+def run(name, d, msgs, hits):
+    for h in hits:
+        h[0] = 0
+    t0 = time.perf_counter()
+    calls = 0
+    for topic in msgs:
+        calls += d.dispatch(topic, b"42")
+    elapsed = time.perf_counter() - t0
+    print("%-12s %9.0f msg/s  %6.2f handlers/msg" % (name, len(msgs) / elapsed, calls / len(msgs)))
+    return [h[0] for h in hits]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=10000)
+    ap.add_argument("--filters", type=int, default=100)
+    ap.add_argument("--topics", type=int, default=500)
+    args = ap.parse_args()
+    rng = random.Random(7)
+    filters = make_filters(args.filters, rng)
+    topics = make_topics(args.topics, rng)
+    msgs = [rng.choice(topics) for _ in range(args.count)]
+    hits = [[0] for _ in filters]
+
+    def handler(cell):
+        def h(topic, msg):
+            cell[0] += 1
+
+        return h
+
+    handlers = [handler(c) for c in hits]
+    want = run("linear", Linear(filters, handlers), msgs, hits)
+    ok = True
+    for name, cache in (("trie", 0), ("trie+cache", 32), ("trie+cache*", args.topics)):
+        r = TopicRouter(cache=cache)
+        for flt, h in zip(filters, handlers):
+            r.add(flt, h)
+        ok &= run(name, r, msgs, hits) == want
+    print("same handlers called: %s" % ("ok" if ok else "FAIL"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# QoS 1 throughput of simple_umqtt.MQTTClient for several in-flight windows.
+#
+#   python bench/mqtt_window.py [--count 500] [--latency-ms 20] [--windows 1,4,16,64]
+#
+# The broker stand-in delays every packet it sends by --latency-ms, so a
+# window of 1 (stop-and-wait) is capped at roughly one message per RTT.
+import argparse
+import time
+
+import upy_host
+from mqtt_broker import BrokerThread
+
+from simple_umqtt import MQTTClient
+
+TOPIC = b"bench/window"
+PAYLOAD = b'{"temp": 23.5, "hum": 41}'
+
+
+def run(port, count, window):
+    c = MQTTClient(b"window%d" % window, "127.0.0.1", port, window=window)
+    c.connect()
+    t0 = time.perf_counter()
+    for _ in range(count):
+        c.publish(TOPIC, PAYLOAD, qos=1)
+    c.flush()
+    elapsed = time.perf_counter() - t0
+    c.disconnect()
+    return count / elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=500)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--windows", default="1,4,16,64")
+    args = ap.parse_args()
+    with BrokerThread(latency=args.latency_ms / 1000) as broker:
+        print("broker latency %.1f ms, %d QoS 1 publishes" % (args.latency_ms, args.count))
+        base = None
+        for w in [int(x) for x in args.windows.split(",")]:
+            rate = run(broker.port, args.count, w)
+            base = base or rate
+            print("window %-4d %10.0f msg/s   x%.1f" % (w, rate, rate / base))
+        print("broker saw %d publishes" % broker.stats["publish"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Building the iot/7 page per request: the f-string webpage(value) the
+# loop used, against the pre-encoded page_template.Template it serves now.
+#
+#   python bench/page_template.py [--n 20000]
+#
+# For each: time to produce the bytes that go out, and the most memory
+# the call holds above what was in use before it (tracemalloc). The same
+# for the HTTP/1.1 response head HTTPServer writes before the page, built
+# each time and cached. Then both pages are fetched through HTTPServer to
+# check they match.
+import argparse
+import asyncio
+import socket
+import threading
+import time
+import tracemalloc
+
+import upy_host
+import http_server
+from http_server import HTTPServer
+from page_template import Template
+
+HTML = """
+            <!DOCTYPE html>
+            <html>
+            <body>
+            <form action="./red">
+            <input type="submit" value="red " />
+            </form>
+            <form action="./green">
+            <input type="submit" value="green" />
+            </form>
+            <form action="./blue">
+            <input type="submit" value="blue" />
+            </form>
+            <form action="./off">
+            <input type="submit" value="off" />
+            </form>
+            <p>Temperature is {value} degrees Celsius</p>
+            </body>
+            </html>
+            """
+
+
+# iot/7_web_page.py before
+def webpage(value):
+    html = f"""
+            <!DOCTYPE html>
+            <html>
+            <body>
+            <form action="./red">
+            <input type="submit" value="red " />
+            </form>
+            <form action="./green">
+            <input type="submit" value="green" />
+            </form>
+            <form action="./blue">
+            <input type="submit" value="blue" />
+            </form>
+            <form action="./off">
+            <input type="submit" value="off" />
+            </form>
+            <p>Temperature is {value} degrees Celsius</p>
+            </body>
+            </html>
+            """
+    return html
+
+
+PAGE = Template(HTML, value=8)
+
+
+class _Writer:
+    def write(self, b):
+        self.last = b
+
+
+def head(length, writer):
+    r = http_server.Request.__new__(http_server.Request)
+    r.writer = writer
+    r.keep_alive = True
+    r.started = False
+    co = r.start(200, None, length)
+    try:
+        co.send(None)
+    except StopIteration:
+        pass
+    return writer.last
+
+
+def legacy(value, w):
+    return webpage(value).encode()
+
+
+def template(value, w):
+    return PAGE.render(value=value)
+
+
+def head_built(value, w):
+    http_server._heads.clear()
+    return head(593, w)
+
+
+def head_cached(value, w):
+    return head(593, w)
+
+
+def measure(fn, values):
+    w = _Writer()
+    fn(values[0], w)
+    t0 = time.perf_counter()
+    for v in values:
+        fn(v, w)
+    dt = (time.perf_counter() - t0) / len(values)
+    # Most memory in use during a call, above what was in use before it
+    tracemalloc.start()
+    n = 1000
+    peak = 0
+    for v in values[:n]:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        r = fn(v, w)
+        peak += tracemalloc.get_traced_memory()[1] - base
+        del r
+    tracemalloc.stop()
+    return dt * 1e6, peak / n
+
+
+def fetch(port, path):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: pico\r\nConnection: close\r\n\r\n")
+    out = b""
+    while True:
+        d = s.recv(4096)
+        if not d:
+            break
+        out += d
+    s.close()
+    return out.partition(b"\r\n\r\n")[2]
+
+
+def served():
+    app = HTTPServer()
+    app.add("/old", lambda req: webpage("21.50"))
+    app.add("/new", lambda req: PAGE.render(value="21.50"))
+    port = []
+    stop = threading.Event()
+
+    async def main():
+        task = asyncio.create_task(app.serve("127.0.0.1", 0))
+        while app.server is None:
+            await asyncio.sleep(0.01)
+        port.append(app.server.sockets[0].getsockname()[1])
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        app.close()
+        await task
+
+    t = threading.Thread(target=asyncio.run, args=(main(),))
+    t.start()
+    while not port:
+        time.sleep(0.01)
+    old, new = fetch(port[0], b"/old"), fetch(port[0], b"/new")
+    stop.set()
+    t.join()
+    # The slot is padded to its width; HTML collapses the spaces
+    same = old.split() == new.split()
+    print("served: old %d bytes, new %d bytes, same page: %s" % (len(old), len(new), same))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+    values = ["%.2f" % (15 + (i % 1000) / 100) for i in range(args.n)]
+    print("%-24s %10s %12s" % ("", "per req", "allocated"))
+    for name, fn in (
+        ("page, f-string", legacy),
+        ("page, template", template),
+        ("response head, built", head_built),
+        ("response head, cached", head_cached),
+    ):
+        us, b = measure(fn, values)
+        print("%-24s %7.2f us %10.0f B" % (name, us, b))
+    served()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Sensor reads with and without the sensors.Registry cache, with the
+# three kinds of consumer the examples have running at once.
+#
+#   python bench/sensors.py [--duration 3] [--browsers 8]
+#
+# In one uasyncio loop (asyncio on the host):
+#   - HTTPServer serving the iot/7 page to --browsers clients, each
+#     reloading it every 100 ms, reading the thermistor per request;
+#   - a WebSocket style loop reading the water level every 100 ms, as
+#     iot/10_plant_monitor.py does;
+#   - an MQTT style publisher sending both every second.
+# The "sensors" are functions that take as long as an ADC read plus the
+# thermistor math. Printed: hardware reads per second, time spent in
+# them, and Registry.stats().
+#
+# Then a DHT11 style sensor that needs 20 ms per reading, read with
+# aget() by 8 tasks at once, to show them sharing one read.
+import argparse
+import asyncio
+import math
+import time
+
+import upy_host
+from http_server import HTTPServer
+from sensors import Registry
+
+READ_US = 150
+
+
+class Counter:
+    def __init__(self):
+        self.reads = 0
+        self.busy = 0.0
+
+
+def sensor(c, value):
+    def read():
+        t0 = time.perf_counter()
+        c.reads += 1
+        while time.perf_counter() - t0 < READ_US / 1e6:
+            pass
+        v = value + math.log(1 + c.reads % 7) / 10
+        c.busy += time.perf_counter() - t0
+        return v
+
+    return read
+
+
+async def browser(port, stop, n):
+    r, w = await asyncio.open_connection("127.0.0.1", port)
+    while not stop.is_set():
+        w.write(b"GET / HTTP/1.1\r\nHost: pico\r\n\r\n")
+        n[0] += 1
+        length = 0
+        while True:
+            line = await r.readline()
+            if line == b"\r\n":
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line[15:])
+        await r.readexactly(length)
+        await asyncio.sleep(0.1)
+    w.close()
+
+
+async def every(ms, stop, fn):
+    while not stop.is_set():
+        fn()
+        await asyncio.sleep(ms / 1000)
+
+
+async def scenario(cached, args):
+    temp_c, water_c = Counter(), Counter()
+    temp, water = sensor(temp_c, 21.5), sensor(water_c, 31000)
+    reg = Registry()
+    reg.add("temp", temp, ttl_ms=2000)
+    reg.add("water", water, period_ms=500)
+    if cached:
+        get_temp, get_water = lambda: reg.get("temp"), lambda: reg.get("water")
+    else:
+        get_temp, get_water = temp, water
+
+    app = HTTPServer(max_conns=args.browsers + 2)
+    app.add("/", lambda req: "<p>Temperature is %.2f degrees Celsius</p>" % get_temp())
+    server = asyncio.create_task(app.serve("127.0.0.1", 0))
+    while app.server is None:
+        await asyncio.sleep(0.01)
+    port = app.server.sockets[0].getsockname()[1]
+
+    stop = asyncio.Event()
+    pages = [0]
+    sent = {}
+    tasks = [asyncio.create_task(browser(port, stop, pages)) for _ in range(args.browsers)]
+    tasks.append(asyncio.create_task(every(100, stop, lambda: sent.update(P=get_water()))))
+    tasks.append(asyncio.create_task(every(1000, stop, lambda: sent.update(T=get_temp(), W=get_water()))))
+    if cached:
+        tasks.append(asyncio.create_task(every(100, stop, reg.poll)))
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    app.close()
+    await server
+    d = args.duration
+    print(
+        "%-9s %5.0f pages/s | thermistor %6.1f reads/s %5.1f ms/s | water %5.1f reads/s %5.1f ms/s"
+        % (
+            "cached" if cached else "direct",
+            pages[0] / d,
+            temp_c.reads / d,
+            temp_c.busy / d * 1e3,
+            water_c.reads / d,
+            water_c.busy / d * 1e3,
+        )
+    )
+    if cached:
+        for name, st in reg.stats().items():
+            print(
+                "          %-5s hit rate %5.1f%%: %d hits, %d collapsed, %d misses; %d reads, %d errors"
+                % (name, st["hit_rate"] * 100, st["hits"], st["collapsed"], st["misses"], st["reads"], st["errors"])
+            )
+
+
+async def collapse():
+    reads = [0]
+
+    async def dht():
+        reads[0] += 1
+        await asyncio.sleep(0.02)
+        return (24, 61)
+
+    reg = Registry()
+    reg.add("dht", dht, ttl_ms=1000)
+    got = await asyncio.gather(*[reg.aget("dht") for _ in range(8)])
+    st = reg.stats()["dht"]
+    print(
+        "dht: 8 concurrent aget() -> %d read(s), %d joined it, all equal: %s"
+        % (reads[0], st["collapsed"], all(g == got[0] for g in got))
+    )
+    # A coroutine read cannot be served synchronously
+    reg.add("dht2", dht, period_ms=10)
+    try:
+        reg.get("dht2")
+        rejected = False
+    except TypeError:
+        rejected = True
+    reg.poll()
+    print("dht: get() on a coroutine read %s" % ("raises TypeError" if rejected else "FAIL"))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--duration", type=float, default=3)
+    ap.add_argument("--browsers", type=int, default=8)
+    args = ap.parse_args()
+    asyncio.run(scenario(False, args))
+    asyncio.run(scenario(True, args))
+    asyncio.run(collapse())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# Live temperature in the iot/7 page: browsers polling the page against
+# an sse.EventStream pushing each new reading.
+#
+#   python bench/sse.py [--clients 4] [--period-ms 100] [--duration 3]
+#
+# The reading changes every --period-ms. Polling clients reload the page
+# (over a kept-alive connection, the cheapest way to poll) every period;
+# SSE clients hold /events open. Per client update: bytes on the wire
+# both ways (HTTP only, not TCP/IP headers) and CPU time of the server
+# thread.
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import upy_host
+from http_server import HTTPServer
+from page_template import Template
+from sse import EventStream
+
+PAGE = Template(
+    """
+            <!DOCTYPE html>
+            <html>
+            <body>
+            <form action="./red">
+            <input type="submit" value="red " />
+            </form>
+            <form action="./green">
+            <input type="submit" value="green" />
+            </form>
+            <form action="./blue">
+            <input type="submit" value="blue" />
+            </form>
+            <form action="./off">
+            <input type="submit" value="off" />
+            </form>
+            <p>Temperature is <span id="t">{value}</span> degrees Celsius</p>
+            <script>
+            new EventSource("/events").onmessage = e => document.getElementById("t").textContent = e.data;
+            </script>
+            </body>
+            </html>
+            """,
+    value=8,
+)
+
+# A browser's request headers, roughly
+REQ = (
+    b"GET %s HTTP/1.1\r\nHost: 192.168.4.1\r\nUser-Agent: Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0\r\n"
+    b"Accept: text/html,*/*\r\nAccept-Language: en-US,en;q=0.5\r\nAccept-Encoding: gzip, deflate\r\n"
+    b"Connection: keep-alive\r\n\r\n"
+)
+
+
+def server(args, port_box, stop, out):
+    period = args.period_ms
+
+    def reading():
+        return 20 + (int(time.monotonic() * 1000 / period) % 500) / 100
+
+    app = HTTPServer(max_conns=args.clients + 2, idle_ms=60000)
+    app.add("/", lambda req: PAGE.render(value="%.2f" % reading()))
+    events = EventStream(reading, period_ms=period, fmt="%.2f", max_subscribers=args.clients)
+    app.add("/events", events.handler)
+
+    async def main():
+        task = asyncio.create_task(app.serve("127.0.0.1", 0))
+        while app.server is None:
+            await asyncio.sleep(0.01)
+        port_box.append(app.server.sockets[0].getsockname()[1])
+        cpu = time.thread_time()
+        while not stop.is_set():
+            await asyncio.sleep(0.25)
+        out["cpu"] = time.thread_time() - cpu
+        out["events"] = events.events
+        app.close()
+        await task
+
+    asyncio.run(main())
+
+
+def poller(port, period, stop, st):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    req = REQ % b"/"
+    buf = b""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        s.sendall(req)
+        st["bytes"] += len(req)
+        while b"\r\n\r\n" not in buf:
+            buf += s.recv(4096)
+        head, _, buf = buf.partition(b"\r\n\r\n")
+        n = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+        while len(buf) < n:
+            buf += s.recv(4096)
+        st["bytes"] += len(head) + 4 + n
+        st["updates"] += 1
+        buf = buf[n:]
+        time.sleep(max(0, period - (time.perf_counter() - t0)))
+    s.close()
+
+
+def subscriber(port, stop, st):
+    s = socket.create_connection(("127.0.0.1", port))
+    req = REQ % b"/events"
+    s.sendall(req)
+    st["bytes"] += len(req)
+    s.settimeout(0.1)
+    while not stop.is_set():
+        try:
+            d = s.recv(4096)
+        except socket.timeout:
+            continue
+        if not d:
+            break
+        st["bytes"] += len(d)
+        st["updates"] += d.count(b"\ndata: ")
+    s.close()
+
+
+def run(name, args):
+    stop_srv, stop = threading.Event(), threading.Event()
+    port, out = [], {}
+    srv = threading.Thread(target=server, args=(args, port, stop_srv, out))
+    srv.start()
+    while not port:
+        time.sleep(0.01)
+    stats = [{"bytes": 0, "updates": 0} for _ in range(args.clients)]
+    if name == "poll":
+        ts = [threading.Thread(target=poller, args=(port[0], args.period_ms / 1000, stop, st)) for st in stats]
+    else:
+        ts = [threading.Thread(target=subscriber, args=(port[0], stop, st)) for st in stats]
+    for t in ts:
+        t.start()
+    time.sleep(args.duration)
+    stop_srv.set()
+    srv_wait = time.perf_counter()
+    while "cpu" not in out and time.perf_counter() - srv_wait < 2:
+        time.sleep(0.01)
+    stop.set()
+    for t in ts:
+        t.join()
+    srv.join()
+    updates = sum(st["updates"] for st in stats)
+    nbytes = sum(st["bytes"] for st in stats)
+    print(
+        "%-22s %5d updates  %7.0f B/update  server %6.1f us/update  (%.1f%% CPU)"
+        % (
+            "page polling" if name == "poll" else "SSE (%d events)" % out["events"],
+            updates,
+            nbytes / max(updates, 1),
+            out["cpu"] / max(updates, 1) * 1e6,
+            out["cpu"] / args.duration * 100,
+        )
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--period-ms", type=int, default=100)
+    ap.add_argument("--duration", type=float, default=3)
+    args = ap.parse_args()
+    run("poll", args)
+    run("sse", args)
+
+
+if __name__ == "__main__":
+    main()
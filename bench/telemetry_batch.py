@@ -0,0 +1,115 @@
+# Messages and bytes on the wire for one publish per reading against
+# umqtt_batch.Aggregator, over a simulated hour of plant monitor sensors.
+#
+#   python bench/telemetry_batch.py [--minutes 60] [--window-ms 30000]
+#
+# Publishes go to a counting sink (see mqtt_encode.py), so "writes" is
+# socket writes, i.e. TCP segments and broker fan-outs. Per-reading JSON
+# is rounded as iot scripts print it; batches are decoded again and must
+# give back every reading at that same resolution.
+import argparse
+import json
+import math
+import random
+
+import upy_host
+from mqtt_encode import Sink, new_client
+
+import telemetry
+from umqtt_batch import Aggregator
+
+# topic, sample period (ms), struct format, scale, decimals in JSON
+SENSORS = (
+    (b"plant/1/temp", 2000, "b", 0, 0),
+    (b"plant/1/humidity", 2000, "B", 0, 0),
+    (b"plant/1/water", 100, "H", 0, 0),
+    (b"plant/1/moisture", 1000, "h", 10, 1),
+)
+
+
+def reading(topic, t, rng):
+    x = t / 60000
+    if topic.endswith(b"temp"):
+        return int(22 + 3 * math.sin(x / 10))
+    if topic.endswith(b"humidity"):
+        return int(55 + 10 * math.sin(x / 7))
+    if topic.endswith(b"water"):
+        return 30000 + int(2000 * math.sin(x)) + rng.randrange(64)
+    return round(40 + 5 * math.sin(x / 3) + rng.random(), 1)
+
+
+def readings(minutes, rng):
+    out = []
+    for topic, period, _, _, _ in SENSORS:
+        for t in range(0, minutes * 60000, period):
+            out.append((t, topic, reading(topic, t, rng)))
+    out.sort()
+    return out
+
+
+def per_reading(data):
+    sink = Sink()
+    c = new_client(sink)
+    for t, topic, v in data:
+        c.publish(topic, json.dumps({"t": t, "value": v}))
+    return sink
+
+
+def batched(data, window_ms, max_samples):
+    sink = Sink()
+    c = new_client(sink)
+    sent = []
+    publish = c.publish
+
+    def capture(topic, msg, retain=False, qos=0):
+        sent.append((topic, bytes(msg)))
+        publish(topic, msg, retain, qos)
+
+    c.publish = capture
+    agg = Aggregator(c)
+    for topic, _, fmt, scale, _ in SENSORS:
+        agg.add_sensor(topic, window_ms=window_ms, max_samples=max_samples, fmt=fmt, scale=scale)
+    for t, topic, v in data:
+        agg.poll(t)
+        agg.add(topic, v, t)
+    agg.flush()
+    return sink, sent
+
+
+def check(data, sent):
+    decimals = {s[0]: s[4] for s in SENSORS}
+    want = {}
+    for t, topic, v in data:
+        want.setdefault(topic, []).append((t, v))
+    got = {}
+    for topic, msg in sent:
+        name, b = telemetry.decode(msg)
+        vals = [v for _, v in b["samples"]]
+        ok = abs(b["mean"] - sum(vals) / len(vals)) < 1e-3 and b["min"] <= min(vals) + 1e-3
+        if not ok or name != "batch":
+            return False
+        got.setdefault(topic, []).extend((b["t0"] + dt, round(v, decimals[topic])) for dt, v in b["samples"])
+    return got == want
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--minutes", type=int, default=60)
+    ap.add_argument("--window-ms", type=int, default=30000)
+    ap.add_argument("--max-samples", type=int, default=64)
+    args = ap.parse_args()
+    data = readings(args.minutes, random.Random(3))
+    one = per_reading(data)
+    sink, sent = batched(data, args.window_ms, args.max_samples)
+    secs = args.minutes * 60
+    print("%d readings over %d min from %d sensors" % (len(data), args.minutes, len(SENSORS)))
+    for name, s in (("per reading", one), ("batched", sink)):
+        print("%-12s %6d writes  %7.2f msg/s  %8d B on the wire" % (name, s.writes, s.writes / secs, s.bytes))
+    print(
+        "x%.0f fewer messages, x%.1f fewer bytes, same readings after decode: %s"
+        % (one.writes / sink.writes, one.bytes / sink.bytes, "ok" if check(data, sent) else "FAIL")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Payload size and encode time: JSON, as training/mqqt.py publishRoute
+# sends GPS fixes, against the binary records of libs/telemetry.py.
+#
+#   python bench/telemetry_codec.py [--count 20000]
+#
+# "frame" is the whole QoS 0 PUBLISH on the wire for that payload, which
+# is what a constrained uplink pays per message. Binary records are
+# decoded again and checked against the input to the schema's precision.
+import argparse
+import json
+import time
+
+import upy_host
+from simple_umqtt import publish_header_size
+
+import telemetry
+
+TOPICS = {"gps_fix": b"sensors/gps", "plant": b"plant/1/sample"}
+
+SAMPLES = (
+    (telemetry.GPS_FIX, {"fleetNo": "SM-002", "latitude": -1.2920659, "longitude": 36.8219462}),
+    (telemetry.PLANT, {"temperature": 23, "humidity": 61, "water": 40312}),
+)
+
+
+def timed(fn, count):
+    t0 = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - t0) / count * 1e6
+
+
+def frame(topic, payload):
+    return publish_header_size(topic, len(payload), 0) + len(payload)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=20000)
+    args = ap.parse_args()
+    ok = True
+    for schema, rec in SAMPLES:
+        name = schema.name
+        values = [rec[n] for n in schema.names]
+        js = json.dumps(rec).encode()
+        us_json = timed(lambda: json.dumps(rec).encode(), args.count)
+        us_bin = timed(lambda: schema.encode(*values), args.count)
+        payload = bytes(schema.encode(*values))
+        got_name, got = telemetry.decode(payload)
+        for n in schema.names:
+            v = rec[n]
+            if isinstance(v, str):
+                ok &= got[n] == v.encode()
+            else:
+                ok &= abs(got[n] - v) <= 1e-7
+        ok &= got_name == name
+        topic = TOPICS[name]
+        print(
+            "%-8s json %3d B (frame %3d) %6.2f us   binary %3d B (frame %3d) %6.2f us   x%.1f smaller"
+            % (name, len(js), frame(topic, js), us_json, len(payload), frame(topic, payload), us_bin, len(js) / len(payload))
+        )
+    print("decode round trip: %s" % ("ok" if ok else "FAIL"))
+    # Client ids as training/mqqt.py uses them for the fleet number: kept
+    # whole, and one too long for the field refused
+    ids = (b"umqtt_client", b"umqtt_client2", b"x" * 16)
+    got = [telemetry.decode(bytes(telemetry.GPS_FIX.encode(c, 0, 0)))[1]["fleetNo"] for c in ids]
+    try:
+        telemetry.GPS_FIX.encode(b"x" * 17, 0, 0)
+        refused = False
+    except ValueError:
+        refused = True
+    print("fleet numbers kept whole: %s, 17 bytes refused: %s" % ("ok" if got == list(ids) else "FAIL", "ok" if refused else "FAIL"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# Run the libs/ modules under CPython for host-side benchmarks.
+#
+# Maps the MicroPython port modules the libraries import (usocket, utime,
+# uasyncio, ...) onto their CPython equivalents. Sockets get the stream
+# read/write/readinto methods MicroPython sockets have. Import this module
+# before importing anything from libs/.
+import asyncio
+import binascii
+import hashlib
+import os
+import select
+import socket as _socket
+import struct
+import sys
+import time as _time
+
+LIBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "libs")
+if LIBS not in sys.path:
+    sys.path.insert(0, LIBS)
+
+
+class _Socket:
+    # CPython socket with MicroPython stream semantics: blocking read(n)
+    # returns n bytes (or fewer at EOF), non-blocking read returns None
+    # when nothing is pending.
+    def __init__(self, *args, sock=None):
+        self._s = sock if sock is not None else _socket.socket(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._s, name)
+
+    def _blocking(self):
+        return self._s.gettimeout() != 0
+
+    def read(self, n=-1):
+        if n < 0:
+            n = 1 << 16
+        if not self._blocking():
+            try:
+                return self._s.recv(n)
+            except BlockingIOError:
+                return None
+        buf = bytearray(n)
+        got = self.readinto(buf)
+        return bytes(buf[:got])
+
+    def readinto(self, buf, n=None):
+        mv = memoryview(buf)
+        if n is not None:
+            mv = mv[:n]
+        if not self._blocking():
+            try:
+                return self._s.recv_into(mv)
+            except BlockingIOError:
+                return None
+        got = 0
+        while got < len(mv):
+            r = self._s.recv_into(mv[got:])
+            if not r:
+                break
+            got += r
+        return got
+
+    def readline(self):
+        # Up to and including the next newline, without reading past it
+        out = b""
+        while True:
+            peek = self._s.recv(256, _socket.MSG_PEEK)
+            if not peek:
+                return out
+            i = peek.find(b"\n")
+            if i >= 0:
+                return out + self._s.recv(i + 1)
+            out += self._s.recv(len(peek))
+
+    def write(self, buf, n=None):
+        mv = memoryview(buf)
+        if n is not None:
+            mv = mv[:n]
+        if not self._blocking():
+            try:
+                return self._s.send(mv)
+            except BlockingIOError:
+                return None
+        self._s.sendall(mv)
+        return len(mv)
+
+    def accept(self):
+        s, addr = self._s.accept()
+        return _Socket(sock=s), addr
+
+
+class _USocket:
+    AF_INET = _socket.AF_INET
+    SOCK_STREAM = _socket.SOCK_STREAM
+    SOL_SOCKET = _socket.SOL_SOCKET
+    SO_REUSEADDR = _socket.SO_REUSEADDR
+    IPPROTO_TCP = _socket.IPPROTO_TCP
+    getaddrinfo = staticmethod(_socket.getaddrinfo)
+    error = OSError
+
+    @staticmethod
+    def socket(*args):
+        return _Socket(*args)
+
+
+class _Poll:
+    # uselect.poll(): poll() returns the registered objects, not fds
+    def __init__(self):
+        self._p = select.poll()
+        self._objs = {}
+
+    def register(self, obj, mask=select.POLLIN | select.POLLOUT):
+        fd = obj.fileno()
+        self._objs[fd] = obj
+        self._p.register(fd, mask)
+
+    def modify(self, obj, mask):
+        self._p.modify(obj.fileno(), mask)
+
+    def unregister(self, obj):
+        fd = obj.fileno()
+        self._objs.pop(fd, None)
+        self._p.unregister(fd)
+
+    def poll(self, timeout=-1):
+        return [(self._objs[fd], ev) for fd, ev in self._p.poll(timeout) if fd in self._objs]
+
+
+class _USelect:
+    POLLIN = select.POLLIN
+    POLLOUT = select.POLLOUT
+    POLLERR = select.POLLERR
+    POLLHUP = select.POLLHUP
+    poll = _Poll
+    select = staticmethod(select.select)
+
+
+class _UTime:
+    sleep = staticmethod(_time.sleep)
+    time = staticmethod(_time.time)
+    localtime = staticmethod(_time.localtime)
+
+    @staticmethod
+    def ticks_ms():
+        return int(_time.monotonic() * 1000) & 0x3FFFFFFF
+
+    @staticmethod
+    def ticks_us():
+        return int(_time.monotonic() * 1000000) & 0x3FFFFFFF
+
+    @staticmethod
+    def ticks_diff(a, b):
+        return ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+    @staticmethod
+    def ticks_add(a, delta):
+        return (a + delta) & 0x3FFFFFFF
+
+    @staticmethod
+    def sleep_ms(ms):
+        _time.sleep(ms / 1000)
+
+    @staticmethod
+    def sleep_us(us):
+        _time.sleep(us / 1000000)
+
+
+class _MicroPython:
+    # No native/viper emitters on the host: modules fall back to pure Python.
+    @staticmethod
+    def const(x):
+        return x
+
+    @staticmethod
+    def schedule(f, arg):
+        f(arg)
+        return True
+
+    @staticmethod
+    def alloc_emergency_exception_buf(n):
+        pass
+
+
+def install():
+    mods = {
+        "usocket": _USocket,
+        "utime": _UTime,
+        "micropython": _MicroPython,
+        "uasyncio": asyncio,
+        "ustruct": struct,
+        "uselect": _USelect,
+        "uos": os,
+        "ubinascii": binascii,
+        "uhashlib": hashlib,
+    }
+    for name, mod in mods.items():
+        sys.modules.setdefault(name, mod)
+    # CPython time lacks the ticks_* helpers the libraries rely on
+    for name in ("ticks_ms", "ticks_us", "ticks_diff", "ticks_add", "sleep_ms", "sleep_us"):
+        if not hasattr(_time, name):
+            setattr(_time, name, getattr(_UTime, name))
+
+
+install()
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * p / 100))]
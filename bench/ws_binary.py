@@ -0,0 +1,146 @@
+# ws_codec binary messages against the JSON WS_Server sends by default:
+# frame size and encode/decode time per message, then one binary client
+# negotiated end to end against WS_Server.
+#
+#   python bench/ws_binary.py [--n 20000]
+#
+# The messages are the plant monitor's snapshot and per-loop delta, and
+# a controller message of the kind the app sends every cycle (a joystick,
+# a slider, a switch and the unused widgets as null).
+import argparse
+import base64
+import json
+import os
+import socket
+import time
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+import ws_codec
+from websocket_helper import OP_BINARY, OP_TEXT
+from ws import WS_Server
+
+ws_mod.print = lambda *a: None
+
+MESSAGES = {
+    "plant snapshot": {"Name": "PicoW", "Type": "Blank", "Check": "SunFounder Controller", "G": 24, "H": 61, "P": 31022},
+    "plant delta": {"P": 31022},
+    "controller": dict(
+        {chr(c): None for c in range(ord("A"), ord("R"))},
+        K=[37, -82],
+        H=90,
+        M=True,
+        D=0.75,
+    ),
+}
+
+
+def payload(frame):
+    n = frame[1]
+    return bytes(frame[2 if n < 126 else 4 if n == 126 else 10 :])
+
+
+def per_call(f, arg, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        f(arg)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def codec(n):
+    print("%-16s %-6s %6s %10s %10s" % ("message", "format", "frame", "encode", "decode"))
+    for name, d in MESSAGES.items():
+        jf = websocket_helper.frame(OP_TEXT, json.dumps(d).encode())
+        bf = websocket_helper.frame(OP_BINARY, ws_codec.encode(d))
+        jp = payload(jf)
+        bp = payload(bf)
+        assert json.loads(jp) == ws_codec.decode(bp)
+        je = per_call(lambda d: websocket_helper.frame(OP_TEXT, json.dumps(d).encode()), d, n)
+        be = per_call(lambda d: websocket_helper.frame(OP_BINARY, ws_codec.encode(d)), d, n)
+        jd = per_call(json.loads, jp, n)
+        bd = per_call(ws_codec.decode, bp, n)
+        print("%-16s %-6s %4d B %7.2f us %7.2f us" % (name, "json", len(jf), je, jd))
+        print("%-16s %-6s %4d B %7.2f us %7.2f us" % ("", "binary", len(bf), be, bd))
+
+
+# Ints at the edges of each width, and past 64 bits (sent as a float)
+def int_range():
+    d = {"a": 127, "b": -32769, "c": 2**31 - 1, "d": 2**31, "e": -(2**31) - 1, "f": -(2**63), "g": 2**63 - 1}
+    assert ws_codec.decode(ws_codec.encode(d)) == d
+    assert ws_codec.decode(ws_codec.encode({"h": 2**70})) == {"h": float(2**70)}
+    print("ints up to 64 bits round-trip, larger ones as floats")
+
+
+# Every message cut short either decodes to its whole entries so far or
+# raises ValueError; none gives a shortened value
+def truncated():
+    cuts = 0
+    for d in MESSAGES.values():
+        b = bytes(ws_codec.encode(d))
+        items = list(d.items())
+        for n in range(len(b)):
+            try:
+                got = list(ws_codec.decode(b[:n]).items())
+            except ValueError:
+                cuts += 1
+                continue
+            assert got == items[: len(got)], (b[:n], got)
+    for b in (b"\x01G\x07\x05ab", b"\x01G\x05\x01\x02", b"\x03abc"):
+        try:
+            ws_codec.decode(b)
+            raise AssertionError(b)
+        except ValueError:
+            cuts += 1
+    print("%d truncated messages rejected with ValueError" % cuts)
+
+
+def negotiate():
+    ws = WS_Server(0, binary=True)
+    ws.send_dict = dict(MESSAGES["plant snapshot"])
+    ws.start_foreground()
+    s = socket.create_connection(("127.0.0.1", ws.listen_s.getsockname()[1]))
+    s.sendall(
+        b"GET / HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        b"Sec-WebSocket-Key: " + base64.b64encode(os.urandom(16)) + b"\r\n"
+        b"Sec-WebSocket-Protocol: chat, " + ws_codec.PROTOCOL + b"\r\n\r\n"
+    )
+    while not ws.clients:
+        ws.poll()
+    s.setblocking(True)
+    resp = b""
+    while b"\r\n\r\n" not in resp:
+        resp += s.recv(1)
+    assert websocket_helper.header(resp, b"Sec-WebSocket-Protocol") == ws_codec.PROTOCOL
+    s.setblocking(False)
+    r = websocket_helper.FrameReader(upy_host._Socket(sock=s))
+    m = None
+    while m is None:
+        r.fill()
+        m = r.next()
+    assert m[0] == OP_BINARY and ws_codec.decode(m[1]) == ws.send_dict
+    # Controller input comes back the same way; a truncated message is
+    # dropped without disturbing the server
+    s.sendall(websocket_helper.frame(OP_BINARY, b"\x01K\x05\x01"))
+    s.sendall(websocket_helper.frame(OP_BINARY, ws_codec.encode({"M": True, "K": [1, -1]})))
+    got = None
+    while got is None:
+        got = ws.read()
+    assert got == {"M": True, "K": [1, -1]}
+    s.close()
+    ws.stop()
+    print("negotiated %s: binary snapshot and controller message round-trip" % ws_codec.PROTOCOL.decode())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+    codec(args.n)
+    int_range()
+    truncated()
+    negotiate()
+
+
+if __name__ == "__main__":
+    main()
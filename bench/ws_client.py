@@ -0,0 +1,129 @@
+# websocket_helper.WebSocket client against WS_Server from libs/ws.py:
+# masking cost and client-to-server throughput at several payload sizes.
+#
+#   python bench/ws_client.py [--duration 1]
+#
+# First the masking step alone: the byte loop the parser used before
+# against _unmask, 4 bytes per pass. On the host that is the pure-Python
+# fallback in websocket_helper; the viper one in ws_mask needs a board.
+# Then a client sends JSON messages of each size as fast as WS_Server (on
+# its own thread, reading with read()) decodes them, with each masking
+# implementation, and once with the largest message split into 1 KB
+# fragments. Last, ping round trips.
+import argparse
+import json
+import threading
+import time
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+from ws import WS_Server
+
+ws_mod.print = lambda *a: None
+
+SIZES = (16, 125, 1024, 4000)
+
+
+def byte_unmask(mv, key):
+    for i in range(len(mv)):
+        mv[i] ^= key[i & 3]
+
+
+def masking():
+    key = b"\x12\x34\x56\x78"
+    for n in SIZES:
+        buf = bytearray(n)
+        mv = memoryview(buf)
+        out = []
+        for f in (byte_unmask, websocket_helper._unmask):
+            reps = max(200, 200000 // n)
+            t0 = time.perf_counter()
+            for _ in range(reps):
+                f(mv, key)
+            out.append((time.perf_counter() - t0) / reps * 1e6)
+        print("mask %4d B: byte loop %8.2f us, word %6.2f us (%.0fx)" % (n, out[0], out[1], out[0] / out[1]))
+
+
+def serve(ws, got, stop):
+    while not stop.is_set():
+        m = ws.read()
+        if m is None:
+            time.sleep(0)
+            continue
+        got[0] += 1
+
+
+def throughput(size, duration, fragment=0):
+    ws = WS_Server(0)
+    ws.start_foreground()
+    got = [0]
+    stop = threading.Event()
+    port = ws.listen_s.getsockname()[1]
+    t = threading.Thread(target=serve, args=(ws, got, stop))
+    t.start()
+    c = websocket_helper.connect("127.0.0.1", port, fragment=fragment)
+    c.recv(1000)  # snapshot
+    msg = json.dumps({"x": "a" * (size - 9)})
+    assert len(msg) == size
+    sent = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < duration:
+        c.send(msg)
+        sent += 1
+        while sent - got[0] > 64:
+            time.sleep(0)
+    while got[0] < sent:
+        time.sleep(0.0005)
+    elapsed = time.perf_counter() - t0
+    c.close()
+    stop.set()
+    t.join()
+    ws.stop()
+    return sent / elapsed, sent * size / elapsed / 1e6
+
+
+def rtt(n=200):
+    ws = WS_Server(0)
+    ws.start_foreground()
+    stop = threading.Event()
+    t = threading.Thread(target=serve, args=(ws, [0], stop))
+    t.start()
+    c = websocket_helper.connect("127.0.0.1", ws.listen_s.getsockname()[1])
+    lat = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        c.ping(b"x")
+        while c._ping_ms is not None:
+            c.recv(0)
+        lat.append(time.perf_counter() - t0)
+    c.close()
+    stop.set()
+    t.join()
+    ws.stop()
+    print("ping round trip p50 %.3f ms, p99 %.3f ms" % (upy_host.percentile(lat, 50) * 1e3, upy_host.percentile(lat, 99) * 1e3))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--duration", type=float, default=1)
+    args = ap.parse_args()
+    masking()
+    word = websocket_helper._unmask
+    for size in SIZES:
+        res = []
+        for f in (byte_unmask, word):
+            websocket_helper._unmask = f
+            res.append(throughput(size, args.duration))
+        websocket_helper._unmask = word
+        print(
+            "%4d B messages: byte masking %7.0f msg/s %6.2f MB/s, word masking %7.0f msg/s %6.2f MB/s"
+            % (size, res[0][0], res[0][1], res[1][0], res[1][1])
+        )
+    m, mb = throughput(SIZES[-1], args.duration, fragment=1024)
+    print("%4d B in 1 KB fragments:                              %7.0f msg/s %6.2f MB/s" % (SIZES[-1], m, mb))
+    rtt()
+
+
+if __name__ == "__main__":
+    main()
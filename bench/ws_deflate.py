@@ -0,0 +1,149 @@
+# permessage-deflate on the plant monitor's WebSocket traffic: compression
+# ratio and CPU per message for ws_deflate at several window sizes, then
+# a client negotiating it end to end with WS_Server(deflate_bits=...).
+#
+#   python bench/ws_deflate.py [--n 500]
+#
+# The streams are what iot/10_plant_monitor.py sends: full send_dict
+# dumps (the default), per-loop deltas (delta=True), and the controller
+# message the app sends back every cycle. "kept" keeps the window across
+# messages (host zlib); "reset" compresses each message on its own, as
+# MicroPython's deflate module does.
+import argparse
+import base64
+import json
+import os
+import random
+import socket
+import time
+import zlib
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+import ws_deflate
+from websocket_helper import OP_TEXT, RSV1
+from ws import WS_Server
+
+ws_mod.print = lambda *a: None
+
+TAIL = b"\x00\x00\xff\xff"
+SNAPSHOT = {"Name": "PicoW", "Type": "Blank", "Check": "SunFounder Controller"}
+
+
+def streams(n):
+    random.seed(1)
+    d = dict(SNAPSHOT, G=24, H=61, P=31000)
+    full, delta = [], []
+    for i in range(n):
+        if i % 10 == 0:
+            d["G"] += random.choice((-1, 0, 0, 1))
+            d["H"] += random.choice((-1, 0, 0, 1))
+        d["P"] = 31000 + random.randint(-96, 96)
+        full.append(json.dumps(d).encode())
+        delta.append(json.dumps({"P": d["P"]} if i % 10 else {"G": d["G"], "H": d["H"], "P": d["P"]}).encode())
+    ctl = []
+    for i in range(n):
+        m = {chr(c): None for c in range(ord("A"), ord("R"))}
+        m.update(K=[random.randint(-100, 100), random.randint(-100, 100)], H=90, M=i % 50 < 5)
+        ctl.append(json.dumps(m).encode())
+    return {"full dump": full, "delta": delta, "controller": ctl}
+
+
+def measure(msgs, bits, takeover):
+    pmd = ws_deflate.PerMessageDeflate(bits, takeover, bits, takeover)
+    # The receiving end, as a browser would inflate
+    d = zlib.decompressobj(-15)
+    out = []
+    t0 = time.perf_counter()
+    for m in msgs:
+        out.append(pmd.compress(m))
+    tc = time.perf_counter() - t0
+    for c, m in zip(out, msgs):
+        if c is None:
+            continue  # sent uncompressed
+        if not takeover:
+            d = zlib.decompressobj(-15)
+        assert d.decompress(c + TAIL) == m
+    # What the server's inflater costs for the same stream
+    pmd2 = ws_deflate.PerMessageDeflate(bits, takeover, bits, takeover)
+    t0 = time.perf_counter()
+    for c, m in zip(out, msgs):
+        assert c is None or pmd2.decompress(c) == m
+    ti = time.perf_counter() - t0
+    n = len(msgs)
+    return pmd.ratio(), tc / n * 1e6, ti / n * 1e6, sum(len(m) for m in msgs) / n
+
+
+def window_memory(bits):
+    # zlib: deflate 2**(bits+2) plus the 2**(memLevel+9) hash; inflate 2**bits plus ~7 KB
+    return ((1 << (bits + 2)) + (1 << 11) + (1 << bits) + 7 * 1024) // 1024
+
+
+def codec(n):
+    print("%-11s %5s %-6s %6s %8s %10s %10s %8s" % ("stream", "bits", "window", "raw", "ratio", "compress", "inflate", "~mem"))
+    for name, msgs in streams(n).items():
+        for bits in (9, 10, 12, 15):
+            for takeover in (True, False):
+                r, tc, ti, raw = measure(msgs, bits, takeover)
+                print(
+                    "%-11s %5d %-6s %5.0fB %7.2fx %7.1f us %7.1f us %5d KB"
+                    % (name, bits, "kept" if takeover else "reset", raw, 1 / r, tc, ti, window_memory(bits))
+                )
+
+
+def negotiate():
+    ws = WS_Server(0, deflate_bits=10)
+    ws.send_dict = dict(SNAPSHOT, G=24, H=61, P=31000)
+    ws.start_foreground()
+    s = socket.create_connection(("127.0.0.1", ws.listen_s.getsockname()[1]))
+    s.sendall(
+        b"GET / HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        b"Sec-WebSocket-Key: " + base64.b64encode(os.urandom(16)) + b"\r\n"
+        b"Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n\r\n"
+    )
+    while not ws.clients:
+        ws.poll()
+    resp = b""
+    while b"\r\n\r\n" not in resp:
+        resp += s.recv(1)
+    ext = websocket_helper.header(resp, b"Sec-WebSocket-Extensions")
+    s.setblocking(False)
+    r = websocket_helper.FrameReader(upy_host._Socket(sock=s))
+    inflate = zlib.decompressobj(-10)
+    got = []
+    for i in range(3):
+        ws.send_dict["P"] = 31000 + i
+        if i:
+            ws.write()
+        m = None
+        while m is None:
+            r.fill()
+            m = r.next()
+        assert m[0] == OP_TEXT | RSV1
+        got.append(len(m[1]))
+        assert json.loads(inflate.decompress(bytes(m[1]) + TAIL)) == ws.send_dict
+    # A compressed message from the client
+    c = zlib.compressobj(6, zlib.DEFLATED, -10)
+    body = c.compress(b'{"M": true, "H": 90}') + c.flush(zlib.Z_SYNC_FLUSH)
+    s.sendall(websocket_helper.masked_frame(OP_TEXT | RSV1, body[:-4]))
+    m = None
+    while m is None:
+        m = ws.read()
+    assert m == {"M": True, "H": 90}
+    s.close()
+    ws.stop()
+    print("negotiated %s" % ext.decode())
+    print("snapshot frames %s bytes (uncompressed %d); client message inflated" % (got, len(json.dumps(ws.send_dict)) + 2))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=500)
+    args = ap.parse_args()
+    codec(args.n)
+    negotiate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Bytes on the wire and server CPU per loop for the iot/10_plant_monitor.py
+# loop, full send_dict dumps against delta updates from libs/ws.py.
+#
+#   python bench/ws_delta.py [--loops 600] [--period-ms 10] [--min-interval-ms 50]
+#
+# One controller is connected and, like the app, sends its widget state
+# every loop, so transfer() writes every loop. The loop body is the plant
+# monitor's: the water level ADC (raw read_u16, so it carries noise) every
+# loop and the DHT11 every ten loops. --period-ms runs the loop faster than
+# the example's 100 ms; --min-interval-ms is the rate cap for the last run.
+import argparse
+import base64
+import os
+import random
+import socket
+import time
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+from ws import WS_Server
+
+ws_mod.print = lambda *a: None
+
+KEY = b"\x12\x34\x56\x78"
+APP_STATE = b'{"M": false, "A": 0, "B": 0}'
+
+
+def masked(payload):
+    body = bytes(b ^ KEY[i & 3] for i, b in enumerate(payload))
+    return bytes((0x81, 0x80 | len(payload))) + KEY + body
+
+
+def connect(ws):
+    s = socket.create_connection(("127.0.0.1", ws.listen_s.getsockname()[1]))
+    # Else Nagle holds the app's frames back whenever the server is quiet
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    key = base64.b64encode(os.urandom(16))
+    s.sendall(
+        b"GET / HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        b"Sec-WebSocket-Key: " + key + b"\r\nSec-WebSocket-Version: 13\r\n\r\n"
+    )
+    while not ws.clients:
+        ws.poll()
+    resp = b""
+    while b"\r\n\r\n" not in resp:
+        resp += s.recv(1)
+    s.setblocking(False)
+    return s
+
+
+def drain(s):
+    n = 0
+    while True:
+        try:
+            d = s.recv(65536)
+        except BlockingIOError:
+            return n
+        if not d:
+            return n
+        n += len(d)
+
+
+def run(label, loops, period, **kw):
+    random.seed(1)
+    ws = WS_Server(0, **kw)
+    ws.send_dict = {"Name": "PicoW", "Type": "Blank", "Check": "SunFounder Controller"}
+    ws.start_foreground()
+    s = connect(ws)
+    time.sleep(0.05)
+    drain(s)  # the snapshot on connect
+    frame = masked(APP_STATE)
+    wire = 0
+    cpu = 0.0
+    temp, hum = 24, 61
+    for i in range(loops):
+        s.sendall(frame)
+        time.sleep(period)
+        t0 = time.perf_counter()
+        if i % 10 == 0:
+            temp += random.choice((-1, 0, 0, 0, 1))
+            hum += random.choice((-1, 0, 0, 1))
+            ws.send_dict["G"] = temp
+            ws.send_dict["H"] = hum
+        ws.send_dict["P"] = 31000 + random.randint(-96, 96)
+        while not ws.transfer()[0]:
+            pass
+        cpu += time.perf_counter() - t0
+        wire += drain(s)
+    time.sleep(0.05)
+    wire += drain(s)
+    s.close()
+    ws.stop()
+    print(
+        "%-28s %7d bytes  %6.1f B/loop  %6.1f us/loop" % (label, wire, wire / loops, cpu / loops * 1e6)
+    )
+    return wire
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--loops", type=int, default=600)
+    ap.add_argument("--period-ms", type=float, default=10)
+    ap.add_argument("--min-interval-ms", type=int, default=50)
+    args = ap.parse_args()
+    period = args.period_ms / 1000
+    full = run("full dump (iot/10 today)", args.loops, period)
+    delta = run("delta", args.loops, period, delta=True)
+    capped = run(
+        "delta, %d ms cap" % args.min_interval_ms,
+        args.loops,
+        period,
+        delta=True,
+        min_interval_ms=args.min_interval_ms,
+    )
+    print("bytes vs full dump: delta %.2fx less, capped %.2fx less" % (full / delta, full / capped))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# send_dict fan-out from the multi-client WS_Server in libs/ws.py to 16
+# local WebSocket clients.
+#
+#   python bench/ws_fanout.py [--clients 16] [--updates 500] [--period-ms 10]
+#
+# The server runs its usual loop (transfer() plus a send_dict change
+# every --period-ms) on one thread; the clients are read from another.
+# Each update carries the time it was made, so the clients measure
+# broadcast-to-receipt latency. A second run adds a client that stops
+# reading: backpressure must keep it from delaying the others.
+import argparse
+import base64
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+from ws import WS_Server
+
+ws_mod.print = lambda *a: None  # one line per accepted connection otherwise
+
+
+def ws_connect(port):
+    s = socket.create_connection(("127.0.0.1", port))
+    key = base64.b64encode(os.urandom(16))
+    s.sendall(
+        b"GET / HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        b"Sec-WebSocket-Key: " + key + b"\r\nSec-WebSocket-Version: 13\r\n\r\n"
+    )
+    resp = b""
+    while b"\r\n\r\n" not in resp:
+        resp += s.recv(1)
+    assert b" 101 " in resp
+    s.setblocking(False)
+    return upy_host._Socket(sock=s)
+
+
+def serve(ws, updates, period, done):
+    ws.start_foreground()
+    # Accepted sockets inherit this: a send buffer the size of lwIP's,
+    # rather than the host's megabytes, so a stalled client fills it
+    ws.listen_s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8192)
+    done["port"] = ws.listen_s.getsockname()[1]
+    done["ready"].set()
+    n = 0
+    next_t = time.perf_counter()
+    while n < updates and not done["stop"].is_set():
+        ws.transfer()
+        now = time.perf_counter()
+        if now >= next_t and len(ws.clients) >= done["want"]:
+            ws.send_dict["T"] = now
+            ws.send_dict["N"] = n
+            ws.write()
+            n += 1
+            next_t = now + period
+        time.sleep(0.0005)
+    st = ws.stats()
+    done["skipped"] = st["dropped"] + st["coalesced"]
+    ws.stop()
+
+
+def run(nclients, updates, period, stalled):
+    ws = WS_Server(0, max_clients=nclients + 1)
+    ws.send_dict = {"Name": "bench", "Type": "Blank"}
+    done = {"ready": threading.Event(), "stop": threading.Event(), "want": nclients + stalled}
+    t = threading.Thread(target=serve, args=(ws, updates, period, done))
+    t.start()
+    done["ready"].wait()
+    readers = [websocket_helper.FrameReader(ws_connect(done["port"]), max_size=1 << 16) for _ in range(nclients)]
+    if stalled:
+        slow = socket.create_connection(("127.0.0.1", done["port"]))
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.sendall(
+            b"GET / HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n"
+        )
+    lat = []
+    got = [0] * nclients
+    socks = {r.sock.fileno(): i for i, r in enumerate(readers)}
+    p = select.poll()
+    for fd in socks:
+        p.register(fd, select.POLLIN)
+    deadline = time.perf_counter() + updates * period + 10
+    while min(got) < updates - 1 and time.perf_counter() < deadline:
+        for fd, _ in p.poll(100):
+            i = socks[fd]
+            r = readers[i]
+            r.fill()
+            while True:
+                m = r.next()
+                if m is None:
+                    break
+                now = time.perf_counter()
+                d = json.loads(bytes(m[1]))
+                if "T" in d:
+                    lat.append(now - d["T"])
+                    got[i] = d["N"]
+    done["stop"].set()
+    t.join()
+    print(
+        "%2d clients%s  p50 %6.2f ms  p99 %6.2f ms  %d updates each, %d dropped or coalesced for slow clients"
+        % (
+            nclients,
+            " + 1 stalled" if stalled else "",
+            upy_host.percentile(lat, 50) * 1000,
+            upy_host.percentile(lat, 99) * 1000,
+            min(got) + 1,
+            done.get("skipped", 0),
+        )
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--updates", type=int, default=500)
+    ap.add_argument("--period-ms", type=float, default=10)
+    args = ap.parse_args()
+    for stalled in (0, 1):
+        run(args.clients, args.updates, args.period_ms / 1000, stalled)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# WebSocket handshakes per second for websocket_helper.server_handshake,
+# against the readline()-based version it replaced.
+#
+#   python bench/ws_handshake.py [--clients 4] [--duration 3]
+#
+# A server thread accepts and handshakes in a loop, as WS_Server does;
+# --clients threads connect, send a browser-sized upgrade request, wait
+# for the 101 and close. Then two misbehaving clients show the budgets: one
+# dribbling its request 10 bytes every 50 ms and one sending 60 KB of
+# headers, each timed from accept until the server is free again. Last, a
+# request spelling its headers as Go's client does (Sec-Websocket-Key).
+#
+# Then WS_Server itself: a connected controller pings in a loop while a
+# client connects and never sends its request, for the longest ping
+# round trip meanwhile.
+import argparse
+import base64
+import hashlib
+import binascii
+import os
+import socket
+import threading
+import time
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+from ws import WS_Server
+
+ws_mod.print = lambda *a: None
+
+REQUEST = (
+    b"GET / HTTP/1.1\r\nHost: 192.168.4.1:8765\r\nConnection: Upgrade\r\nPragma: no-cache\r\n"
+    b"Cache-Control: no-cache\r\nUser-Agent: Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 "
+    b"(KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36\r\nUpgrade: websocket\r\n"
+    b"Origin: http://localhost\r\nSec-WebSocket-Version: 13\r\nAccept-Encoding: gzip, deflate\r\n"
+    b"Accept-Language: en-US,en;q=0.9\r\nSec-WebSocket-Key: %s\r\n"
+    b"Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n\r\n"
+)
+
+
+# server_handshake as it was before the fixed-buffer parser
+def legacy_handshake(sock):
+    clr = sock.makefile("rwb", 0)
+    l = clr.readline()
+    webkey = None
+    while 1:
+        l = clr.readline()
+        if not l:
+            raise OSError("EOF in headers")
+        if l == b"\r\n":
+            break
+        h, v = [x.strip() for x in l.split(b":", 1)]
+        if h == b"Sec-WebSocket-Key":
+            webkey = v
+    if not webkey:
+        raise OSError("Not a websocket request")
+    d = hashlib.sha1(webkey)
+    d.update(b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11")
+    respkey = binascii.b2a_base64(d.digest())[:-1]
+    sock.send(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: ")
+    sock.send(respkey)
+    sock.send(b"\r\n\r\n")
+
+
+def legacy(cl):
+    cl.setblocking(True)
+    cl.settimeout(2)
+    legacy_handshake(cl)
+
+
+def current(cl):
+    websocket_helper.server_handshake(cl)
+
+
+def serve(ls, handshake, stop, held):
+    ls.settimeout(0.1)
+    while not stop.is_set():
+        try:
+            cl, _ = ls.accept()
+        except socket.timeout:
+            continue
+        t0 = time.perf_counter()
+        try:
+            handshake(upy_host._Socket(sock=cl))
+            ok = True
+        except (OSError, ValueError):
+            ok = False
+        held.append((time.perf_counter() - t0, ok))
+        cl.close()
+
+
+def read_response(s):
+    resp = b""
+    while not resp.endswith(b"\r\n\r\n"):
+        d = s.recv(256)
+        if not d:
+            break
+        resp += d
+    return resp
+
+
+def client(port, stop, count):
+    key = base64.b64encode(os.urandom(16))
+    req = REQUEST % key
+    while not stop.is_set():
+        s = socket.create_connection(("127.0.0.1", port))
+        s.sendall(req)
+        read_response(s)
+        s.close()
+        count[0] += 1
+
+
+def dribble(port):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        req = REQUEST % b"dGhlIHNhbXBsZSBub25jZQ=="
+        for i in range(0, len(req), 10):
+            s.send(req[i : i + 10])
+            time.sleep(0.05)
+    except OSError:
+        pass
+    s.close()
+
+
+def flood(port):
+    s = socket.create_connection(("127.0.0.1", port))
+    try:
+        req = REQUEST % b"dGhlIHNhbXBsZSBub25jZQ=="
+        s.sendall(req[:-2] + (b"X-Filler: " + b"a" * 90 + b"\r\n") * 600 + b"\r\n")
+        read_response(s)
+    except OSError:
+        pass
+    s.close()
+
+
+def go(port):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall((REQUEST % b"dGhlIHNhbXBsZSBub25jZQ==").replace(b"Sec-WebSocket-", b"Sec-Websocket-"))
+    read_response(s)
+    s.close()
+
+
+def run(name, handshake, nclients, duration):
+    ls = socket.socket()
+    ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ls.bind(("127.0.0.1", 0))
+    ls.listen(64)
+    port = ls.getsockname()[1]
+    stop = threading.Event()
+    held = []
+    srv = threading.Thread(target=serve, args=(ls, handshake, stop, held))
+    srv.start()
+    count = [0]
+    cstop = threading.Event()
+    cs = [threading.Thread(target=client, args=(port, cstop, count)) for _ in range(nclients)]
+    for c in cs:
+        c.start()
+    time.sleep(duration)
+    cstop.set()
+    for c in cs:
+        c.join()
+    rate = count[0] / duration
+    time.sleep(0.2)
+    lat = [t for t, ok in held if ok]
+    out = []
+    for bad in (dribble, flood, go):
+        t = threading.Thread(target=bad, args=(port,))
+        t.start()
+        t.join()
+        time.sleep(0.2)
+        t_held, ok = held[-1]
+        out.append("%s %.2f s %s" % (bad.__name__, t_held, "accepted" if ok else "refused"))
+    stop.set()
+    srv.join()
+    ls.close()
+    print(
+        "%-8s %6.0f handshakes/s  p50 %5.0f us  |  %s"
+        % (name, rate, upy_host.percentile(lat, 50) * 1e6, ", ".join(out))
+    )
+
+
+def stall():
+    ws = WS_Server(0)
+    ws.start_foreground()
+    port = ws.listen_s.getsockname()[1]
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            ws.poll()
+            time.sleep(0)
+
+    t = threading.Thread(target=loop)
+    t.start()
+    c = websocket_helper.connect("127.0.0.1", port)
+    c.recv(1000)  # snapshot
+    silent = socket.create_connection(("127.0.0.1", port))
+    worst = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < 2.5:
+        t1 = time.perf_counter()
+        c.ping(b"x")
+        while c._ping_ms is not None:
+            c.recv(0)
+        worst = max(worst, time.perf_counter() - t1)
+    dropped = silent.recv(1) == b""
+    silent.close()
+    c.close()
+    stop.set()
+    t.join()
+    ws.stop()
+    print(
+        "WS_Server with a silent client connected: worst ping %.1f ms, silent client %s"
+        % (worst * 1e3, "dropped" if dropped else "kept")
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--duration", type=float, default=3)
+    args = ap.parse_args()
+    run("legacy", legacy, args.clients, args.duration)
+    run("current", current, args.clients, args.duration)
+    stall()
+
+
+if __name__ == "__main__":
+    main()
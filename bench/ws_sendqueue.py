@@ -0,0 +1,116 @@
+# WS_Server send queue policies with one client that stops reading.
+#
+#   python bench/ws_sendqueue.py [--loops 600] [--period-ms 2] [--max-pending 1024]
+#
+# The server loop (delta=True) changes send_dict every --period-ms and
+# calls write(), timing each call. One client reads everything; a second
+# one, with a small receive buffer, stops reading for the first 60% of
+# the run and then catches up. For each policy: how long write() can
+# take, what the slow client got, the queue metrics from stats(), and
+# whether both clients end up with the server's final state.
+import argparse
+import json
+import socket
+import threading
+import time
+
+import upy_host
+import websocket_helper
+import ws as ws_mod
+from ws import BLOCK, DROP_OLDEST, LATEST, WS_Server
+
+ws_mod.print = lambda *a: None
+
+
+def client(port, rcvbuf, start, stop, out):
+    s = socket.socket()
+    if rcvbuf:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    s.connect(("127.0.0.1", port))
+    s = upy_host._Socket(sock=s)
+    proto, rest = websocket_helper.client_handshake(s, b"bench")
+    c = websocket_helper.WebSocket(s, proto, rest, max_size=1 << 16)
+    state = {}
+    n = 0
+    start.wait()
+    try:
+        while True:
+            m = c.recv(50)
+            if m is None:
+                if stop.is_set():
+                    break
+                continue
+            state.update(json.loads(bytes(m[1])))
+            n += 1
+    except OSError:
+        out["closed"] = True
+    out["state"] = state
+    out["messages"] = n
+
+
+def run(policy, args):
+    ws = WS_Server(0, delta=True, policy=policy, max_pending=args.max_pending, block_ms=200)
+    ws.send_dict = {"Name": "PicoW", "Type": "Blank", "P": 0, "L": [0] * 16}
+    ws.start_foreground()
+    ws.listen_s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    port = ws.listen_s.getsockname()[1]
+    go_fast, go_slow, stop = threading.Event(), threading.Event(), threading.Event()
+    fast, slow = {}, {}
+    threads = [
+        threading.Thread(target=client, args=(port, 0, go_fast, stop, fast)),
+        threading.Thread(target=client, args=(port, 2048, go_slow, stop, slow)),
+    ]
+    for t in threads:
+        t.start()
+        while len(ws.clients) < threads.index(t) + 1:
+            ws.poll()
+    go_fast.set()
+    lat = []
+    for i in range(args.loops):
+        if i == args.loops * 6 // 10:
+            go_slow.set()
+        ws.send_dict["P"] = i
+        ws.send_dict["L"] = [(i * k) % 1000 for k in range(16)]
+        t0 = time.perf_counter()
+        ws.write()
+        lat.append(time.perf_counter() - t0)
+        end = time.perf_counter() + args.period_ms / 1000
+        while time.perf_counter() < end:
+            ws.poll()
+    st = ws.stats()
+    end = time.perf_counter() + 1
+    while time.perf_counter() < end:
+        ws.poll()
+    stop.set()
+    for t in threads:
+        t.join()
+    ws.stop()
+    final = ws.send_dict
+    print(
+        "%-12s write() p50 %6.1f us max %7.1f ms | slow client: %4d msgs %-12s | max depth %2d, %3d dropped, %3d coalesced | fast %s"
+        % (
+            policy,
+            upy_host.percentile(lat, 50) * 1e6,
+            max(lat) * 1e3,
+            slow.get("messages", 0),
+            "disconnected" if slow.get("closed") else "in sync" if slow.get("state") == final else "out of sync",
+            st["max_depth"],
+            st["dropped"],
+            st["coalesced"],
+            "in sync" if fast.get("state") == final else "out of sync",
+        )
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--loops", type=int, default=600)
+    ap.add_argument("--period-ms", type=float, default=2)
+    ap.add_argument("--max-pending", type=int, default=1024)
+    args = ap.parse_args()
+    for policy in (LATEST, DROP_OLDEST, BLOCK):
+        run(policy, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from ws import WS_Server
+from sensors import Registry
 import time
 
 from machine import Pin,ADC
@@ -16,7 +17,22 @@ water_level = ADC(28)
 
 
 # Websocket
-ws = WS_Server(8765) 
+ws = WS_Server(8765, delta=True, min_interval_ms=200)
+
+def read_dht():
+    try:
+        sensor.measure()
+    except:
+        print("no data")
+        raise
+    print("Temperature: {}, Humidity: {}".format(sensor.temperature, sensor.humidity))
+    return sensor.temperature, sensor.humidity
+
+# Sampled by sensors.poll() at their own pace, read from the cache by
+# the loop; the water level changes far slower than the loop runs
+sensors = Registry()
+sensors.add('dht', read_dht, period_ms=1000, ttl_ms=5000)
+sensors.add('water', water_level.read_u16, period_ms=500)
 
 
 
@@ -35,23 +51,16 @@ def main():
     
     pump_flag = False
     pump_start_time = False
-    dht_start_time = time.ticks_ms()
     
     while True:
+        sensors.poll()
         try:
-            current_time=time.ticks_ms()
-            if current_time - dht_start_time>=1000:
-                sensor.measure()
-                dht_start_time = current_time
-                ws.send_dict['G'] = sensor.temperature
-                ws.send_dict['H'] = sensor.humidity
-                print("Temperature: {}, Humidity: {}".format(sensor.temperature, sensor.humidity))
+            ws.send_dict['G'], ws.send_dict['H'] = sensors.get('dht')
         except:
-            print("no data")
             pass
             
 
-        ws.send_dict['P'] = water_level.read_u16()
+        ws.send_dict['P'] = sensors.get('water')
         #print(ws.send_dict)
         
         status,result=ws.transfer()
@@ -1,4 +1,4 @@
-import urequests
+import http_client
 import json
 import time
 import machine
@@ -9,10 +9,13 @@ do_connect()
 
 ws = WS2812(machine.Pin(0), 8)
 
+# Keeps the connection to thingspeak open from one poll to the next
+requests = http_client.Session(idle_ms=90000)
+
 def get_colour():
     url = "http://api.thingspeak.com/channels/1417/field/2/last.json"
     try:
-        r = urequests.get(url)
+        r = requests.get(url)
         if r.status_code > 199 and r.status_code < 300:
             cheerlights = json.loads(r.content.decode('utf-8'))
             print(cheerlights['field2'])
@@ -1,4 +1,5 @@
-import urequests
+# Keeps the connection to IFTTT open between events
+import http_client as requests
 import machine
 import time
 
@@ -22,7 +23,7 @@ warn_flag=False
 
 
 def motion_detected(pin):
-    urequests.post(message)
+    requests.post(message)
     print(message)
     global warn_flag
     warn_flag=True
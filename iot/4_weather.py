@@ -1,4 +1,5 @@
-import urequests
+# Keeps the (TLS) connection to openweathermap open between updates
+import http_client as requests
 import time
 
 # connect the network       
@@ -50,7 +51,7 @@ def get_weather(city, api_key, units='metric', lang='en'):
     '''
     url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units={units}&lang={lang}"
     print(url)
-    res = urequests.post(url)
+    res = requests.post(url)
     return res.json()
 
 def print_weather(weather_data):
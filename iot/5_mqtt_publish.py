@@ -1,6 +1,8 @@
 import time
+import machine
 from machine import Pin
-from umqtt.simple import MQTTClient
+from simple_umqtt import MQTTClient
+from umqtt_irq import IRQPublisher
 
 from do_connect import *
 do_connect()
@@ -16,7 +18,9 @@ client_id = 'Jimmy'
 topic = b'SunFounder MQTT Test'
 
 try:
-    client = MQTTClient(client_id, mqtt_server, keepalive=3600)
+    # check_msg() below pings when idle and reconnects a dead link within
+    # about 40 s, so the keepalive no longer has to be huge
+    client = MQTTClient(client_id, mqtt_server, keepalive=60)
     client.connect()
     print('Connected to %s MQTT Broker'%(mqtt_server))
 except OSError as e:
@@ -24,31 +28,35 @@ except OSError as e:
     time.sleep(5)
     machine.reset()
 
+# The handlers run in interrupt context, so they only post into the
+# IRQPublisher ring; the main loop below does the actual publishing.
+pub = IRQPublisher(client)
+
 # button 
 def press1(pin):
-    message = b'button 1 is pressed'
-    client.publish(topic, message)
-    print(message)
+    pub.post(topic, b'button 1 is pressed')
 
 sensor1.irq(trigger=machine.Pin.IRQ_RISING, handler=press1)
 
 def press2(pin):
-    message = b'button 2 is pressed'
-    client.publish(topic, message)
-    print(message)
+    pub.post(topic, b'button 2 is pressed')
 
 sensor2.irq(trigger=machine.Pin.IRQ_RISING, handler=press2)
 
 def press3(pin):
-    message = b'button 3 is pressed'
-    client.publish(topic, message)
-    print(message)
+    pub.post(topic, b'button 3 is pressed')
 
 sensor3.irq(trigger=machine.Pin.IRQ_RISING, handler=press3)
 
 def press4(pin):
-    message = b'button 4 is pressed'
-    client.publish(topic, message)
-    print(message)
+    pub.post(topic, b'button 4 is pressed')
 
 sensor4.irq(trigger=machine.Pin.IRQ_RISING, handler=press4)
+
+while True:
+    try:
+        pub.check_msg()
+    except OSError as e:
+        # Presses stay queued in pub while the keepalive reconnects
+        print('MQTT error:', e)
+    time.sleep(1)
@@ -1,6 +1,12 @@
 import machine
-import socket
 import math
+import uasyncio as asyncio
+
+from http_server import HTTPServer
+from page_template import Template
+from sensors import Registry
+from sse import EventStream
+from http_static import StaticFiles
 
 from secrets import *
 from do_connect import *
@@ -23,8 +29,12 @@ def temperature():
     print ('Celsius: %.2f C  Fahrenheit: %.2f F' % (Cel, Fah))
     return Cel
 
-def webpage(value):
-    html = f"""
+# Page hits share one reading for up to 2 s instead of each sampling the ADC
+sensors = Registry()
+sensors.add('temp', temperature, ttl_ms=2000)
+
+# Encoded once; each request only writes the temperature into its slot
+PAGE = Template("""
             <!DOCTYPE html>
             <html>
             <body>
@@ -40,61 +50,50 @@ def webpage(value):
             <form action="./off">
             <input type="submit" value="off" />
             </form>
-            <p>Temperature is {value} degrees Celsius</p>
+            <p>Temperature is <span id="t">{value}</span> degrees Celsius</p>
+            <script>
+            new EventSource("/events").onmessage = e => document.getElementById("t").textContent = e.data;
+            </script>
             </body>
             </html>
-            """
-    return html
+            """, value=8)
+
+app = HTTPServer()
 
-def serve(connection):
-    while True:
-        client = connection.accept()[0]
-        request = client.recv(1024)
-        request = str(request)
-        try:
-            request = request.split()[1]
-        except IndexError:
-            pass
-        
-        print(request)
-        
-        if request == '/off?':
-            red.low()
-            green.low()
-            blue.low()
-        elif request == '/red?':
-            red.high()
-            green.low()
-            blue.low()
-        elif request == '/green?':
-            red.low()
-            green.high()
-            blue.low()
-        elif request == '/blue?':
-            red.low()
-            green.low()
-            blue.high()
+def page(req):
+    value='%.2f'%sensors.get('temp')
+    return PAGE.render(value=value)
 
-        value='%.2f'%temperature()    
-        html=webpage(value)
-        client.send(html)
-        client.close()
+# path -> red, green, blue
+LEDS = {
+    '/off': (0, 0, 0),
+    '/red': (1, 0, 0),
+    '/green': (0, 1, 0),
+    '/blue': (0, 0, 1),
+}
 
-def open_socket(ip):
-    # Open a socket
-    address = (ip, 80)
-    connection = socket.socket()
-    connection.bind(address)
-    connection.listen(1)
-    print(connection)
-    return(connection)
+def led(req):
+    print(req.path)
+    r, g, b = LEDS[req.path]
+    red.value(r)
+    green.value(g)
+    blue.value(b)
+    return page(req)
+
+# Open pages get each new reading pushed instead of reloading
+events = EventStream(lambda: sensors.get('temp'), period_ms=2000, fmt='%.2f')
+
+app.add('/', page)
+app.add('/events', events.handler)
+# Anything copied to /www on the board, e.g. a dashboard's scripts
+app.add('/static/*', StaticFiles('/www', '/static/').handler)
+for path in LEDS:
+    app.add(path, led)
 
 
 try:
     ip=do_connect()
     if ip is not None:
-        connection=open_socket(ip)
-        serve(connection)
+        asyncio.run(app.serve(ip, 80))
 except KeyboardInterrupt:
     machine.reset()
-
@@ -0,0 +1,284 @@
+# uasyncio MQTT client with the same connect/publish/subscribe surface as
+# simple_umqtt.MQTTClient.
+#
+# A single reader task owns the receive side of the connection and
+# dispatches PUBACK/SUBACK/PINGRESP and inbound PUBLISH packets, so
+# publishes, callbacks and keepalive pings never block other tasks for a
+# broker round trip. Inbound QoS 2 messages are answered with PUBREC and
+# delivered once; publish() itself goes up to QoS 1.
+#
+# Once the connection drops (the broker closes it, or a callback raises)
+# the client's tasks are stopped, and publish(), subscribe() and ping()
+# raise OSError until connect() is called again.
+import uasyncio as asyncio
+from utime import ticks_ms, ticks_diff
+from simple_umqtt import (
+    MQTTException,
+    _bytes,
+    connect_size,
+    encode_connect,
+    publish_header_size,
+    encode_publish_header,
+    subscribe_size,
+    encode_subscribe,
+)
+
+try:
+    import errno
+except ImportError:
+    import uerrno as errno
+
+
+class _Ack:
+    # Completion slot for a packet waiting on PUBACK/SUBACK
+    def __init__(self):
+        self.ev = asyncio.Event()
+        self.rc = 0
+
+
+class MQTTClient:
+    def __init__(
+        self,
+        client_id,
+        server,
+        port=0,
+        user=None,
+        password=None,
+        keepalive=0,
+        ssl=None,
+        timeout=10,
+    ):
+        if port == 0:
+            port = 8883 if ssl else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.ssl = ssl
+        self.pid = 0
+        self.cb = None
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+        self._acks = {}
+        # Inbound QoS 2 pids delivered but not yet released by PUBREL
+        self._rec = set()
+        self._last_tx = 0
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    def isconnected(self):
+        return self._writer is not None
+
+    def _next_pid(self):
+        while 1:
+            self.pid = self.pid % 65535 + 1
+            if self.pid not in self._acks:
+                return self.pid
+
+    async def _send(self, pkt):
+        w = self._writer
+        if w is None:
+            raise OSError(errno.ENOTCONN)
+        # One write() per packet: other tasks cannot interleave partial frames
+        w.write(pkt)
+        await w.drain()
+        self._last_tx = ticks_ms()
+
+    async def _recv_len(self):
+        n = 0
+        sh = 0
+        while 1:
+            b = (await self._reader.readexactly(1))[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return n
+            sh += 7
+
+    # Send pkt and wait for the PUBACK/SUBACK to pid
+    async def _request(self, pid, pkt):
+        ack = self._acks[pid] = _Ack()
+        try:
+            await self._send(pkt)
+            await asyncio.wait_for(ack.ev.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise OSError(-2)
+        finally:
+            # The pid is free again whether it was answered or not
+            if self._acks.get(pid) is ack:
+                del self._acks[pid]
+        if ack.rc < 0:
+            raise OSError(-1)
+        return ack.rc
+
+    async def connect(self, clean_session=True):
+        # Stop what is left of an earlier connection
+        self._close()
+        if self.ssl:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.server, self.port, ssl=self.ssl
+            )
+        else:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.server, self.port
+            )
+        flags = clean_session << 1
+        fields = [_bytes(self.client_id)]
+        if self.lw_topic:
+            fields += (_bytes(self.lw_topic), _bytes(self.lw_msg))
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+        if self.user:
+            fields += (_bytes(self.user), _bytes(self.pswd))
+            flags |= 0xC0
+        assert self.keepalive < 65536
+        pkt = bytearray(connect_size(fields))
+        encode_connect(pkt, fields, flags, self.keepalive)
+        await self._send(pkt)
+        resp = await self._reader.readexactly(4)
+        assert resp[0] == 0x20 and resp[1] == 0x02
+        if resp[3] != 0:
+            raise MQTTException(resp[3])
+        self._tasks = [asyncio.create_task(self._read_loop())]
+        if self.keepalive:
+            self._tasks.append(asyncio.create_task(self._keepalive_loop()))
+        return resp[2] & 1
+
+    async def disconnect(self):
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+        if self._writer is None:
+            return
+        try:
+            await self._send(b"\xe0\0")
+        except OSError:
+            pass
+        self._close()
+
+    # Drop the connection and stop the client's tasks but the running one
+    # (the reader, when it is the one closing)
+    def _close(self):
+        cur = asyncio.current_task()
+        for t in self._tasks:
+            if t is not cur:
+                t.cancel()
+        self._tasks = []
+        w = self._writer
+        self._writer = None
+        self._reader = None
+        if w is not None:
+            w.close()
+        # Wake any publisher still waiting on an acknowledgement
+        for ack in self._acks.values():
+            ack.rc = -1
+            ack.ev.set()
+        self._acks = {}
+
+    async def ping(self):
+        await self._send(b"\xc0\0")
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        assert qos < 2
+        topic = _bytes(topic)
+        msg = _bytes(msg)
+        pid = self._next_pid() if qos else 0
+        # A fresh frame per packet: the stream may hold on to it after write()
+        pkt = bytearray(publish_header_size(topic, len(msg), qos) + len(msg))
+        i = encode_publish_header(pkt, topic, len(msg), retain, qos, pid)
+        pkt[i:] = msg
+        if qos:
+            await self._request(pid, pkt)
+        else:
+            await self._send(pkt)
+
+    # topic may also be a list of (topic filter, qos) pairs, subscribed to
+    # with a single SUBSCRIBE packet
+    async def subscribe(self, topic, qos=0):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._next_pid()
+        if isinstance(topic, list):
+            topics = [(_bytes(t), q) for t, q in topic]
+        else:
+            topics = ((_bytes(topic), qos),)
+        pkt = bytearray(subscribe_size(topics))
+        encode_subscribe(pkt, pid, topics)
+        if await self._request(pid, pkt) == 0x80:
+            raise MQTTException(0x80)
+
+    async def _read_loop(self):
+        try:
+            while 1:
+                op = (await self._reader.readexactly(1))[0]
+                sz = await self._recv_len()
+                body = await self._reader.readexactly(sz) if sz else b""
+                kind = op & 0xF0
+                if kind == 0x30:
+                    await self._on_publish(op, body)
+                elif kind == 0x40 or kind == 0x90:
+                    ack = self._acks.pop(body[0] << 8 | body[1], None)
+                    if ack:
+                        # SUBACK: 0x80 if any filter was refused
+                        ack.rc = max(body[2:]) if kind == 0x90 else 0
+                        ack.ev.set()
+                elif kind == 0x60:
+                    # PUBREL: the broker has released an inbound QoS 2
+                    pid = body[0] << 8 | body[1]
+                    self._rec.discard(pid)
+                    await self._send(bytes((0x70, 2, pid >> 8, pid & 0xFF)))
+        except (OSError, EOFError):
+            pass
+        finally:
+            # Also when the callback raises: the connection is dropped
+            # rather than left looking connected with no reader
+            self._close()
+
+    async def _on_publish(self, op, body):
+        topic_len = body[0] << 8 | body[1]
+        topic = body[2 : 2 + topic_len]
+        i = 2 + topic_len
+        if op & 6:
+            pid = body[i] << 8 | body[i + 1]
+            i += 2
+        if op & 6 == 4:
+            # A QoS 2 retransmission before PUBREL is answered, not
+            # delivered again
+            if pid not in self._rec:
+                self._rec.add(pid)
+                self.cb(topic, body[i:])
+            await self._send(bytes((0x50, 2, pid >> 8, pid & 0xFF)))
+            return
+        self.cb(topic, body[i:])
+        if op & 6 == 2:
+            await self._send(bytes((0x40, 2, pid >> 8, pid & 0xFF)))
+
+    async def _keepalive_loop(self):
+        # Ping only once the link has been idle for half the keepalive
+        period = self.keepalive * 500
+        while 1:
+            idle = ticks_diff(ticks_ms(), self._last_tx)
+            if idle >= period:
+                try:
+                    await self.ping()
+                except OSError:
+                    self._close()
+                    return
+                idle = 0
+            await asyncio.sleep((period - idle) / 1000)
+
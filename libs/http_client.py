@@ -0,0 +1,308 @@
+# HTTP/1.1 client that keeps connections open between requests, in place
+# of urequests for programs that talk to the same servers over and over.
+#
+#   import http_client as requests
+#
+#   r = requests.get("http://api.thingspeak.com/channels/1417/field/2/last.json")
+#   if r.status_code == 200:
+#       print(r.json())
+#
+# get/post/request take the same arguments as urequests (data, json,
+# headers) and return a Response with status_code, reason, headers,
+# content, text and json(). The body is read in full before returning,
+# so close() is optional; the connection goes back to the pool.
+#
+# Each host keeps at most one idle connection, closed once it has been
+# unused for idle_ms (servers drop theirs too; most after 5 to 60 s).
+# A request on a kept connection that the server has closed meanwhile
+# is sent again once on a new one. Host names are resolved once per
+# dns_ttl_ms. A Session holds its own pool; the module functions share
+# a default one.
+import usocket as socket
+from utime import ticks_diff, ticks_ms
+
+try:
+    import errno
+except ImportError:
+    import uerrno as errno
+
+try:
+    import ssl
+except ImportError:
+    import ussl as ssl
+try:
+    import json
+except ImportError:
+    import ujson as json
+
+
+# Errors that mean the server had closed the connection (32 is EPIPE)
+_CLOSED = (errno.ECONNRESET, errno.ECONNABORTED, errno.ENOTCONN, 32)
+
+
+class Response:
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    # The connection was released when the body was read
+    def close(self):
+        pass
+
+
+class _Conn:
+    def __init__(self, sock, key):
+        self.sock = sock
+        self.key = key
+        self.used = ticks_ms()
+        self.requests = 0
+
+
+def _parse(url):
+    proto, _, rest = url.partition("://")
+    if proto == "http":
+        port = 80
+    elif proto == "https":
+        port = 443
+    else:
+        raise ValueError("unsupported protocol: " + proto)
+    host, _, path = rest.partition("/")
+    if ":" in host:
+        host, p = host.split(":", 1)
+        port = int(p)
+    return proto, host, port, "/" + path
+
+
+class Session:
+    def __init__(self, idle_ms=60000, dns_ttl_ms=300000, timeout=10):
+        self.idle_ms = idle_ms
+        self.dns_ttl_ms = dns_ttl_ms
+        self.timeout = timeout
+        # (proto, host, port) -> idle _Conn
+        self._idle = {}
+        # (host, port) -> (address, ticks_ms resolved)
+        self._dns = {}
+        self.connects = 0
+        self.reused = 0
+        self.retried = 0
+        self.lookups = 0
+
+    def _resolve(self, host, port):
+        e = self._dns.get((host, port))
+        if e is not None and ticks_diff(ticks_ms(), e[1]) < self.dns_ttl_ms:
+            return e[0]
+        self.lookups += 1
+        addr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][-1]
+        self._dns[(host, port)] = (addr, ticks_ms())
+        return addr
+
+    def _connect(self, key):
+        proto, host, port = key
+        s = socket.socket()
+        s.settimeout(self.timeout)
+        try:
+            try:
+                s.connect(self._resolve(host, port))
+            except OSError:
+                # The address may have moved; look it up again
+                self._dns.pop((host, port), None)
+                s.connect(self._resolve(host, port))
+            if proto == "https":
+                s = ssl.wrap_socket(s, server_hostname=host)
+        except Exception:
+            s.close()
+            raise
+        self.connects += 1
+        return _Conn(s, key)
+
+    # Close idle connections past idle_ms
+    def evict(self):
+        now = ticks_ms()
+        for key, c in list(self._idle.items()):
+            if ticks_diff(now, c.used) >= self.idle_ms:
+                del self._idle[key]
+                c.sock.close()
+
+    def close(self):
+        for c in self._idle.values():
+            c.sock.close()
+        self._idle = {}
+
+    def request(self, method, url, data=None, json=None, headers=None):
+        proto, host, port, path = _parse(url)
+        key = (proto, host, port)
+        # The port is part of Host unless it is the scheme's own
+        if port != (443 if proto == "https" else 80):
+            host_hdr = "%s:%d" % (host, port)
+        else:
+            host_hdr = host
+        head = "%s %s HTTP/1.1\r\nHost: %s\r\n" % (method, path, host_hdr)
+        if headers:
+            for k, v in headers.items():
+                head += "%s: %s\r\n" % (k, v)
+        if json is not None:
+            data = _json_dumps(json)
+            if not headers or "Content-Type" not in headers:
+                head += "Content-Type: application/json\r\n"
+        if isinstance(data, str):
+            data = data.encode()
+        if data or method in ("POST", "PUT", "PATCH"):
+            head += "Content-Length: %d\r\n" % (len(data) if data else 0)
+        head = (head + "\r\n").encode()
+        self.evict()
+        c = self._idle.pop(key, None)
+        if c is not None:
+            self.reused += 1
+            try:
+                r = self._exchange(c, head, data, method)
+            except Exception:
+                c.sock.close()
+                raise
+            if r is not None:
+                return r
+            # The server closed it while it sat idle; nothing was
+            # answered, so send the request again on a new connection
+            c.sock.close()
+            self.retried += 1
+        c = self._connect(key)
+        try:
+            r = self._exchange(c, head, data, method)
+        except Exception:
+            c.sock.close()
+            raise
+        if r is None:
+            c.sock.close()
+            raise OSError("connection closed")
+        return r
+
+    # Send one request and read the response. Returns None when the
+    # connection turns out to be closed before any of the response came.
+    def _exchange(self, c, head, data, method):
+        s = c.sock
+        try:
+            if data and len(data) <= 1024:
+                # One segment: a second small write would wait for the
+                # server to ACK the first
+                s.write(head + data)
+            else:
+                s.write(head)
+                if data:
+                    s.write(data)
+            line = s.readline()
+        except OSError as e:
+            if e.args and e.args[0] in _CLOSED:
+                return None
+            raise
+        if not line:
+            return None
+        c.requests += 1
+        parts = line.split(None, 2)
+        if len(parts) < 2:
+            raise ValueError("bad status line")
+        status = int(parts[1])
+        reason = parts[2].rstrip().decode() if len(parts) > 2 else ""
+        headers = {}
+        while True:
+            line = s.readline()
+            if not line or line == b"\r\n":
+                break
+            k, _, v = line.decode().partition(":")
+            headers[k.strip().lower()] = v.strip()
+        keep = headers.get("connection", "").lower() != "close" and parts[0] != b"HTTP/1.0"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = self._chunked(s)
+        elif "content-length" in headers:
+            n = int(headers["content-length"])
+            body = s.read(n) if n else b""
+            if len(body) < n:
+                raise OSError("connection closed")
+        else:
+            body = s.read()
+            keep = False
+        if keep:
+            c.used = ticks_ms()
+            old = self._idle.get(c.key)
+            if old is not None:
+                old.sock.close()
+            self._idle[c.key] = c
+        else:
+            s.close()
+        return Response(status, reason, headers, body)
+
+    def _chunked(self, s):
+        body = b""
+        while True:
+            line = s.readline()
+            if not line:
+                raise OSError("connection closed")
+            n = int(line.split(b";")[0], 16)
+            if n == 0:
+                # Trailers, then the blank line
+                while s.readline() not in (b"\r\n", b""):
+                    pass
+                return body
+            body += s.read(n)
+            s.read(2)
+
+    def get(self, url, **kw):
+        return self.request("GET", url, **kw)
+
+    def post(self, url, **kw):
+        return self.request("POST", url, **kw)
+
+    def put(self, url, **kw):
+        return self.request("PUT", url, **kw)
+
+    def delete(self, url, **kw):
+        return self.request("DELETE", url, **kw)
+
+    def head(self, url, **kw):
+        return self.request("HEAD", url, **kw)
+
+
+# request()'s json argument hides the module there
+_json_dumps = json.dumps
+
+_session = None
+
+
+def session():
+    global _session
+    if _session is None:
+        _session = Session()
+    return _session
+
+
+def request(method, url, **kw):
+    return session().request(method, url, **kw)
+
+
+def get(url, **kw):
+    return session().request("GET", url, **kw)
+
+
+def post(url, **kw):
+    return session().request("POST", url, **kw)
+
+
+def put(url, **kw):
+    return session().request("PUT", url, **kw)
+
+
+def delete(url, **kw):
+    return session().request("DELETE", url, **kw)
+
+
+def head(url, **kw):
+    return session().request("HEAD", url, **kw)
@@ -0,0 +1,355 @@
+# Small HTTP/1.1 server on uasyncio: many connections at once, keep-alive
+# and a route table.
+#
+#   app = HTTPServer()
+#
+#   @app.route("/")
+#   def index(req):
+#       return "<p>Hello</p>"
+#
+#   asyncio.run(app.serve("0.0.0.0", 80))
+#
+# A route is an exact path, or a prefix ending in "*" ("/static/*", or
+# "/*" for everything); exact paths win, then the longest prefix.
+# Handlers take the Request and may be plain functions or coroutines.
+# They return the body (str or bytes, sent as text/html), (status, body)
+# or (status, body, headers) with headers a dict, which may set
+# Content-Type. A handler that streams its response itself calls
+# req.start() and writes to req.writer, and returns None.
+#
+# Requests are parsed line by line as they arrive, within max_line bytes
+# per line, max_headers headers and max_body bytes of body. No more than
+# max_line bytes are read ahead of the parser, so a line that runs past
+# it is answered 414 (request line) or 431 (header) without reading the
+# rest. A connection
+# is kept open for further requests unless the client asks otherwise,
+# until it has been idle for idle_ms.
+import uasyncio as asyncio
+
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    414: "URI Too Long",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+# Encoded response heads without extra headers: (status, length,
+# keep_alive) -> bytes
+_heads = {}
+
+
+# A request the server refuses with status instead of 400
+class _Refused(ValueError):
+    def __init__(self, status):
+        super().__init__(REASONS[status])
+        self.status = status
+
+
+# The connection's input, read in pieces of at most max_line bytes so
+# that a line is bounded before it has all arrived. Bytes past the line
+# being parsed are kept for the next one (or the body, or the next
+# request on the connection).
+class _Input:
+    def __init__(self, reader, max_line):
+        self.reader = reader
+        self.max_line = max_line
+        self.buf = b""
+        self.pos = 0
+
+    # The next line, ending in \n, or what was left at EOF. Raises
+    # _Refused(status) once max_line bytes have come without a \n.
+    async def line(self, status):
+        while True:
+            i = self.buf.find(b"\n", self.pos)
+            if i >= 0:
+                if i + 1 - self.pos > self.max_line:
+                    raise _Refused(status)
+                line = self.buf[self.pos : i + 1]
+                self.pos = i + 1
+                return line
+            n = len(self.buf) - self.pos
+            if n >= self.max_line:
+                raise _Refused(status)
+            data = await self.reader.read(self.max_line - n)
+            if not data:
+                line = self.buf[self.pos :]
+                self.buf = b""
+                self.pos = 0
+                return line
+            self.buf = self.buf[self.pos :] + data if n else data
+            self.pos = 0
+
+    async def readexactly(self, n):
+        data = self.buf[self.pos : self.pos + n]
+        self.pos += len(data)
+        if len(data) < n:
+            data += await self.reader.readexactly(n - len(data))
+        return data
+
+
+def _unquote(s):
+    if "%" not in s and "+" not in s:
+        return s
+    s = s.replace("+", " ")
+    parts = s.split("%")
+    out = bytearray(parts[0].encode())
+    for p in parts[1:]:
+        try:
+            out.append(int(p[:2], 16))
+            out += p[2:].encode()
+        except ValueError:
+            out += b"%" + p.encode()
+    return out.decode()
+
+
+class Request:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.remote = writer.get_extra_info("peername")
+        self.method = ""
+        self.path = ""
+        self.query = ""
+        self.headers = {}
+        self.body = b""
+        self.keep_alive = True
+        self.started = False
+        self._args = None
+
+    # Header value by lower-case name
+    def header(self, name, default=None):
+        return self.headers.get(name, default)
+
+    # Query string parameters, decoded
+    @property
+    def args(self):
+        if self._args is None:
+            self._args = {}
+            for kv in self.query.split("&"):
+                if kv:
+                    kv = kv.split("=", 1)
+                    self._args[_unquote(kv[0])] = _unquote(kv[1]) if len(kv) > 1 else ""
+        return self._args
+
+    # Write the status line and headers; the body follows on writer. Without
+    # a length the connection is closed after the response. A 204 or 304
+    # has no body, so it goes out with only the headers given.
+    async def start(self, status=200, headers=None, length=None):
+        self._start(status, headers, length)
+
+    # start() without yielding: a handler's body can then be written
+    # before any other task runs, so it may be a buffer the next request
+    # reuses (page_template)
+    def _start(self, status, headers, length):
+        self.started = True
+        bare = status == 204 or status == 304
+        if bare:
+            length = None
+        elif length is None:
+            self.keep_alive = False
+        key = None
+        if not headers:
+            key = (status, length, self.keep_alive)
+            h = _heads.get(key)
+            if h is not None:
+                self.writer.write(h)
+                return
+        h = "HTTP/1.1 %d %s\r\n" % (status, REASONS.get(status, ""))
+        if not bare and (not headers or "Content-Type" not in headers):
+            h += "Content-Type: text/html\r\n"
+        if headers:
+            for k, v in headers.items():
+                h += "%s: %s\r\n" % (k, v)
+        if length is not None:
+            h += "Content-Length: %d\r\n" % length
+        h += "Connection: keep-alive\r\n\r\n" if self.keep_alive else "Connection: close\r\n\r\n"
+        h = h.encode()
+        if key:
+            if len(_heads) >= 16:
+                _heads.clear()
+            _heads[key] = h
+        self.writer.write(h)
+
+
+class HTTPServer:
+    def __init__(self, max_conns=8, idle_ms=5000, max_line=512, max_headers=24, max_body=2048):
+        self.max_conns = max_conns
+        self.idle_ms = idle_ms
+        self.max_line = max_line
+        self.max_headers = max_headers
+        self.max_body = max_body
+        self.conns = 0
+        self.requests = 0
+        self.server = None
+        # path -> {method: handler}
+        self._routes = {}
+        # (prefix, {method: handler}), longest prefix first
+        self._prefixes = []
+
+    def add(self, path, handler, methods=("GET",)):
+        if path.endswith("*"):
+            path = path[:-1]
+            for p, table in self._prefixes:
+                if p == path:
+                    break
+            else:
+                table = {}
+                self._prefixes.append((path, table))
+                self._prefixes.sort(key=lambda e: -len(e[0]))
+        else:
+            table = self._routes.setdefault(path, {})
+        for m in methods:
+            table[m] = handler
+
+    def route(self, path, methods=("GET",)):
+        def register(handler):
+            self.add(path, handler, methods)
+            return handler
+
+        return register
+
+    def _find(self, path):
+        table = self._routes.get(path)
+        if table is None:
+            for p, t in self._prefixes:
+                if path.startswith(p):
+                    return t
+        return table
+
+    # Fill req from the connection. Returns False when the client is done
+    # (closed, or idle past idle_ms); raises ValueError on a bad request.
+    async def _read(self, req, inp):
+        t = self.idle_ms / 1000
+        try:
+            line = await asyncio.wait_for(inp.line(414), t)
+        except asyncio.TimeoutError:
+            return False
+        if not line:
+            return False
+        parts = line.decode().split()
+        if len(parts) != 3:
+            raise ValueError("bad request line")
+        req.method = parts[0]
+        target = parts[1].split("?", 1)
+        req.path = _unquote(target[0])
+        req.query = target[1] if len(target) > 1 else ""
+        req.keep_alive = parts[2] == "HTTP/1.1"
+        # The rest of the request gets one more idle_ms, not one per line
+        try:
+            await asyncio.wait_for(self._rest(req, inp), t)
+        except asyncio.TimeoutError:
+            raise ValueError("request timed out")
+        return True
+
+    async def _rest(self, req, inp):
+        headers = req.headers
+        while True:
+            line = await inp.line(431)
+            if line == b"\r\n" or line == b"\n" or not line:
+                break
+            if len(headers) == self.max_headers:
+                raise _Refused(431)
+            kv = line.decode().split(":", 1)
+            if len(kv) != 2:
+                raise ValueError("bad header")
+            headers[kv[0].strip().lower()] = kv[1].strip()
+        conn = headers.get("connection", "").lower()
+        if conn == "close":
+            req.keep_alive = False
+        elif conn == "keep-alive":
+            req.keep_alive = True
+        n = int(headers.get("content-length", 0))
+        if n > self.max_body:
+            raise _Refused(413)
+        if n:
+            req.body = await inp.readexactly(n)
+
+    async def _respond(self, req, status, body, headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        req._start(status, headers, len(body))
+        if req.method != "HEAD":
+            req.writer.write(body)
+        await req.writer.drain()
+
+    async def _dispatch(self, req):
+        table = self._find(req.path)
+        if table is None:
+            return await self._respond(req, 404, "Not Found")
+        handler = table.get(req.method)
+        if handler is None and req.method == "HEAD":
+            handler = table.get("GET")
+        if handler is None:
+            return await self._respond(req, 405, "Method Not Allowed")
+        r = handler(req)
+        if hasattr(r, "send"):
+            r = await r
+        if req.started:
+            await req.writer.drain()
+            return
+        if r is None:
+            r = b""
+        if isinstance(r, tuple):
+            await self._respond(req, *r)
+        else:
+            await self._respond(req, 200, r)
+
+    async def _conn(self, reader, writer):
+        if self.conns >= self.max_conns:
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await self._close(writer)
+            return
+        self.conns += 1
+        inp = _Input(reader, self.max_line)
+        try:
+            while True:
+                req = Request(reader, writer)
+                try:
+                    if not await self._read(req, inp):
+                        break
+                except ValueError as e:
+                    req.keep_alive = False
+                    status = e.status if isinstance(e, _Refused) else 400
+                    await self._respond(req, status, REASONS[status])
+                    break
+                self.requests += 1
+                try:
+                    await self._dispatch(req)
+                except OSError:
+                    raise
+                except Exception as e:
+                    print("http handler error:", repr(e))
+                    if req.started:
+                        break
+                    req.keep_alive = False
+                    await self._respond(req, 500, "Internal Server Error")
+                if not req.keep_alive:
+                    break
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.conns -= 1
+            await self._close(writer)
+
+    async def _close(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    async def serve(self, host="0.0.0.0", port=80, backlog=5):
+        self.server = await asyncio.start_server(self._conn, host, port, backlog=backlog)
+        await self.server.wait_closed()
+
+    def close(self):
+        if self.server:
+            self.server.close()
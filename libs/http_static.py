@@ -0,0 +1,106 @@
+# Files from flash for HTTPServer.
+#
+#   files = StaticFiles("/www", "/static/")
+#   app.add("/static/*", files.handler)
+#
+# GET /static/app.js sends /www/app.js. Files are streamed in chunk-byte
+# pieces through one buffer, so a large file costs no more RAM than a
+# small one. Put a gzipped copy next to a file (gzip -k app.js gives
+# app.js.gz) and clients that accept gzip get that instead; every
+# browser does, so the original can be left off the board if space is
+# short.
+#
+# Every response carries an ETag made from the file's size and time; a
+# request whose If-None-Match matches is answered 304 with no body, so a
+# browser revalidating its cache gets a few bytes instead of the file.
+import os
+from micropython import const
+
+_DIR = const(0x4000)
+
+MIME = {
+    "html": "text/html",
+    "htm": "text/html",
+    "css": "text/css",
+    "js": "application/javascript",
+    "json": "application/json",
+    "svg": "image/svg+xml",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "ico": "image/x-icon",
+    "txt": "text/plain",
+}
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if st[0] & _DIR:
+        return None
+    return st
+
+
+class StaticFiles:
+    # cache: Cache-Control value; the default has browsers check the ETag
+    # on every use
+    def __init__(self, root, prefix="/", index="index.html", chunk=1024, cache="no-cache"):
+        self.root = root.rstrip("/")
+        self.prefix = prefix
+        self.index = index
+        self.cache = cache
+        self._buf = bytearray(chunk)
+        self._mv = memoryview(self._buf)
+        self.sent = 0
+        self.not_modified = 0
+
+    def _path(self, req):
+        p = req.path[len(self.prefix) :] if req.path.startswith(self.prefix) else req.path
+        parts = [x for x in p.split("/") if x]
+        for x in parts:
+            if x == ".." or x == "." or "\\" in x:
+                return None
+        if not parts or req.path.endswith("/"):
+            parts.append(self.index)
+        return self.root + "/" + "/".join(parts)
+
+    async def handler(self, req):
+        path = self._path(req)
+        if path is None:
+            return 404, "Not Found"
+        ctype = MIME.get(path.rsplit(".", 1)[-1].lower(), "application/octet-stream")
+        gz = "gzip" in req.header("accept-encoding", "")
+        st = _stat(path + ".gz") if gz else None
+        if st is not None:
+            path += ".gz"
+        else:
+            gz = False
+            st = _stat(path)
+            if st is None:
+                return 404, "Not Found"
+        size = st[6]
+        etag = '"%x-%x%s"' % (size, st[8], "-gz" if gz else "")
+        headers = {"Content-Type": ctype, "ETag": etag, "Cache-Control": self.cache}
+        if gz:
+            headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        inm = req.header("if-none-match")
+        if inm is not None and (inm == "*" or etag in inm):
+            self.not_modified += 1
+            # Only the validators: _start sends a 304 without the
+            # Content-Type and Content-Length of the file it stands for
+            return 304, b"", {"ETag": etag, "Cache-Control": self.cache, "Vary": "Accept-Encoding"}
+        with open(path, "rb") as f:
+            await req.start(200, headers, size)
+            if req.method == "HEAD":
+                return
+            w = req.writer
+            buf, mv = self._buf, self._mv
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                w.write(mv[:n])
+                await w.drain()
+        self.sent += 1
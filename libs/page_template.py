@@ -0,0 +1,77 @@
+# HTML page with a few changing values, encoded once.
+#
+#   PAGE = Template("<p>Temperature is {temp} degrees</p>", temp=8)
+#   body = PAGE.render(temp="%.2f" % t)
+#
+# The text is encoded into one buffer when the Template is made, with
+# room reserved for each {name} slot: the keyword arguments give the
+# width of each, in bytes (default 16). render() writes the values into
+# their slots in place, padding with spaces, and returns the whole page
+# as a memoryview of that buffer. The page never changes size, so it can
+# go out with a Content-Length in one write, and nothing the size of the
+# page is allocated per request.
+#
+# Only {identifier} is a slot; other braces (CSS, scripts) are left as
+# they are. The buffer is shared by every request: write the result out
+# before the next render(). Under HTTPServer, return it from the handler
+# with no await after render(); the server writes a returned body
+# without yielding, and the stream keeps its own copy. A handler that has
+# to await after rendering should return bytes(page) instead.
+WIDTH = 16
+
+
+def _is_name(s):
+    if not s or s[0].isdigit():
+        return False
+    for c in s:
+        if not (c.isalpha() or c.isdigit() or c == "_"):
+            return False
+    return True
+
+
+class Template:
+    def __init__(self, text, **widths):
+        buf = bytearray()
+        # name -> (width, [start, ...])
+        self.slots = {}
+        i = 0
+        while True:
+            j = text.find("{", i)
+            k = text.find("}", j + 1) if j >= 0 else -1
+            if k < 0:
+                buf += text[i:].encode()
+                break
+            name = text[j + 1 : k]
+            if not _is_name(name):
+                buf += text[i : j + 1].encode()
+                i = j + 1
+                continue
+            buf += text[i:j].encode()
+            w = widths.get(name, WIDTH)
+            self.slots.setdefault(name, (w, []))[1].append(len(buf))
+            buf += b" " * w
+            i = k + 1
+        self.buf = buf
+        self._mv = memoryview(buf)
+        self._pad = memoryview(b" " * max([w for w, _ in self.slots.values()] or [0]))
+
+    def __len__(self):
+        return len(self.buf)
+
+    def fill(self, name, value):
+        w, starts = self.slots[name]
+        if isinstance(value, str):
+            value = value.encode()
+        n = len(value)
+        if n > w:
+            raise ValueError("value too long for slot " + name)
+        buf = self.buf
+        pad = self._pad[: w - n]
+        for start in starts:
+            buf[start : start + n] = value
+            buf[start + n : start + w] = pad
+
+    def render(self, **values):
+        for name, value in values.items():
+            self.fill(name, value)
+        return self._mv
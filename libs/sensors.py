@@ -0,0 +1,182 @@
+# Cached sensor readings shared by every part of a program that wants
+# them: web pages, the WebSocket loop, MQTT publishers.
+#
+#   reg = Registry()
+#   reg.add("temp", read_temperature, ttl_ms=2000)
+#   reg.add("water", water_level.read_u16, period_ms=500)
+#
+#   reg.get("temp")          # cached value; reads the sensor when stale
+#   await reg.aget("temp")   # the same from a uasyncio task
+#   reg.poll()               # from the main loop: refresh what is due
+#
+# A value is returned from the cache until it is ttl_ms old; after that
+# the next get() reads the sensor. Sensors with a period_ms are also
+# sampled by poll() (or the run() task) every period_ms, so readers find
+# a fresh value waiting. ttl_ms defaults to twice the period, or to one
+# second for sensors only read on demand.
+#
+# read may be a coroutine function, for sensors that have to wait for a
+# conversion. Such a sensor is read with aget() and sampled by run();
+# get() raises TypeError for it and poll() leaves it alone. While one
+# aget() is waiting on a read, other aget() calls for the same sensor
+# wait for that read instead of starting their own.
+#
+# When a read raises, the last good value is returned and the error is
+# counted; with no value yet the exception is raised. A failed sensor is
+# not read again before its period is up.
+import uasyncio as asyncio
+from utime import ticks_add, ticks_diff, ticks_ms
+
+
+class _Sensor:
+    def __init__(self, read, period_ms, ttl_ms):
+        self.read = read
+        self.period_ms = period_ms
+        self.ttl_ms = ttl_ms
+        self.value = None
+        self.ok = False
+        # The last read raised
+        self.failed = False
+        self.t = 0
+        # When poll() samples it next; every read, good or not, moves it
+        self.next = ticks_ms()
+        # Event set when the read in flight finishes
+        self.pending = None
+        # read turned out to be a coroutine function
+        self.coro = False
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.reads = 0
+        self.errors = 0
+
+
+class Registry:
+    def __init__(self):
+        self._sensors = {}
+
+    def add(self, name, read, period_ms=0, ttl_ms=None):
+        if ttl_ms is None:
+            ttl_ms = 2 * period_ms if period_ms else 1000
+        self._sensors[name] = _Sensor(read, period_ms, ttl_ms)
+
+    def get(self, name):
+        s = self._sensors[name]
+        if s.ok and ticks_diff(ticks_ms(), s.t) < s.ttl_ms:
+            s.hits += 1
+            return s.value
+        s.misses += 1
+        return self._sample(s)
+
+    async def aget(self, name):
+        s = self._sensors[name]
+        if s.ok and ticks_diff(ticks_ms(), s.t) < s.ttl_ms:
+            s.hits += 1
+            return s.value
+        if s.pending is not None:
+            s.collapsed += 1
+            await s.pending.wait()
+            return self._backoff(s)
+        s.misses += 1
+        return await self._asample(s)
+
+    # The last good value while a failed sensor waits for its retry
+    def _backoff(self, s):
+        if not s.ok:
+            raise OSError("sensor read failed")
+        return s.value
+
+    def _sample(self, s):
+        if s.coro:
+            raise TypeError("coroutine read: use aget()")
+        if s.failed and ticks_diff(ticks_ms(), s.next) < 0:
+            return self._backoff(s)
+        s.reads += 1
+        s.next = ticks_add(ticks_ms(), s.period_ms)
+        try:
+            v = s.read()
+        except Exception:
+            s.errors += 1
+            s.failed = True
+            if not s.ok:
+                raise
+            return s.value
+        if hasattr(v, "send"):
+            v.close()
+            s.coro = True
+            raise TypeError("coroutine read: use aget()")
+        s.value = v
+        s.ok = True
+        s.failed = False
+        s.t = ticks_ms()
+        return v
+
+    async def _asample(self, s):
+        if s.failed and ticks_diff(ticks_ms(), s.next) < 0:
+            return self._backoff(s)
+        ev = s.pending = asyncio.Event()
+        s.reads += 1
+        s.next = ticks_add(ticks_ms(), s.period_ms)
+        try:
+            v = s.read()
+            if hasattr(v, "send"):
+                v = await v
+            s.value = v
+            s.ok = True
+            s.failed = False
+            s.t = ticks_ms()
+        except Exception:
+            s.errors += 1
+            s.failed = True
+            if not s.ok:
+                raise
+        finally:
+            s.pending = None
+            ev.set()
+        return s.value
+
+    # Sample every sensor whose period has run out; call from the main
+    # loop. Read errors are only counted here.
+    def poll(self):
+        now = ticks_ms()
+        for s in self._sensors.values():
+            if s.period_ms and not s.coro and ticks_diff(now, s.next) >= 0:
+                try:
+                    self._sample(s)
+                except Exception:
+                    pass
+
+    # poll() as a uasyncio task, for coroutine reads as well
+    async def run(self):
+        while True:
+            now = ticks_ms()
+            wait = 1000
+            for s in self._sensors.values():
+                if not s.period_ms:
+                    continue
+                if ticks_diff(now, s.next) >= 0 and s.pending is None:
+                    try:
+                        await self._asample(s)
+                    except Exception:
+                        pass
+                    now = ticks_ms()
+                wait = min(wait, max(ticks_diff(s.next, now), 1))
+            await asyncio.sleep(wait / 1000)
+
+    # Per sensor: reads served from the cache or by joining a read in
+    # flight, reads that went to the sensor, and the share of the first
+    def stats(self):
+        out = {}
+        for name, s in self._sensors.items():
+            served = s.hits + s.collapsed
+            total = served + s.misses
+            out[name] = {
+                "hits": s.hits,
+                "collapsed": s.collapsed,
+                "misses": s.misses,
+                "reads": s.reads,
+                "errors": s.errors,
+                "hit_rate": served / total if total else 0.0,
+                "value": s.value,
+            }
+        return out
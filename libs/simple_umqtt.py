@@ -1,12 +1,127 @@
 import usocket as socket
-import struct
+import uselect as select
 from binascii import hexlify
+from utime import ticks_ms, ticks_diff, ticks_add
+from micropython import const
+
+try:
+    import errno
+except ImportError:
+    import uerrno as errno
 
 
 class MQTTException(Exception):
     pass
 
 
+# In-flight states. PUB, REL and REC are what umqtt_store persists.
+PUB = const(1)  # QoS 2 PUBLISH sent, waiting for PUBREC
+REL = const(2)  # PUBREL sent, waiting for PUBCOMP
+REC = const(3)  # inbound QoS 2 PUBLISH delivered, waiting for PUBREL
+ACK = const(4)  # QoS 1 PUBLISH sent, waiting for PUBACK
+
+# The write buffer grows to hold a whole PUBLISH frame up to this size;
+# a larger one goes out as header and payload in two writes
+_WBUF_MAX = const(1024)
+
+
+# Packet encoders. Each writes a whole frame into a caller-supplied buffer
+# so it can go out in a single write (one TCP segment on lwIP) instead of
+# one write per field.
+
+
+def _len_size(sz):
+    return 1 if sz < 0x80 else 2 if sz < 0x4000 else 3 if sz < 0x200000 else 4
+
+
+def _put_len(buf, i, sz):
+    while sz > 0x7F:
+        buf[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    buf[i] = sz
+    return i + 1
+
+
+def _put_str(buf, i, s):
+    n = len(s)
+    buf[i] = n >> 8
+    buf[i + 1] = n & 0xFF
+    buf[i + 2 : i + 2 + n] = s
+    return i + 2 + n
+
+
+def _bytes(s):
+    return s.encode() if isinstance(s, str) else s
+
+
+# Size of a PUBLISH frame up to (not including) the payload.
+def publish_header_size(topic, msg_len, qos):
+    sz = 2 + len(topic) + msg_len + (2 if qos else 0)
+    assert sz < 2097152
+    return 1 + _len_size(sz) + sz - msg_len
+
+
+def encode_publish_header(buf, topic, msg_len, retain=False, qos=0, pid=0, dup=False):
+    buf[0] = 0x30 | qos << 1 | retain | dup << 3
+    i = _put_len(buf, 1, 2 + len(topic) + msg_len + (2 if qos else 0))
+    i = _put_str(buf, i, topic)
+    if qos:
+        buf[i] = pid >> 8
+        buf[i + 1] = pid & 0xFF
+        i += 2
+    return i
+
+
+def connect_size(fields):
+    sz = 10
+    for f in fields:
+        sz += 2 + len(f)
+    return 1 + _len_size(sz) + sz
+
+
+# fields: client id, then will topic/message and user/password if present
+def encode_connect(buf, fields, flags, keepalive):
+    sz = 10
+    for f in fields:
+        sz += 2 + len(f)
+    buf[0] = 0x10
+    i = _put_len(buf, 1, sz)
+    i = _put_str(buf, i, b"MQTT")
+    buf[i] = 4
+    buf[i + 1] = flags
+    buf[i + 2] = keepalive >> 8
+    buf[i + 3] = keepalive & 0xFF
+    i += 4
+    for f in fields:
+        i = _put_str(buf, i, f)
+    return i
+
+
+def subscribe_size(topics):
+    sz = 2
+    for t, q in topics:
+        sz += 3 + len(t)
+    return 1 + _len_size(sz) + sz
+
+
+# topics: sequence of (topic filter, qos) pairs
+def encode_subscribe(buf, pid, topics):
+    sz = 2
+    for t, q in topics:
+        sz += 3 + len(t)
+    buf[0] = 0x82
+    i = _put_len(buf, 1, sz)
+    buf[i] = pid >> 8
+    buf[i + 1] = pid & 0xFF
+    i += 2
+    for t, q in topics:
+        i = _put_str(buf, i, t)
+        buf[i] = q
+        i += 1
+    return i
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -17,6 +132,12 @@ class MQTTClient:
         password=None,
         keepalive=0,
         ssl=None,
+        window=1,
+        retry_ms=5000,
+        bufsize=128,
+        rbufsize=256,
+        store=None,
+        queue=None,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -27,6 +148,7 @@ class MQTTClient:
         self.ssl = ssl
         self.pid = 0
         self.cb = None
+        self.cb_copy = False
         self.user = user
         self.pswd = password
         self.keepalive = keepalive
@@ -34,23 +156,118 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # Outbound QoS 1/2 publishes not yet acknowledged:
+        #   pid -> [topic, msg, retain, sent_ms, state, store slot]
+        # and inbound QoS 2 pids between PUBREC and PUBREL: pid -> slot.
+        # With a store, no more may be in flight than it has slots.
+        self.window = min(window, store.slots) if store else window
+        self.retry_ms = retry_ms
+        self._inflight = {}
+        self._rec = {}
+        self._poll = None
+        # Optional umqtt_store.InflightStore keeping QoS 2 state across reboots
+        self.store = store
+        if store:
+            for slot, st, pid, flags, topic, msg in store.load():
+                if st == REC:
+                    self._rec[pid] = slot
+                else:
+                    self._inflight[pid] = [topic, msg, flags & 1, 0, st, slot]
+        # Optional umqtt_queue.PublishQueue holding publishes made while
+        # the connection is down
+        self.queue = queue
+        self._drained = 0
+        # Keepalive engine, run from check_msg() when keepalive is set: a
+        # PINGREQ outstanding for ping_timeout_ms counts as missed, and
+        # max_missed in a row reconnect. Filters subscribed to are kept to
+        # be renewed if the broker did not keep the session.
+        self.ping_timeout_ms = 5000
+        self.max_missed = 2
+        self.last_rtt = -1
+        self.pings = 0
+        self.ping_misses = 0
+        self.reconnects = 0
+        self._subs = {}
+        self._clean = True
+        self._timeout = None
+        self._pinging = False
+        self._missed = 0
+        self._ping_ms = 0
+        self._last_tx = 0
+        self._last_rx = 0
+        # Reused for every outgoing frame; grown if a CONNECT or SUBSCRIBE
+        # does not fit, or a PUBLISH of up to _WBUF_MAX bytes.
+        self._wbuf = bytearray(bufsize)
+        self._ack = bytearray(b"\x40\x02\0\0")
+        # Receive buffer: bytes [_rs, _re) have been read but not parsed yet.
+        # Inbound packets are parsed in place and handed to the callback as
+        # memoryview slices of it.
+        self._rbuf = bytearray(rbufsize)
+        self._rmv = memoryview(self._rbuf)
+        self._rs = 0
+        self._re = 0
+        self._nb = False
+
+    def _buf(self, n):
+        if n > len(self._wbuf):
+            self._wbuf = bytearray(n)
+        return self._wbuf
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    # Make n unparsed bytes available in the receive buffer. A blocking
+    # socket is asked for exactly the missing bytes; a non-blocking one
+    # (check_msg) for as much as fits, so later packets are read ahead.
+    # Returns False if the socket is non-blocking and has nothing yet.
+    def _fill(self, n):
+        avail = self._re - self._rs
+        if avail >= n:
+            return True
+        if self._rs + n > len(self._rbuf):
+            if n > len(self._rbuf):
+                buf = bytearray(n)
+                buf[:avail] = self._rmv[self._rs : self._re]
+                self._rbuf = buf
+                self._rmv = memoryview(buf)
+            else:
+                self._rmv[:avail] = self._rmv[self._rs : self._re]
+            self._rs = 0
+            self._re = avail
+        s = self._conn()
+        while self._re - self._rs < n:
+            if self._nb:
+                r = s.readinto(self._rmv[self._re :])
+            else:
+                r = s.readinto(self._rmv[self._re : self._rs + n])
+            if r is None:
+                return False
+            if r == 0:
+                raise OSError(-1)
+            self._re += r
+            self._last_rx = ticks_ms()
+        return True
+
+    def _read(self, n):
+        self._fill(n)
+        self._rs += n
+        return self._rmv[self._rs - n : self._rs]
 
     def _recv_len(self):
         n = 0
         sh = 0
         while 1:
-            b = self.sock.read(1)[0]
+            self._fill(1)
+            b = self._rbuf[self._rs]
+            self._rs += 1
             n |= (b & 0x7F) << sh
             if not b & 0x80:
                 return n
             sh += 7
 
-    def set_callback(self, f):
+    # The callback gets topic and msg as memoryviews into the receive
+    # buffer, valid only until it returns. Pass copy=True to get bytes
+    # objects instead when the callback keeps references to them.
+    def set_callback(self, f, copy=False):
         self.cb = f
+        self.cb_copy = copy
 
     def set_last_will(self, topic, msg, retain=False, qos=0):
         assert 0 <= qos <= 2
@@ -65,107 +282,303 @@ class MQTTClient:
         self.sock.settimeout(timeout)
         addr = socket.getaddrinfo(self.server, self.port)[0][-1]
         self.sock.connect(addr)
+        self._rs = self._re = 0
+        self._nb = False
         if self.ssl:
             self.sock = self.ssl.wrap_socket(self.sock, server_hostname=self.server)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
-        sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
-        if self.user:
-            sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
+        flags = clean_session << 1
+        fields = [_bytes(self.client_id)]
         if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
+            fields += (_bytes(self.lw_topic), _bytes(self.lw_msg))
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
         if self.user:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        resp = self.sock.read(4)
+            fields += (_bytes(self.user), _bytes(self.pswd))
+            flags |= 0xC0
+        assert self.keepalive < 65536
+        buf = self._buf(connect_size(fields))
+        n = encode_connect(buf, fields, flags, self.keepalive)
+        # print(hex(n), hexlify(buf[:n], ":"))
+        self.sock.write(buf, n)
+        self._clean = clean_session
+        self._timeout = timeout
+        self._pinging = False
+        self._missed = 0
+        self._last_tx = ticks_ms()
+        resp = self._read(4)
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
             raise MQTTException(resp[3])
+        self._poll = select.poll()
+        self._poll.register(self.sock, select.POLLIN)
+        if clean_session:
+            # The broker has dropped its half of any inbound QoS 2 exchange
+            for slot in self._rec.values():
+                if slot is not None:
+                    self.store.free(slot)
+            self._rec = {}
+        # Anything still unacknowledged from a previous connection is resent
+        for pid, m in self._inflight.items():
+            self._resend(pid, m)
+        self._drained = ticks_ms()
         return resp[2] & 1
 
+    # A no-op once the connection has been lost
     def disconnect(self):
-        self.sock.write(b"\xe0\0")
-        self.sock.close()
+        if self.sock is None:
+            return
+        try:
+            self.sock.write(b"\xe0\0")
+        finally:
+            self.sock.close()
+
+    # The socket, or OSError(ENOTCONN) after _lost() has dropped it, so a
+    # caller catching network errors sees the same error as for a write
+    # on a dead link
+    def _conn(self):
+        if self.sock is None:
+            raise OSError(errno.ENOTCONN)
+        return self.sock
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        self._conn().write(b"\xc0\0")
+        self._last_tx = self._ping_ms = ticks_ms()
+        self._pinging = True
+        self.pings += 1
+
+    # Ping once nothing has been sent or received for half the keepalive
+    # period. A dead link is torn down within keepalive / 2 seconds plus
+    # max_missed * ping_timeout_ms, then a reconnect is attempted every
+    # ping_timeout_ms until one succeeds.
+    def _keepalive(self):
+        now = ticks_ms()
+        if self.sock is None:
+            if ticks_diff(now, self._ping_ms) >= self.ping_timeout_ms:
+                self._ping_ms = now
+                self._reconnect()
+            return
+        if self._pinging:
+            if ticks_diff(now, self._ping_ms) < self.ping_timeout_ms:
+                return
+            self._missed += 1
+            self.ping_misses += 1
+            if self._missed >= self.max_missed:
+                # Reconnect on the next call
+                self._lost()
+                self._ping_ms = ticks_add(now, -self.ping_timeout_ms)
+                return
+        else:
+            period = self.keepalive * 500
+            if ticks_diff(now, self._last_tx) < period and ticks_diff(now, self._last_rx) < period:
+                return
+        try:
+            self.ping()
+        except OSError:
+            self._lost()
+
+    def _reconnect(self):
+        try:
+            # Bounded, so a broker that accepts but never answers is retried
+            present = self.connect(self._clean, self._timeout or self.ping_timeout_ms / 1000)
+            if self._subs and not present:
+                self.subscribe(list(self._subs.items()))
+        except OSError:
+            self._lost()
+            return
+        self.reconnects += 1
 
+    def _next_pid(self):
+        while 1:
+            self.pid = self.pid % 65535 + 1
+            if self.pid not in self._inflight:
+                return self.pid
+
+    def _send_publish(self, topic, msg, retain, qos, pid, dup=False):
+        n = publish_header_size(topic, len(msg), qos)
+        buf = self._buf(n + len(msg) if n + len(msg) <= _WBUF_MAX else n)
+        i = encode_publish_header(buf, topic, len(msg), retain, qos, pid, dup)
+        n = i + len(msg)
+        s = self._conn()
+        if n <= len(buf):
+            buf[i:n] = msg
+            s.write(buf, n)
+        else:
+            s.write(buf, i)
+            s.write(msg)
+        self._last_tx = ticks_ms()
+
+    def _send_ctl(self, op, pid):
+        self._ack[0] = op
+        self._ack[2] = pid >> 8
+        self._ack[3] = pid & 0xFF
+        self._conn().write(self._ack)
+        self._last_tx = ticks_ms()
+
+    def _resend(self, pid, m):
+        if m[4] == REL:
+            self._send_ctl(0x62, pid)
+        else:
+            self._send_publish(m[0], m[1], m[2], 2 if m[4] == PUB else 1, pid, True)
+        m[3] = ticks_ms()
+
+    # Each frame goes out in one write, up to _WBUF_MAX (1 KB) with the
+    # header; a larger one in two, header then payload. A publish that
+    # finds the connection down raises OSError, or with a queue is queued
+    # instead. QoS 1/2 messages already in flight when
+    # it drops are resent by the next connect().
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
-        if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
-        if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+        topic = _bytes(topic)
+        msg = _bytes(msg)
+        if self.queue is None:
+            return self._publish(topic, msg, retain, qos)
+        if self.sock is None:
+            self.queue.put(topic, msg, retain, qos)
+            return
+        try:
+            self._publish(topic, msg, retain, qos)
+        except OSError:
+            self._lost()
+            if not qos:
+                self.queue.put(topic, msg, retain, qos)
+
+    def _lost(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self._nb = False
 
+    # Send up to queue.batch queued publishes, at most once every
+    # queue.interval_ms so the backlog does not starve live traffic.
+    # Each leaves the queue once it is sent (QoS 0) or held in flight
+    # (QoS 1/2), from where connect() resends it; a connection lost part
+    # way through leaves only the rest to be sent again, so none goes out
+    # twice under two packet ids.
+    def drain(self):
+        q = self.queue
+        if not q or self.sock is None or ticks_diff(ticks_ms(), self._drained) < q.interval_ms:
+            return 0
+        self._drained = ticks_ms()
+        n = 0
+        try:
+            for topic, msg, retain, qos in q.peek(q.batch):
+                pid = self.pid
+                try:
+                    self._publish(topic, msg, retain, qos)
+                except OSError:
+                    # Given a packet id, it is in flight already
+                    if qos and self.pid != pid:
+                        n += 1
+                    raise
+                n += 1
+        except OSError:
+            self._lost()
+        finally:
+            if n:
+                q.pop(n)
+        return n
+
+    def _publish(self, topic, msg, retain, qos):
+        # Before anything is recorded in flight, so nothing is resent on
+        # reconnect behind the caller's back
+        self._conn()
+        pid = 0
+        if qos:
+            pid = self._next_pid()
+            slot = None
+            if qos == 2 and self.store:
+                # Slots held by inbound QoS 2 messages count against the
+                # window too; wait for ours to complete (StoreFull if none
+                # are in flight to free one)
+                while self.store.full() and self._inflight:
+                    self._wait_ack()
+                # Persisted before it is sent, so a reboot can only repeat
+                # it with DUP set, which the broker discards.
+                slot = self.store.add(PUB, pid, retain | qos << 1, topic, msg)
+            # Kept for retransmission, so a caller's reused buffer is copied
+            if not isinstance(msg, bytes):
+                msg = bytes(msg)
+            self._inflight[pid] = [topic, msg, retain, ticks_ms(), PUB if qos == 2 else ACK, slot]
+        self._send_publish(topic, msg, retain, qos, pid)
+        # Up to self.window publishes may be awaiting acknowledgement at
+        # once; with the default window of 1 this is plain stop-and-wait.
+        while qos and len(self._inflight) >= self.window:
+            self._wait_ack()
+
+    # Block until every outstanding QoS 1/2 publish has been acknowledged.
+    def flush(self):
+        while self._inflight:
+            self._wait_ack()
+
+    def inflight(self):
+        return len(self._inflight)
+
+    # Process incoming packets until the earliest retransmit deadline,
+    # then resend whatever has timed out: PUBLISH with DUP set, or PUBREL.
+    def _wait_ack(self):
+        now = ticks_ms()
+        wait = self.retry_ms
+        for m in self._inflight.values():
+            wait = min(wait, self.retry_ms - ticks_diff(now, m[3]))
+        if self._re > self._rs or wait > 0 and self._poll.poll(wait):
+            self.wait_msg()
+        else:
+            self._retransmit()
+
+    def _retransmit(self):
+        now = ticks_ms()
+        for pid, m in self._inflight.items():
+            if ticks_diff(now, m[3]) >= self.retry_ms:
+                self._resend(pid, m)
+
+    # PUBACK, PUBREC, PUBREL or PUBCOMP for pid, in any order
+    def _on_ack(self, op, pid):
+        if op == 0x60:  # PUBREL: the broker has released an inbound QoS 2
+            slot = self._rec.pop(pid, None)
+            if slot is not None:
+                self.store.free(slot)
+            self._send_ctl(0x70, pid)
+            return
+        m = self._inflight.get(pid)
+        if op == 0x50:  # PUBREC
+            if m is not None and m[4] == PUB:
+                m[4] = REL
+                m[3] = ticks_ms()
+                if m[5] is not None:
+                    self.store.set_state(m[5], REL)
+            self._send_ctl(0x62, pid)
+        elif m is not None and (op == 0x40 and m[4] == ACK or op == 0x70 and m[4] == REL):
+            del self._inflight[pid]
+            if m[5] is not None:
+                self.store.free(m[5])
+
+    # topic may also be a list of (topic filter, qos) pairs, subscribed to
+    # with a single SUBSCRIBE packet
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        pid = self._next_pid()
+        if isinstance(topic, list):
+            topics = [(_bytes(t), q) for t, q in topic]
+        else:
+            topics = ((_bytes(topic), qos),)
+        buf = self._buf(subscribe_size(topics))
+        n = encode_subscribe(buf, pid, topics)
+        # print(hex(n), hexlify(buf[:n], ":"))
+        self._conn().write(buf, n)
+        self._last_tx = ticks_ms()
         while 1:
             op = self.wait_msg()
             if op == 0x90:
-                resp = self.sock.read(4)
-                # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
+                resp = self._read(self._recv_len())
+                # print(bytes(resp))
+                assert resp[0] << 8 | resp[1] == pid
+                for i in range(2, len(resp)):
+                    if resp[i] == 0x80:
+                        raise MQTTException(resp[i])
+                for t, q in topics:
+                    self._subs[t] = q
                 return
 
     # Wait for a single incoming MQTT message and process it.
@@ -173,41 +586,98 @@ class MQTTClient:
     # set by .set_callback() method. Other (internal) MQTT
     # messages processed internally.
     def wait_msg(self):
-        res = self.sock.read(1)
-        self.sock.setblocking(True)
-        if res is None:
+        ready = self._fill(1)
+        if self._nb:
+            self.sock.setblocking(True)
+            self._nb = False
+        if not ready:
             return None
-        if res == b"":
-            raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
+        b = self._rbuf
+        op = b[self._rs]
+        self._rs += 1
+        if op == 0xD0:  # PINGRESP
+            sz = self._read(1)[0]
             assert sz == 0
+            if self._pinging:
+                self.last_rtt = ticks_diff(ticks_ms(), self._ping_ms)
+                self._pinging = False
+                self._missed = 0
             return None
-        op = res[0]
-        if op & 0xF0 != 0x30:
+        kind = op & 0xF0
+        if 0x40 <= kind <= 0x70:  # PUBACK/PUBREC/PUBREL/PUBCOMP
+            self._fill(3)
+            i = self._rs
+            assert b[i] == 2
+            self._rs = i + 3
+            self._on_ack(kind, b[i + 1] << 8 | b[i + 2])
+            return op
+        if kind != 0x30:
             return op
         sz = self._recv_len()
-        topic_len = self.sock.read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
-        sz -= topic_len + 2
+        self._fill(sz)
+        b = self._rbuf
+        i = self._rs
+        topic_len = (b[i] << 8) | b[i + 1]
+        j = i + 2 + topic_len
+        topic = self._rmv[i + 2 : j]
         if op & 6:
-            pid = self.sock.read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.read(sz)
-        self.cb(topic, msg)
+            pid = b[j] << 8 | b[j + 1]
+            j += 2
+        msg = self._rmv[j : i + sz]
+        self._rs = i + sz
+        # A QoS 2 message already delivered but not yet released is a
+        # retransmission and must not reach the callback again. A new one
+        # is recorded before the callback runs, so a reset during it
+        # cannot deliver the message twice. With the store full it is left
+        # unanswered, and the broker sends it again later.
+        dup = False
+        if op & 6 == 4:
+            dup = pid in self._rec
+            if not dup:
+                if self.store and self.store.full():
+                    return op
+                self._rec[pid] = self.store.add(REC, pid) if self.store else None
+        if not dup:
+            if self.cb_copy:
+                topic = bytes(topic)
+                msg = bytes(msg)
+            self.cb(topic, msg)
         if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
+            self._send_ctl(0x40, pid)
         elif op & 6 == 4:
-            assert 0
+            self._send_ctl(0x50, pid)
         return op
 
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.
+    # With keepalive set it also runs the keepalive engine, and returns
+    # None rather than raising while a lost connection is being restored:
+    # a connection the broker closes (or that fails to write) is dropped
+    # at once, and the next call reconnects.
     def check_msg(self):
-        self.sock.setblocking(False)
-        return self.wait_msg()
\ No newline at end of file
+        if self.keepalive:
+            self._keepalive()
+        if self.sock is None:
+            if self.keepalive:
+                return None
+            raise OSError(-1)
+        if not self.keepalive:
+            return self._check()
+        try:
+            return self._check()
+        except OSError:
+            self._lost()
+            self._ping_ms = ticks_add(ticks_ms(), -self.ping_timeout_ms)
+            return None
+
+    def _check(self):
+        if self._inflight:
+            self._retransmit()
+        if self.queue:
+            self.drain()
+        self._conn()
+        if self._re == self._rs:
+            self.sock.setblocking(False)
+            self._nb = True
+        return self.wait_msg()
@@ -0,0 +1,104 @@
+# Server-Sent Events (text/event-stream) for HTTPServer: browsers keep
+# one connection open and are sent a value whenever it changes.
+#
+#   temp = EventStream(lambda: sensors.get("temp"), period_ms=2000, fmt="%.2f")
+#   app.add("/events", temp.handler)
+#
+#   // in the page
+#   new EventSource("/events").onmessage = e => el.textContent = e.data
+#
+# One task samples the value every period_ms while anyone is subscribed,
+# and stops when the last one leaves. A change is formatted once and
+# every subscriber is woken to send it; a subscriber that is still
+# sending an earlier event skips to the latest one, so a slow client
+# never holds up the others or the sampling. New subscribers get the
+# current value straight away. A comment line every keepalive_ms finds
+# clients that went away without closing.
+import uasyncio as asyncio
+from utime import ticks_diff, ticks_ms
+
+HEADERS = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+
+
+class EventStream:
+    # sample: function or coroutine function returning the value.
+    # fmt: % format for the event data, or None for str().
+    def __init__(self, sample, period_ms=1000, fmt=None, max_subscribers=4, keepalive_ms=15000, retry_ms=3000):
+        self.sample = sample
+        self.period_ms = period_ms
+        self.fmt = fmt
+        self.max_subscribers = max_subscribers
+        self.keepalive_ms = keepalive_ms
+        self.retry_ms = retry_ms
+        self.subscribers = 0
+        self.events = 0
+        self.samples = 0
+        self._id = 0
+        # The latest event, encoded
+        self._event = None
+        self._data = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    async def _sample(self):
+        v = self.sample()
+        if hasattr(v, "send"):
+            v = await v
+        self.samples += 1
+        data = str(v) if self.fmt is None else self.fmt % v
+        if data == self._data:
+            return
+        self._data = data
+        self._id += 1
+        self._event = ("id: %d\ndata: %s\n\n" % (self._id, data)).encode()
+        self.events += 1
+        # Wake everyone waiting on this change; later waits use a new one
+        ev = self._changed
+        self._changed = asyncio.Event()
+        ev.set()
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                try:
+                    await self._sample()
+                except Exception as e:
+                    print("sse sample error:", repr(e))
+                await asyncio.sleep(self.period_ms / 1000)
+        finally:
+            self._task = None
+
+    # Route handler: holds the connection until the client goes away
+    async def handler(self, req):
+        if self.subscribers >= self.max_subscribers:
+            return 503, "Too many subscribers"
+        self.subscribers += 1
+        try:
+            await req.start(200, HEADERS)
+            w = req.writer
+            w.write(("retry: %d\n\n" % self.retry_ms).encode())
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+            sent = 0
+            last = ticks_ms()
+            while True:
+                if self._id != sent and self._event is not None:
+                    sent = self._id
+                    w.write(self._event)
+                    await w.drain()
+                    last = ticks_ms()
+                    continue
+                left = self.keepalive_ms - ticks_diff(ticks_ms(), last)
+                if left <= 0:
+                    w.write(b":\n\n")
+                    await w.drain()
+                    last = ticks_ms()
+                    continue
+                try:
+                    await asyncio.wait_for(self._changed.wait(), left / 1000)
+                except asyncio.TimeoutError:
+                    pass
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.subscribers -= 1
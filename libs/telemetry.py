@@ -0,0 +1,133 @@
+# Schema-driven binary encoding for sensor records sent over MQTT.
+#
+# A record is one schema id byte followed by its fields packed with
+# (u)struct, little endian. Floats can be sent as integers scaled by a
+# fixed factor. The same module decodes on the host (CPython struct) so
+# both ends share one set of schemas.
+#
+#   payload = GPS_FIX.encode(b"SM-002", -1.2921, 36.8219)
+#   client.publish(b"sensors/gps", payload)
+#
+#   name, record = telemetry.decode(payload)   # on the host
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+_SCHEMAS = {}
+
+
+class Schema:
+    # fields: (name, struct format[, scale]) per field, e.g.
+    # ("latitude", "i", 10000000) sends degrees as a 1e-7 fixed point int.
+    # "Ns" fields hold up to N bytes, zero padded; encode() raises
+    # ValueError for a longer value rather than cut it short.
+    def __init__(self, sid, name, fields):
+        assert 0 < sid < 256 and sid not in _SCHEMAS
+        self.sid = sid
+        self.name = name
+        self.names = tuple(f[0] for f in fields)
+        self._fmts = tuple("<" + f[1] for f in fields)
+        self._scales = tuple(f[2] if len(f) > 2 else 0 for f in fields)
+        self._lens = tuple(struct.calcsize(f) if f[-1] == "s" else 0 for f in self._fmts)
+        offs = []
+        i = 1
+        for fmt in self._fmts:
+            offs.append(i)
+            i += struct.calcsize(fmt)
+        self._offs = tuple(offs)
+        self.size = i
+        # Reused by encode(); see there
+        self._buf = bytearray(i)
+        self._buf[0] = sid
+        _SCHEMAS[sid] = self
+
+    # Pack values in field order. Returns the schema's own buffer, which
+    # the next encode() overwrites; MQTTClient.publish copies it if the
+    # message has to be kept for retransmission.
+    def encode(self, *values):
+        assert len(values) == len(self._fmts)
+        buf = self._buf
+        for i in range(len(values)):
+            v = values[i]
+            s = self._scales[i]
+            if s:
+                v = round(v * s)
+            elif isinstance(v, str):
+                v = v.encode()
+            if self._lens[i] and len(v) > self._lens[i]:
+                raise ValueError("%s longer than %d bytes" % (self.names[i], self._lens[i]))
+            struct.pack_into(self._fmts[i], buf, self._offs[i], v)
+        return buf
+
+    def encode_dict(self, d):
+        return self.encode(*[d[n] for n in self.names])
+
+    def decode(self, payload):
+        assert payload[0] == self.sid and len(payload) == self.size
+        out = {}
+        for i in range(len(self.names)):
+            v = struct.unpack_from(self._fmts[i], payload, self._offs[i])[0]
+            s = self._scales[i]
+            if s:
+                v = v / s
+            elif isinstance(v, bytes):
+                v = v.rstrip(b"\0")
+            out[self.names[i]] = v
+        return out
+
+
+# Batches of readings of one sensor, built by umqtt_batch.Aggregator:
+# header of id 0, sample struct format (as a character code), count, first sample ticks_ms, scale,
+# min, max, mean; then per sample its ms offset from the first and value.
+BATCH = 0
+BATCH_FMT = "<BBHIffff"
+
+
+def decode_batch(payload):
+    _, fmt, count, t0, scale, lo, hi, mean = struct.unpack_from(BATCH_FMT, payload, 0)
+    sfmt = "<H" + chr(fmt)
+    i = struct.calcsize(BATCH_FMT)
+    step = struct.calcsize(sfmt)
+    samples = []
+    for _ in range(count):
+        dt, v = struct.unpack_from(sfmt, payload, i)
+        samples.append((dt, v / scale if scale else v))
+        i += step
+    return {"t0": t0, "min": lo, "max": hi, "mean": mean, "samples": samples}
+
+
+# Returns (schema name, {field: value}) for a payload of any known schema,
+# or ("batch", decode_batch(payload)) for a batch
+def decode(payload):
+    if payload[0] == BATCH:
+        return "batch", decode_batch(payload)
+    s = _SCHEMAS.get(payload[0])
+    if s is None:
+        raise ValueError("unknown telemetry schema %d" % payload[0])
+    return s.name, s.decode(payload)
+
+
+# GPS fix published by training/mqqt.py publishRoute. The fleet number is
+# the client id, up to 16 bytes.
+GPS_FIX = Schema(
+    1,
+    "gps_fix",
+    (
+        ("fleetNo", "16s"),
+        ("latitude", "i", 10000000),
+        ("longitude", "i", 10000000),
+    ),
+)
+
+# Plant monitor sample: DHT11 temperature (C) and humidity (%), raw
+# water level ADC reading
+PLANT = Schema(
+    2,
+    "plant",
+    (
+        ("temperature", "b"),
+        ("humidity", "B"),
+        ("water", "H"),
+    ),
+)
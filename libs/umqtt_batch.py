@@ -0,0 +1,95 @@
+# Aggregation in front of MQTTClient.publish: readings are collected per
+# topic and published as one telemetry batch (see telemetry.decode_batch)
+# carrying every sample plus min/max/mean, instead of one message each.
+#
+#   agg = Aggregator(client)
+#   agg.add_sensor(b"plant/1/temp", window_ms=30000, max_samples=30)
+#   agg.add_sensor(b"plant/1/water", fmt="H", window_ms=10000)
+#   while True:
+#       agg.add(b"plant/1/temp", dht.temperature())
+#       agg.poll()
+#
+# A batch goes out when it holds max_samples readings or its first
+# reading is window_ms old, whichever comes first.
+import ustruct as struct
+from utime import ticks_ms, ticks_diff
+from telemetry import BATCH, BATCH_FMT
+
+_HDR = struct.calcsize(BATCH_FMT)
+
+
+class _Series:
+    def __init__(self, window_ms, max_samples, fmt, scale, qos):
+        assert window_ms < 65536
+        self.window_ms = window_ms
+        self.max_samples = max_samples
+        self.fmt = "<H" + fmt
+        self.code = ord(fmt)
+        self.scale = scale
+        self.qos = qos
+        self.step = struct.calcsize(self.fmt)
+        self.buf = bytearray(_HDR + max_samples * self.step)
+        self.mv = memoryview(self.buf)
+        self.n = 0
+        self.t0 = 0
+        self.lo = 0.0
+        self.hi = 0.0
+        self.sum = 0.0
+
+
+class Aggregator:
+    def __init__(self, client):
+        self.client = client
+        self._series = {}
+        self.readings = 0
+        self.batches = 0
+
+    # fmt is the struct format of one sample. Integer formats with a scale
+    # carry value * scale, e.g. fmt="h", scale=100 for 0.01 resolution.
+    def add_sensor(self, topic, window_ms=10000, max_samples=32, fmt="f", scale=0, qos=0):
+        self._series[topic] = _Series(window_ms, max_samples, fmt, scale, qos)
+
+    def add(self, topic, value, t=None):
+        s = self._series[topic]
+        if t is None:
+            t = ticks_ms()
+        if s.n and ticks_diff(t, s.t0) >= s.window_ms:
+            self._flush(topic, s)
+        if not s.n:
+            s.t0 = t
+            s.lo = s.hi = value
+            s.sum = 0.0
+        elif value < s.lo:
+            s.lo = value
+        elif value > s.hi:
+            s.hi = value
+        s.sum += value
+        v = round(value * s.scale) if s.scale else value
+        struct.pack_into(s.fmt, s.buf, _HDR + s.n * s.step, ticks_diff(t, s.t0), v)
+        s.n += 1
+        self.readings += 1
+        if s.n == s.max_samples:
+            self._flush(topic, s)
+
+    # Publish every batch whose window has run out; call from the main loop
+    def poll(self, t=None):
+        if t is None:
+            t = ticks_ms()
+        for topic, s in self._series.items():
+            if s.n and ticks_diff(t, s.t0) >= s.window_ms:
+                self._flush(topic, s)
+
+    # Publish everything collected so far, e.g. before a deep sleep
+    def flush(self):
+        for topic, s in self._series.items():
+            if s.n:
+                self._flush(topic, s)
+
+    def _flush(self, topic, s):
+        struct.pack_into(
+            BATCH_FMT, s.buf, 0, BATCH, s.code, s.n, s.t0 & 0xFFFFFFFF, s.scale, s.lo, s.hi, s.sum / s.n
+        )
+        n = s.n
+        s.n = 0
+        self.batches += 1
+        self.client.publish(topic, s.mv[: _HDR + n * s.step], False, s.qos)
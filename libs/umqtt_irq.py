@@ -0,0 +1,148 @@
+# Publishing from Pin.irq handlers.
+#
+# An interrupt handler must not do socket I/O or allocate. post() only
+# copies topic and message into a preallocated ring of fixed-size slots;
+# the ring is drained into the MQTT client from the main loop, or from a
+# micropython.schedule() callback when schedule=True.
+#
+#   pub = IRQPublisher(client)
+#   pin.irq(trigger=Pin.IRQ_RISING, handler=lambda p: pub.post(TOPIC, MSG))
+#   while True:
+#       pub.check_msg()  # in place of client.check_msg()
+#       time.sleep_ms(100)
+#
+# A post() that finds the ring full is coalesced into the newest message
+# queued if it is identical to it (a burst of presses, or contact bounce,
+# gives one publish), and dropped otherwise. Both are counted; while
+# there is room every post is published. While the client is
+# disconnected posts stay in the ring, and are published once its
+# keepalive has reconnected.
+import micropython
+
+
+class IRQPublisher:
+    def __init__(self, client, slots=8, topic_max=32, msg_max=64, schedule=False):
+        assert topic_max < 256 and msg_max < 256
+        self.client = client
+        self.slots = slots
+        self.topic_max = topic_max
+        self.msg_max = msg_max
+        self.schedule = schedule
+        self.posted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._topics = bytearray(slots * topic_max)
+        self._msgs = bytearray(slots * msg_max)
+        self._tlen = bytearray(slots)
+        self._mlen = bytearray(slots)
+        self._flags = bytearray(slots)
+        self._tmv = memoryview(self._topics)
+        self._mmv = memoryview(self._msgs)
+        # Positions run modulo 2 * slots so that full and empty differ;
+        # head is only written by post(), tail only by drain().
+        self._head = 0
+        self._tail = 0
+        self._busy = False
+        # Slot drain() is publishing, which post() must not merge into
+        self._sending = -1
+        self._scheduled = False
+        self._drain_cb = self._on_schedule
+
+    def pending(self):
+        return (self._head - self._tail) % (2 * self.slots)
+
+    def _same(self, s, topic, msg, flags):
+        if self._tlen[s] != len(topic) or self._mlen[s] != len(msg) or self._flags[s] != flags:
+            return False
+        o = s * self.topic_max
+        for i in range(len(topic)):
+            if self._topics[o + i] != topic[i]:
+                return False
+        o = s * self.msg_max
+        for i in range(len(msg)):
+            if self._msgs[o + i] != msg[i]:
+                return False
+        return True
+
+    # Safe to call from a hard IRQ handler: bytes are copied one at a time
+    # and only small ints are created. Returns False if the post was dropped.
+    def post(self, topic, msg, retain=False, qos=0):
+        flags = retain | qos << 1
+        if self.pending() == self.slots:
+            s = (self._head - 1) % self.slots
+            if s != self._sending and self._same(s, topic, msg, flags):
+                self.coalesced += 1
+                return True
+            self.dropped += 1
+            return False
+        if len(topic) > self.topic_max or len(msg) > self.msg_max:
+            self.dropped += 1
+            return False
+        s = self._head % self.slots
+        o = s * self.topic_max
+        for i in range(len(topic)):
+            self._topics[o + i] = topic[i]
+        o = s * self.msg_max
+        for i in range(len(msg)):
+            self._msgs[o + i] = msg[i]
+        self._tlen[s] = len(topic)
+        self._mlen[s] = len(msg)
+        self._flags[s] = flags
+        self._head = (self._head + 1) % (2 * self.slots)
+        self.posted += 1
+        if self.schedule and not self._scheduled:
+            try:
+                micropython.schedule(self._drain_cb, None)
+                self._scheduled = True
+            except RuntimeError:
+                pass  # schedule queue full: the main loop will drain
+        return True
+
+    def _on_schedule(self, _):
+        self._scheduled = False
+        # The main loop is using the client; it drains on its next pass
+        if not self._busy:
+            self.drain()
+
+    # Publish everything posted so far. Main loop context only. Stops at
+    # the first publish that fails, leaving it and the rest pending; the
+    # client's check_msg() reports the broken link.
+    def drain(self):
+        c = self.client
+        n = 0
+        while self._tail != self._head and c.sock is not None:
+            s = self._tail % self.slots
+            o = s * self.topic_max
+            topic = self._tmv[o : o + self._tlen[s]]
+            o = s * self.msg_max
+            msg = self._mmv[o : o + self._mlen[s]]
+            flags = self._flags[s]
+            if flags & 6:
+                # Kept for retransmission after the slot is reused
+                topic = bytes(topic)
+                msg = bytes(msg)
+            pid = c.pid
+            self._sending = s
+            try:
+                c.publish(topic, msg, flags & 1, flags >> 1)
+            except OSError:
+                # Unless the client gave it a packet id: then it is in
+                # flight, and resent by the client on reconnect
+                if flags & 6 and c.pid != pid:
+                    self._tail = (self._tail + 1) % (2 * self.slots)
+                break
+            finally:
+                self._sending = -1
+            self._tail = (self._tail + 1) % (2 * self.slots)
+            n += 1
+        return n
+
+    # client.check_msg() preceded by drain(); a scheduled drain that fires
+    # meanwhile leaves the client alone instead of interleaving packets.
+    def check_msg(self):
+        self._busy = True
+        try:
+            self.drain()
+            return self.client.check_msg()
+        finally:
+            self._busy = False
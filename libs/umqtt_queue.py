@@ -0,0 +1,188 @@
+# Flash-backed queue of publishes made while the broker is unreachable.
+#
+# Records are appended to a fixed-size circular log file; when it is full
+# the oldest records are dropped. Read and write pointers live in a small
+# index file with two slots written alternately, so a power cut while the
+# index is being updated leaves the previous copy intact. The write
+# pointer is only saved every `sync` appends: on load the log is scanned
+# forward from the saved pointer for records carrying the expected
+# sequence number.
+#
+#   queue = PublishQueue("mqtt.q")
+#   client = MQTTClient(client_id, server, queue=queue)
+#
+# client.publish() then queues instead of raising OSError when the
+# connection is down, and check_msg()/drain() send the backlog `batch`
+# messages at a time, at most once every `interval_ms`, after reconnect.
+import ustruct as struct
+from micropython import const
+
+# magic, sequence, flags (retain | qos << 1), topic length, message length
+_REC_FMT = "<BHBHH"
+_REC = const(8)
+_MAGIC = const(0xA5)
+# Written where a record would not fit before the end of the log
+_WRAP = const(0x5A)
+
+# generation, head, tail, count, sequence, checksum
+_IDX_FMT = "<IIIHHB"
+_IDX = const(17)
+
+
+def _check(b):
+    s = 0
+    for i in range(_IDX - 1):
+        s += b[i]
+    return s & 0xFF
+
+
+def _open(path):
+    try:
+        return open(path, "r+b")
+    except OSError:
+        return open(path, "w+b")
+
+
+class PublishQueue:
+    def __init__(self, path, size=16384, batch=8, interval_ms=200, sync=8):
+        self.size = size
+        self.batch = batch
+        self.interval_ms = interval_ms
+        self.sync = sync
+        self.dropped = 0
+        self._f = _open(path)
+        self._ix = _open(path + ".idx")
+        self._hdr = bytearray(_REC)
+        self._idx = bytearray(_IDX)
+        self._gen = 0
+        self._head = 0
+        self._tail = 0
+        self.count = 0
+        self._seq = 0
+        self._dirty = 0
+        self._load_index()
+        self._recover()
+
+    def __len__(self):
+        return self.count
+
+    def _load_index(self):
+        best = None
+        for slot in (0, 1):
+            self._ix.seek(slot * _IDX)
+            if self._ix.readinto(self._idx) != _IDX or _check(self._idx) != self._idx[_IDX - 1]:
+                continue
+            v = struct.unpack(_IDX_FMT, self._idx)
+            if best is None or v[0] > best[0]:
+                best = v
+        if best:
+            self._gen, self._head, self._tail, self.count, self._seq, _ = best
+
+    def _save_index(self):
+        self._gen += 1
+        struct.pack_into(_IDX_FMT, self._idx, 0, self._gen, self._head, self._tail, self.count, self._seq, 0)
+        self._idx[_IDX - 1] = _check(self._idx)
+        self._ix.seek((self._gen & 1) * _IDX)
+        self._ix.write(self._idx)
+        self._ix.flush()
+        self._dirty = 0
+
+    # Pick up records appended after the index was last saved
+    def _recover(self):
+        while True:
+            pos = self._read_hdr(self._head)
+            if pos is None:
+                return
+            magic, seq, _, tlen, mlen = struct.unpack(_REC_FMT, self._hdr)
+            n = _REC + tlen + mlen
+            if magic != _MAGIC or seq != self._seq or pos + n > self.size or not self._fits(pos, n):
+                return
+            self._head = pos + n
+            self._seq = (self._seq + 1) & 0xFFFF
+            self.count += 1
+
+    # Read the record header at pos, following a wrap marker back to 0.
+    # Returns the position of the record, or None past the end of the file.
+    def _read_hdr(self, pos):
+        if pos + _REC > self.size:
+            pos = 0
+        f = self._f
+        f.seek(pos)
+        n = f.readinto(self._hdr)
+        if n and self._hdr[0] == _WRAP and pos:
+            return self._read_hdr(self.size)
+        return pos if n == _REC else None
+
+    def _fits(self, p, n):
+        if not self.count:
+            return True
+        if self._tail < self._head:
+            return p >= self._head or p + n <= self._tail
+        return p >= self._head and p + n <= self._tail
+
+    def put(self, topic, msg, retain=False, qos=0):
+        n = _REC + len(topic) + len(msg)
+        if n > self.size:
+            raise ValueError("message too large for publish queue")
+        while True:
+            p = self._head if self._head + n <= self.size else 0
+            if self._fits(p, n):
+                break
+            # Full: drop the oldest eighth of the records, so that the index
+            # is rewritten once per batch of drops rather than on every put
+            k = max(1, self.count >> 3)
+            self._skip(k)
+            self.dropped += k
+            self._dirty = self.sync
+        f = self._f
+        if p != self._head and self._head + 1 <= self.size:
+            f.seek(self._head)
+            f.write(bytes((_WRAP,)))
+        # Body before header, so a torn write is never recovered as a record
+        f.seek(p + _REC)
+        f.write(topic)
+        f.write(msg)
+        struct.pack_into(_REC_FMT, self._hdr, 0, _MAGIC, self._seq, retain | qos << 1, len(topic), len(msg))
+        f.seek(p)
+        f.write(self._hdr)
+        f.flush()
+        self._head = p + n
+        self._seq = (self._seq + 1) & 0xFFFF
+        self.count += 1
+        self._dirty += 1
+        if self._dirty >= self.sync:
+            self._save_index()
+
+    # The oldest k records as (topic, msg, retain, qos), without removing them
+    def peek(self, k=1):
+        out = []
+        pos = self._tail
+        f = self._f
+        for _ in range(min(k, self.count)):
+            pos = self._read_hdr(pos)
+            _, _, flags, tlen, mlen = struct.unpack(_REC_FMT, self._hdr)
+            out.append((f.read(tlen), f.read(mlen), flags & 1, flags >> 1 & 3))
+            pos += _REC + tlen + mlen
+        return out
+
+    def _skip(self, k):
+        for _ in range(min(k, self.count)):
+            pos = self._read_hdr(self._tail)
+            _, _, _, tlen, mlen = struct.unpack(_REC_FMT, self._hdr)
+            self._tail = pos + _REC + tlen + mlen
+            self.count -= 1
+        if not self.count:
+            # Start the next record at a known place; the sequence number
+            # keeps stale records beyond it from being recovered.
+            self._head = self._tail = 0
+
+    # Remove the oldest k records once they have been sent
+    def pop(self, k=1):
+        self._skip(k)
+        self._save_index()
+
+    def close(self):
+        if self._dirty:
+            self._save_index()
+        self._f.close()
+        self._ix.close()
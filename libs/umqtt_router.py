@@ -0,0 +1,124 @@
+# Per-filter handlers for MQTT subscriptions.
+#
+# Filters (with + and # wildcards) are kept in a trie keyed on topic
+# levels as bytes, so matching never decodes the topic to str. Handlers
+# take (topic, msg) like a set_callback() callback.
+#
+#   router = TopicRouter()
+#   router.add(b"plant/+/moisture", on_moisture)
+#   router.add(b"music/#", on_song, qos=1)
+#   client.set_callback(router.dispatch)
+#   client.connect()
+#   router.subscribe(client)  # one SUBSCRIBE for every filter
+
+
+# Trie node: [children by level, handlers]
+def _node():
+    return [{}, []]
+
+
+class TopicRouter:
+    def __init__(self, default=None, cache=32):
+        self._root = _node()
+        self._filters = {}
+        # Called with messages no filter matches
+        self.default = default
+        # Handlers per exact topic for the most recent topics seen, as
+        # nodes mostly publish and receive on a handful of fixed topics
+        self._cache = {}
+        self._cache_size = cache
+
+    def add(self, flt, handler, qos=0):
+        flt = flt.encode() if isinstance(flt, str) else bytes(flt)
+        node = self._root
+        for level in flt.split(b"/"):
+            nxt = node[0].get(level)
+            if nxt is None:
+                nxt = node[0][level] = _node()
+            node = nxt
+        node[1].append(handler)
+        self._filters[flt] = max(qos, self._filters.get(flt, 0))
+        self._cache = {}
+
+    # Remove one handler from flt, or all of them if handler is None
+    def remove(self, flt, handler=None):
+        flt = flt.encode() if isinstance(flt, str) else bytes(flt)
+        path = [self._root]
+        for level in flt.split(b"/"):
+            node = path[-1][0].get(level)
+            if node is None:
+                return
+            path.append(node)
+        hs = path[-1][1]
+        if handler is None:
+            hs.clear()
+        elif handler in hs:
+            hs.remove(handler)
+        if not hs:
+            self._filters.pop(flt, None)
+            # Prune nodes left without handlers or children
+            levels = flt.split(b"/")
+            for i in range(len(levels), 0, -1):
+                node = path[i]
+                if node[0] or node[1]:
+                    break
+                del path[i - 1][0][levels[i - 1]]
+        self._cache = {}
+
+    # (filter, qos) pairs for MQTTClient.subscribe()
+    def filters(self):
+        return list(self._filters.items())
+
+    def subscribe(self, client):
+        if self._filters:
+            client.subscribe(self.filters())
+
+    def match(self, topic):
+        t = topic if isinstance(topic, bytes) else bytes(topic)
+        hs = self._cache.get(t)
+        if hs is None:
+            out = []
+            # Topics starting with $ are not matched by a leading wildcard
+            self._match(self._root, t, 0, out, t[:1] == b"$")
+            hs = tuple(out)
+            if len(self._cache) >= self._cache_size:
+                self._cache = {}
+            self._cache[t] = hs
+        return hs
+
+    def _match(self, node, t, i, out, sys):
+        kids = node[0]
+        if not sys:
+            n = kids.get(b"#")
+            if n:
+                out.extend(n[1])
+        j = t.find(b"/", i)
+        last = j < 0
+        if last:
+            j = len(t)
+        n = kids.get(t[i:j])
+        if n:
+            self._leaf(n, t, j, out, last)
+        if not sys:
+            n = kids.get(b"+")
+            if n:
+                self._leaf(n, t, j, out, last)
+
+    def _leaf(self, n, t, j, out, last):
+        if last:
+            out.extend(n[1])
+            # "a/#" also matches "a"
+            n = n[0].get(b"#")
+            if n:
+                out.extend(n[1])
+        else:
+            self._match(n, t, j + 1, out, False)
+
+    # Call every handler whose filter matches topic; returns how many
+    def dispatch(self, topic, msg):
+        hs = self.match(topic)
+        for h in hs:
+            h(topic, msg)
+        if not hs and self.default:
+            self.default(topic, msg)
+        return len(hs)
@@ -0,0 +1,100 @@
+# Flash-backed table of QoS 2 handshakes in flight for simple_umqtt.
+#
+# One file of fixed-size slots. Recording a message writes its slot once;
+# every later state change rewrites a single byte, so a reboot part-way
+# through PUBREC/PUBREL/PUBCOMP resumes instead of dropping or repeating
+# the message.
+#
+#   store = InflightStore("mqtt.inf")
+#   client = MQTTClient(client_id, server, store=store)
+#   client.connect(clean_session=False)
+import ustruct as struct
+from micropython import const
+
+# Slot states other than FREE are simple_umqtt's PUB, REL and REC
+FREE = const(0)
+
+# state, flags (retain | qos << 1), pid, topic length, message length
+_HDR_FMT = "<BBHHH"
+_HDR = const(8)
+
+
+# Raised by add() when every slot is taken. Not an OSError: the link is
+# fine, there is only no room to record another handshake.
+class StoreFull(Exception):
+    pass
+
+
+class InflightStore:
+    def __init__(self, path, slots=8, slot_size=128):
+        assert slot_size > _HDR
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._state = bytearray(slots)
+        self._hdr = bytearray(_HDR)
+        self._byte = bytearray(1)
+        try:
+            self._f = open(path, "r+b")
+        except OSError:
+            self._f = open(path, "w+b")
+        f = self._f
+        for i in range(slots):
+            f.seek(i * slot_size)
+            if f.readinto(self._hdr) == _HDR:
+                self._state[i] = self._hdr[0]
+            else:
+                # New or short file: lay down an empty slot
+                f.seek(i * slot_size)
+                f.write(bytearray(slot_size))
+        f.flush()
+
+    # Entries left from before a reboot: (slot, state, pid, flags, topic, msg)
+    def load(self):
+        out = []
+        f = self._f
+        for i in range(self.slots):
+            if self._state[i] == FREE:
+                continue
+            f.seek(i * self.slot_size)
+            st, flags, pid, tlen, mlen = struct.unpack(_HDR_FMT, f.read(_HDR))
+            topic = f.read(tlen)
+            msg = f.read(mlen)
+            out.append((i, st, pid, flags, topic, msg))
+        return out
+
+    def full(self):
+        return FREE not in self._state
+
+    def add(self, state, pid, flags=0, topic=b"", msg=b""):
+        if _HDR + len(topic) + len(msg) > self.slot_size:
+            raise ValueError("message too large for inflight store")
+        for slot in range(self.slots):
+            if self._state[slot] == FREE:
+                break
+        else:
+            raise StoreFull("inflight store full")
+        f = self._f
+        # Body first with a FREE state, then the state byte: a power cut in
+        # between leaves the slot empty rather than half written.
+        struct.pack_into(_HDR_FMT, self._hdr, 0, FREE, flags, pid, len(topic), len(msg))
+        f.seek(slot * self.slot_size)
+        f.write(self._hdr)
+        f.write(topic)
+        f.write(msg)
+        f.flush()
+        self.set_state(slot, state)
+        return slot
+
+    def set_state(self, slot, state):
+        self._state[slot] = state
+        self._byte[0] = state
+        self._f.seek(slot * self.slot_size)
+        self._f.write(self._byte)
+        self._f.flush()
+
+    def free(self, slot):
+        self.set_state(slot, FREE)
+
+    def close(self):
+        self._f.close()
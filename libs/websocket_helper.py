@@ -1,4 +1,15 @@
 import sys
+import os
+import time
+from micropython import const
+try:
+    import uselect as select
+except:
+    import select
+try:
+    import usocket as socket
+except:
+    import socket
 try:
     import ubinascii as binascii
 except:
@@ -10,65 +21,447 @@ except:
 
 DEBUG = 0
 
-def server_handshake(sock):
-    clr = sock.makefile("rwb", 0)
-    l = clr.readline()
-    #sys.stdout.write(repr(l))
+# Requests larger than this are refused
+HANDSHAKE_MAX = const(1024)
+_hs_buf = bytearray(HANDSHAKE_MAX)
+_RESPONSE = b"""\
+HTTP/1.1 101 Switching Protocols\r
+Upgrade: websocket\r
+Connection: Upgrade\r
+Sec-WebSocket-Accept: """
+
 
-    webkey = None
+# Header names as found in a lowercased head; names are case insensitive,
+# and clients differ (Go sends Sec-Websocket-Key)
+_KEY = b"\r\nsec-websocket-key:"
+_ACCEPT = b"\r\nsec-websocket-accept:"
+_PROTOCOL = b"\r\nsec-websocket-protocol:"
+_EXTENSIONS = b"\r\nsec-websocket-extensions:"
 
-    while 1:
-        l = clr.readline()
-        if not l:
+
+# Value of the header found at pat in lower, the head lowercased, sliced
+# from the head itself; None if it is absent. One lowercased copy serves
+# every lookup in a head, and nothing else is allocated but the value.
+def _value(req, lower, pat):
+    i = lower.find(pat)
+    if i < 0:
+        return None
+    i += len(pat)
+    j = req.find(b"\r\n", i)
+    return req[i : j if j >= 0 else len(req)].strip()
+
+
+# Value of a header in an HTTP head, or None
+def header(req, name):
+    return _value(req, req.lower(), b"\r\n" + name.lower() + b":")
+
+
+# Read an HTTP head into _hs_buf on a non-blocking socket, within
+# HANDSHAKE_MAX bytes and timeout_ms. Returns (head, bytes read past it).
+def _read_head(sock, timeout_ms):
+    buf = _hs_buf
+    mv = memoryview(buf)
+    n = 0
+    deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+    sock.setblocking(False)
+    p = select.poll()
+    p.register(sock, select.POLLIN)
+    while True:
+        if n == len(buf):
+            raise OSError("handshake too large")
+        left = time.ticks_diff(deadline, time.ticks_ms())
+        if left <= 0:
+            raise OSError("handshake timeout")
+        if not p.poll(left):
+            continue
+        r = sock.readinto(mv[n:])
+        if r is None:
+            continue
+        if not r:
             raise OSError("EOF in headers")
-        if l == b"\r\n":
-            break
-    #    sys.stdout.write(l)
-        h, v = [x.strip() for x in l.split(b":", 1)]
-        if DEBUG:
-            print((h, v))
-        if h == b'Sec-WebSocket-Key':
-            webkey = v
+        s = n - 3 if n > 3 else 0
+        i = bytes(mv[s : n + r]).find(b"\r\n\r\n")
+        n += r
+        if i >= 0:
+            i += s + 4
+            return bytes(mv[:i]), bytes(mv[i:n])
 
-    if not webkey:
-        raise OSError("Not a websocket request")
 
-    if DEBUG:
-        print("Sec-WebSocket-Key:", webkey, len(webkey))
+# One non-blocking read towards an HTTP head, for a server handling
+# several handshakes at once: each has its own buf, which holds the n
+# bytes that have arrived so far. Returns (n, length of the head once it
+# is complete, else 0); OSError at EOF or once buf fills without one.
+def read_head_part(sock, buf, n):
+    if n >= len(buf):
+        raise OSError("handshake too large")
+    mv = memoryview(buf)
+    r = sock.readinto(mv[n:])
+    if r is None:
+        return n, 0
+    if not r:
+        raise OSError("EOF in headers")
+    # Only the new bytes, and the 3 before them, can complete the blank line
+    s = n - 3 if n > 3 else 0
+    i = bytes(mv[s : n + r]).find(b"\r\n\r\n")
+    return n + r, s + i + 4 if i >= 0 else 0
+
 
+def _accept_key(webkey):
     d = hashlib.sha1(webkey)
     d.update(b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11")
-    respkey = d.digest()
-    respkey = binascii.b2a_base64(respkey)[:-1]
+    return binascii.b2a_base64(d.digest())[:-1]
+
+
+# Read the upgrade request into a fixed buffer and answer it in one send.
+# A request that exceeds HANDSHAKE_MAX bytes or takes longer than
+# timeout_ms to arrive raises OSError, so a slow or chatty client cannot
+# hold the server up. The first of protocols that the client offers in
+# Sec-WebSocket-Protocol is accepted, and with deflate_bits permessage-
+# deflate with a window of at most that many bits (see ws_deflate).
+# Leaves sock non-blocking; returns (request head, accepted protocol or
+# None, ws_deflate.PerMessageDeflate or None).
+def server_handshake(sock, timeout_ms=2000, protocols=(), deflate_bits=0, max_size=4096):
+    # The client has to wait for our 101 before sending frames, so
+    # nothing can follow the head
+    req = _read_head(sock, timeout_ms)[0]
+    resp, proto, pmd = handshake_response(req, protocols, deflate_bits, max_size)
+    sock.write(resp)
+    return req, proto, pmd
+
+
+# The 101 answering an upgrade request head, as (response, accepted
+# protocol or None, ws_deflate.PerMessageDeflate or None). Raises OSError
+# if it is not a WebSocket request.
+def handshake_response(req, protocols=(), deflate_bits=0, max_size=4096):
+    lower = req.lower()
+    webkey = _value(req, lower, _KEY)
+    if not webkey:
+        raise OSError("Not a websocket request")
     if DEBUG:
-        print("respkey:", respkey)
+        print("Sec-WebSocket-Key:", webkey, len(webkey))
 
-    sock.send(b"""\
-HTTP/1.1 101 Switching Protocols\r
-Upgrade: websocket\r
-Connection: Upgrade\r
-Sec-WebSocket-Accept: """)
-    sock.send(respkey)
-    sock.send("\r\n\r\n")
-
-
-# Very simplified client handshake, works for MicroPython's
-# websocket server implementation, but probably not for other
-# servers.
-def client_handshake(sock):
-    cl = sock.makefile("rwb", 0)
-    cl.write(b"""\
-GET / HTTP/1.1\r
-Host: echo.websocket.org\r
-Connection: Upgrade\r
-Upgrade: websocket\r
-Sec-WebSocket-Key: foo\r
-\r
-""")
-    l = cl.readline()
-#    print(l)
-    while 1:
-        l = cl.readline()
-        if l == b"\r\n":
-            break
-#        sys.stdout.write(l)
+    resp = _RESPONSE + _accept_key(webkey)
+
+    proto = None
+    if protocols:
+        offered = _value(req, lower, _PROTOCOL)
+        if offered:
+            offered = [x.strip() for x in offered.split(b",")]
+            for x in protocols:
+                if x in offered:
+                    proto = x
+                    resp += b"\r\nSec-WebSocket-Protocol: " + x
+                    break
+
+    pmd = None
+    if deflate_bits:
+        offered = _value(req, lower, _EXTENSIONS)
+        if offered:
+            import ws_deflate
+
+            pmd = ws_deflate.negotiate(offered, deflate_bits, max_size)
+            if pmd:
+                resp += b"\r\nSec-WebSocket-Extensions: " + pmd[0]
+                pmd = pmd[1]
+    return resp + b"\r\n\r\n", proto, pmd
+
+
+# Upgrade a connected socket to a WebSocket, offering protocols in
+# Sec-WebSocket-Protocol. Raises OSError unless the server answers with a
+# valid 101. Leaves sock non-blocking; returns (accepted protocol or None,
+# bytes the server sent after its response).
+def client_handshake(sock, host, path=b"/", protocols=(), timeout_ms=5000):
+    if isinstance(host, str):
+        host = host.encode()
+    if isinstance(path, str):
+        path = path.encode()
+    key = binascii.b2a_base64(os.urandom(16))[:-1]
+    req = b"GET " + path + b" HTTP/1.1\r\nHost: " + host + b"\r\nConnection: Upgrade\r\n" \
+        b"Upgrade: websocket\r\nSec-WebSocket-Version: 13\r\nSec-WebSocket-Key: " + key + b"\r\n"
+    if protocols:
+        req += b"Sec-WebSocket-Protocol: " + b", ".join(protocols) + b"\r\n"
+    sock.write(req + b"\r\n")
+    resp, rest = _read_head(sock, timeout_ms)
+    lower = resp.lower()
+    if resp[9:12] != b"101" or _value(resp, lower, _ACCEPT) != _accept_key(key):
+        raise OSError("websocket handshake refused")
+    return _value(resp, lower, _PROTOCOL), rest
+
+
+# Frame opcodes (RFC 6455)
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+# Set on the opcode of a compressed (permessage-deflate) message
+RSV1 = 0x40
+
+
+# Header of a frame carrying n bytes; masked (client to server) frames
+# are followed by their 4 byte key
+def frame_header(op, n, fin=True, masked=False):
+    b0 = op | (0x80 if fin else 0)
+    m = 0x80 if masked else 0
+    if n < 126:
+        return bytes((b0, n | m))
+    if n < 65536:
+        return bytes((b0, 126 | m, n >> 8, n & 0xFF))
+    return bytes((b0, 127 | m, 0, 0, 0, 0, n >> 24 & 0xFF, n >> 16 & 0xFF, n >> 8 & 0xFF, n & 0xFF))
+
+
+def frame(op, payload, fin=True):
+    return frame_header(op, len(payload), fin) + payload
+
+
+# A client frame: payload masked with a fresh random key, built in one
+# buffer
+def masked_frame(op, payload, fin=True):
+    key = os.urandom(4)
+    h = frame_header(op, len(payload), fin, True)
+    i = len(h) + 4
+    out = bytearray(i + len(payload))
+    out[: i - 4] = h
+    out[i - 4 : i] = key
+    out[i:] = payload
+    _unmask(memoryview(out)[i:], key)
+    return out
+
+
+# XOR mv in place with the repeating 4 byte key, 4 bytes per pass and
+# allocating nothing. ws_mask replaces it with a viper version, a word at
+# a time, where the port has the native emitter.
+def _unmask(mv, key):
+    k0 = key[0]
+    k1 = key[1]
+    k2 = key[2]
+    k3 = key[3]
+    n = len(mv)
+    m = n & ~3
+    for i in range(0, m, 4):
+        mv[i] ^= k0
+        mv[i + 1] ^= k1
+        mv[i + 2] ^= k2
+        mv[i + 3] ^= k3
+    for i in range(m, n):
+        mv[i] ^= key[i & 3]
+
+
+try:
+    from ws_mask import unmask as _unmask
+except (ImportError, SyntaxError, AttributeError):
+    # No viper: a port without the native emitter, or the host
+    pass
+
+
+# Incremental frame parser for one connection, fed from a non-blocking
+# socket. Frames are unmasked in place; fragmented messages are joined.
+class FrameReader:
+    def __init__(self, sock, bufsize=512, max_size=4096):
+        self.sock = sock
+        self.max_size = max_size
+        self.buf = bytearray(bufsize)
+        self.mv = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.frag = None
+        self.frag_op = 0
+
+    # Queue bytes that were read from the socket elsewhere (after the
+    # handshake response) as if fill() had read them
+    def feed(self, data):
+        while len(self.buf) - self.end < len(data):
+            buf = bytearray(len(self.buf) * 2)
+            buf[: self.end] = self.mv[: self.end]
+            self.buf = buf
+            self.mv = memoryview(buf)
+        self.mv[self.end : self.end + len(data)] = data
+        self.end += len(data)
+
+    # Read whatever the socket has. Returns False once the peer has
+    # closed, True otherwise.
+    def fill(self):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            n = self.end - self.start
+            self.mv[:n] = self.mv[self.start : self.end]
+            self.start = 0
+            self.end = n
+        if self.end == len(self.buf):
+            # A frame larger than the buffer (but within max_size)
+            buf = bytearray(len(self.buf) * 2)
+            buf[: self.end] = self.mv[: self.end]
+            self.buf = buf
+            self.mv = memoryview(buf)
+        r = self.sock.readinto(self.mv[self.end :])
+        if r is None:
+            return True
+        if not r:
+            return False
+        self.end += r
+        return True
+
+    # Next complete message as (opcode, payload memoryview), or None if
+    # more data is needed. The payload is only valid until the next call.
+    # The opcode of a compressed message has RSV1 set.
+    def next(self):
+        while True:
+            b = self.buf
+            i = self.start
+            avail = self.end - i
+            if avail < 2:
+                return None
+            op = b[i] & 0x0F
+            rsv = b[i] & RSV1
+            fin = b[i] & 0x80
+            n = b[i + 1] & 0x7F
+            masked = b[i + 1] & 0x80
+            h = 2
+            if n == 126:
+                if avail < 4:
+                    return None
+                n = b[i + 2] << 8 | b[i + 3]
+                h = 4
+            elif n == 127:
+                if avail < 10:
+                    return None
+                n = 0
+                for j in range(i + 2, i + 10):
+                    n = n << 8 | b[j]
+                h = 10
+            if n > self.max_size:
+                raise OSError("websocket frame too large")
+            if masked:
+                h += 4
+            if avail < h + n:
+                return None
+            payload = self.mv[i + h : i + h + n]
+            if masked:
+                _unmask(payload, self.mv[i + h - 4 : i + h])
+            self.start = i + h + n
+            if op >= OP_CLOSE or fin and op and self.frag is None:
+                return op | rsv, payload
+            # Fragmented message
+            if op:
+                self.frag = bytearray(payload)
+                self.frag_op = op | rsv
+            elif self.frag is not None:
+                if len(self.frag) + n > self.max_size:
+                    raise OSError("websocket message too large")
+                self.frag += payload
+                if fin:
+                    data = self.frag
+                    self.frag = None
+                    return self.frag_op, memoryview(data)
+
+
+# Client end of a WebSocket, e.g. a device feeding a dashboard:
+#
+#   ws = websocket_helper.connect("192.168.4.2", 8765)
+#   ws.send('{"T": 21}')
+#   m = ws.recv(1000)  # (opcode, payload) or None after 1 s
+#
+# Frames sent are masked; messages longer than fragment bytes (when set)
+# go out in fragments. Pings from the server are answered inside recv(),
+# and a pong to ping() records its round trip in last_rtt (ms).
+class WebSocket:
+    def __init__(self, sock, proto=None, rest=b"", max_size=4096, fragment=0, timeout_ms=5000):
+        self.sock = sock
+        self.proto = proto
+        self.fragment = fragment
+        self.timeout_ms = timeout_ms
+        self.reader = FrameReader(sock, max_size=max_size)
+        if rest:
+            self.reader.feed(rest)
+        self.last_rtt = None
+        self._ping_ms = None
+        self._poll = select.poll()
+        self._poll.register(sock, select.POLLIN)
+
+    def _write(self, data):
+        mv = memoryview(data)
+        i = 0
+        deadline = time.ticks_add(time.ticks_ms(), self.timeout_ms)
+        while i < len(mv):
+            n = self.sock.write(mv[i:])
+            if n:
+                i += n
+                continue
+            left = time.ticks_diff(deadline, time.ticks_ms())
+            if left <= 0:
+                raise OSError("websocket send timeout")
+            self._poll.modify(self.sock, select.POLLOUT)
+            self._poll.poll(left)
+            self._poll.modify(self.sock, select.POLLIN)
+
+    # Send str as text and anything else as binary
+    def send(self, data):
+        op = OP_TEXT if isinstance(data, str) else OP_BINARY
+        if op == OP_TEXT:
+            data = data.encode()
+        f = self.fragment
+        if not f or len(data) <= f:
+            self._write(masked_frame(op, data))
+            return
+        mv = memoryview(data)
+        for i in range(0, len(mv), f):
+            last = i + f >= len(mv)
+            self._write(masked_frame(op if i == 0 else OP_CONT, mv[i : i + f], last))
+
+    def ping(self, data=b""):
+        self._ping_ms = time.ticks_ms()
+        self._write(masked_frame(OP_PING, data))
+
+    # Next text or binary message as (opcode, payload memoryview, valid
+    # until the next call), or None if none arrives within timeout_ms.
+    # Raises OSError once the connection is closed.
+    def recv(self, timeout_ms=0):
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while True:
+            m = self.reader.next()
+            if m is None:
+                left = time.ticks_diff(deadline, time.ticks_ms())
+                if not self._poll.poll(left if left > 0 else 0):
+                    if left <= 0:
+                        return None
+                    continue
+                if not self.reader.fill():
+                    self.close()
+                    raise OSError("websocket closed")
+                continue
+            op, payload = m
+            if op == OP_PING:
+                self._write(masked_frame(OP_PONG, payload))
+            elif op == OP_PONG:
+                if self._ping_ms is not None:
+                    self.last_rtt = time.ticks_diff(time.ticks_ms(), self._ping_ms)
+                    self._ping_ms = None
+            elif op == OP_CLOSE:
+                self.close()
+                raise OSError("websocket closed")
+            else:
+                return m
+
+    def close(self, code=1000):
+        if self.sock is None:
+            return
+        try:
+            self._write(masked_frame(OP_CLOSE, bytes((code >> 8, code & 0xFF))))
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+
+
+def connect(host, port=80, path="/", protocols=(), **kw):
+    ai = socket.getaddrinfo(host, port)[0]
+    sock = socket.socket(ai[0], socket.SOCK_STREAM)
+    try:
+        sock.connect(ai[-1])
+        proto, rest = client_handshake(sock, host, path, protocols)
+    except OSError:
+        sock.close()
+        raise
+    return WebSocket(sock, proto, rest, **kw)
@@ -1,41 +1,128 @@
 # This module should be imported from REPL, not run from command line.
-import socket
-import uos
-import network
-import uwebsocket
+import usocket as socket
+import uselect as select
 import websocket_helper
+import ws_codec
+from websocket_helper import OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG, RSV1
 import time
 import json
 
+try:
+    import network
+except ImportError:  # host benchmarks
+    network = None
+
+# Send queue policies for a client that cannot keep up, see WS_Server
+DROP_OLDEST = 'drop_oldest'
+LATEST = 'latest'
+BLOCK = 'block'
+
 NAME = 'PicoW'
 AP_PASSWORD = "123456789"
 STA_NAME = "MakerStarsHall"
-STA_PASSWORD = "sunfounder" 
+STA_PASSWORD = "sunfounder"
 SWITCH_MODE = "sta" # Change the values to "ap" or "sta" to select the operating mode
 
 
+class _Client:
+    # One controller connection: its own frame parser and send queue
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.reader = websocket_helper.FrameReader(sock)
+        # Negotiated ws_codec messages instead of JSON
+        self.binary = False
+        # ws_deflate.PerMessageDeflate, if negotiated
+        self.deflate = None
+        # Messages waiting to be written: [is send_dict state, frame or
+        # (opcode, payload) framed when dequeued, size]
+        self.queue = []
+        self.queued = 0
+        # The frame being written
+        self.out = b''
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        # Missed an update, so the next one must be a full snapshot
+        self.stale = False
+
+
+class _Pending:
+    # A connection whose upgrade request is still arriving
+    def __init__(self, sock, addr, deadline):
+        self.sock = sock
+        self.addr = addr
+        self.deadline = deadline
+        # The request so far, in a buffer of its own
+        self.buf = bytearray(websocket_helper.HANDSHAKE_MAX)
+        self.n = 0
+
+
 class WS_Server():
-    
-    # read -- <function>
-    # readinto -- <function>
-    # readline -- <function>
-    # write -- <function>
-    # ioctl -- <function>
-    # close -- <function>
+    # Serves any number of controllers from one listening socket. All
+    # sockets are polled without blocking from transfer(): new connections
+    # are accepted, each client's frames are parsed as they arrive, and
+    # send_dict is broadcast to every client.
+    #
+    # Each client has a send queue of at most max_pending bytes, written
+    # out as its socket accepts them, so a slow client never holds up the
+    # loop. When it is full, policy decides: LATEST (the default) replaces
+    # the update still queued with the new one and otherwise drops the
+    # new message, DROP_OLDEST drops queued messages to make room, and
+    # BLOCK waits up to block_ms for the socket, then disconnects the
+    # client. A client that lost an update gets a full snapshot next.
+    # stats() sums queue depth and drops over the clients.
+    #
+    # With delta=True an update only carries the send_dict keys whose
+    # values changed since the last one (clients get a full snapshot on
+    # connect), and nothing is sent when nothing changed. Values are
+    # compared with ==, so replace lists rather than mutating them.
+    # min_interval_ms coalesces updates: write() marks send_dict dirty and
+    # at most one update goes out per interval, the pending one from a
+    # later transfer()/poll().
+    #
+    # With binary=True, clients that ask for the ws_codec.PROTOCOL
+    # subprotocol at connect exchange ws_codec binary messages instead of
+    # JSON; everyone else, the SunFounder Controller app included, gets
+    # JSON. The frames are 1.5-3x smaller, but ws_codec is Python where
+    # json is C, so snapshots and controller messages take longer to
+    # encode and decode; worth it when airtime matters more than CPU.
+    #
+    # deflate_bits (9-15) lets clients negotiate permessage-deflate with a
+    # compression window of at most 2**deflate_bits bytes per connection.
+    #
+    # Upgrade requests are read from the poll loop as they arrive, so a
+    # slow client does not hold up the others; one not complete within
+    # handshake_ms (or over websocket_helper.HANDSHAKE_MAX) is dropped.
     send_dict = {
         'Name':NAME,
         'Type':'Blank',
         'Check':'SunFounder Controller',
         }
 
-    def __init__(self, port):
+    def __init__(self, port, max_clients=4, max_pending=2048, delta=False, min_interval_ms=0, binary=False, deflate_bits=0,
+                 policy=LATEST, block_ms=1000, handshake_ms=2000):
         self.port = port
+        self.handshake_ms = handshake_ms
+        self.policy = policy
+        self.block_ms = block_ms
+        self.deflate_bits = deflate_bits
+        self.protocols = (ws_codec.PROTOCOL,) if binary else ()
+        self.delta = delta
+        self.min_interval_ms = min_interval_ms
+        self._sent = {}
+        self._dirty = False
+        self._last_push = 0
+        self.max_clients = max_clients
+        self.max_pending = max_pending
         self.listen_s = None
-        self.client_s = None
-        self.ws = None
+        self.clients = {}
+        self._pending = {}
         self.wlan = None
-    
-    def setup_conn(self, accept_handler):
+        self._poll = None
+        self._inbox = []
+
+    def setup_conn(self):
         self.listen_s = socket.socket()
         self.listen_s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
@@ -44,36 +131,233 @@ class WS_Server():
 
         self.listen_s.bind(addr)
         self.listen_s.listen(5)
-        if accept_handler:
-            self.listen_s.setsockopt(socket.SOL_SOCKET, 20, accept_handler)
-        for i in (network.AP_IF, network.STA_IF):
-            iface = network.WLAN(i)
-            if iface.active():
-                print("WebServer started on ws://%s:%d" % (iface.ifconfig()[0], self.port))
+        self.listen_s.setblocking(False)
+        self._poll = select.poll()
+        self._poll.register(self.listen_s, select.POLLIN)
+        if network:
+            for i in (network.AP_IF, network.STA_IF):
+                iface = network.WLAN(i)
+                if iface.active():
+                    print("WebServer started on ws://%s:%d" % (iface.ifconfig()[0], self.port))
         return self.listen_s
 
     def accept_conn(self, listen_sock):
-        cl, remote_addr = listen_sock.accept()
+        try:
+            cl, remote_addr = listen_sock.accept()
+        except OSError:
+            return
+        if len(self.clients) + len(self._pending) >= self.max_clients:
+            cl.close()
+            return
         print("\nWebSocket connection from:", remote_addr)
-        self.client_s = cl
-        websocket_helper.server_handshake(cl)
-        self.ws = uwebsocket.websocket(cl, True)
-        self.ws.write(json.dumps(self.send_dict))
-        print("have sended!")
         cl.setblocking(False)
+        deadline = time.ticks_add(time.ticks_ms(), self.handshake_ms)
+        self._pending[cl] = _Pending(cl, remote_addr, deadline)
+        self._poll.register(cl, select.POLLIN)
+
+    # Read what has arrived of p's upgrade request; once it is whole, p
+    # becomes a client, with the 101 queued ahead of its first snapshot
+    def _handshake(self, p):
+        try:
+            p.n, end = websocket_helper.read_head_part(p.sock, p.buf, p.n)
+            if not end:
+                return
+            resp, proto, pmd = websocket_helper.handshake_response(
+                bytes(memoryview(p.buf)[:end]), protocols=self.protocols, deflate_bits=self.deflate_bits
+            )
+        except OSError:
+            self._drop_pending(p)
+            return
+        del self._pending[p.sock]
+        c = _Client(p.sock, p.addr)
+        c.binary = proto is not None
+        c.deflate = pmd
+        c.out = resp
+        self.clients[p.sock] = c
+        msg = self._encode(self.send_dict, c.binary)
+        self._send(c, msg if c.deflate else self._frame(c, msg), True)
+
+    def _drop_pending(self, p):
+        self._pending.pop(p.sock, None)
+        try:
+            self._poll.unregister(p.sock)
+        except (OSError, ValueError, KeyError):
+            pass
+        p.sock.close()
+
+    def _drop(self, c):
+        self.clients.pop(c.sock, None)
+        try:
+            self._poll.unregister(c.sock)
+        except (OSError, ValueError, KeyError):
+            pass
+        c.sock.close()
 
+    # Queue a message for c, under the send queue policy, and write as
+    # much as the socket takes now; the rest goes out when poll() reports
+    # it writable. item is a frame, or (opcode, payload) for a client with
+    # deflate, compressed only when it is written so that dropped messages
+    # never enter its window. Returns False if the message was dropped.
+    def _send(self, c, item, state=False):
+        q = c.queue
+        size = len(item) if isinstance(item, (bytes, bytearray)) else len(item[1]) + 14
+        if state and self.policy == LATEST:
+            for e in q:
+                if e[0]:
+                    c.queued += size - e[2]
+                    e[1] = item
+                    e[2] = size
+                    c.coalesced += 1
+                    return True
+        deadline = time.ticks_add(time.ticks_ms(), self.block_ms)
+        while len(c.out) + c.queued + size > self.max_pending:
+            if self.policy == DROP_OLDEST and q:
+                e = q.pop(0)
+                c.queued -= e[2]
+                c.dropped += 1
+                if e[0]:
+                    c.stale = self.delta
+            elif self.policy == BLOCK:
+                if not self._wait(c, deadline):
+                    return False
+            else:
+                c.dropped += 1
+                return False
+        q.append([state, item, size])
+        c.queued += size
+        if len(q) > c.max_depth:
+            c.max_depth = len(q)
+        self._flush(c)
+        return True
+
+    # BLOCK policy: wait for c's socket to take more, until deadline.
+    # Returns False, having disconnected c, if it does not.
+    def _wait(self, c, deadline):
+        left = time.ticks_diff(deadline, time.ticks_ms())
+        p = select.poll()
+        p.register(c.sock, select.POLLOUT)
+        if left <= 0 or not p.poll(left):
+            self._drop(c)
+            return False
+        self._flush(c)
+        return c.sock in self.clients
+
+    def _flush(self, c):
+        try:
+            while True:
+                if not c.out:
+                    if not c.queue:
+                        break
+                    e = c.queue.pop(0)
+                    c.queued -= e[2]
+                    c.out = e[1] if isinstance(e[1], (bytes, bytearray)) else self._frame(c, e[1])
+                n = c.sock.write(c.out)
+                if not n:
+                    break
+                c.out = c.out[n:]
+        except OSError:
+            self._drop(c)
+            return
+        self._poll.modify(c.sock, select.POLLIN | (select.POLLOUT if c.out or c.queue else 0))
+
+    # Queue metrics summed over the connected clients
+    def stats(self):
+        s = {'clients': len(self.clients), 'depth': 0, 'max_depth': 0, 'queued': 0, 'dropped': 0, 'coalesced': 0}
+        for c in self.clients.values():
+            s['depth'] += len(c.queue)
+            s['max_depth'] = max(s['max_depth'], c.max_depth)
+            s['queued'] += c.queued + len(c.out)
+            s['dropped'] += c.dropped
+            s['coalesced'] += c.coalesced
+        return s
+
+    # (opcode, payload) of a message carrying d
+    def _encode(self, d, binary):
+        if binary:
+            return OP_BINARY, bytes(ws_codec.encode(d))
+        return OP_TEXT, json.dumps(d).encode()
+
+    # The frame of a message for c, compressed if c negotiated that
+    def _frame(self, c, msg):
+        op, payload = msg
+        if c.deflate:
+            z = c.deflate.compress(payload)
+            if z is not None:
+                return websocket_helper.frame(op | RSV1, z)
+        return websocket_helper.frame(op, payload)
+
+    def _receive(self, c):
+        try:
+            if not c.reader.fill():
+                self._drop(c)
+                return
+            while True:
+                m = c.reader.next()
+                if m is None:
+                    return
+                op, payload = m
+                if op & RSV1:
+                    if c.deflate is None:
+                        self._drop(c)
+                        return
+                    payload = c.deflate.decompress(payload)
+                    op &= 0x0F
+                if op == OP_TEXT or op == OP_BINARY:
+                    try:
+                        if op == OP_BINARY and c.binary:
+                            self._inbox.append(ws_codec.decode(payload))
+                        else:
+                            self._inbox.append(json.loads(bytes(payload)))
+                    except ValueError:
+                        pass
+                elif op == OP_PING:
+                    self._send(c, websocket_helper.frame(OP_PONG, bytes(payload)))
+                elif op == OP_CLOSE:
+                    self._drop(c)
+                    return
+        except OSError:
+            self._drop(c)
+
+    # Service every socket that is ready, without blocking
+    def poll(self):
+        if self._poll is None:
+            return
+        for entry in self._poll.poll(0):
+            s, ev = entry[0], entry[1]
+            if s is self.listen_s:
+                self.accept_conn(s)
+                continue
+            p = self._pending.get(s)
+            if p is not None:
+                if ev & (select.POLLHUP | select.POLLERR):
+                    self._drop_pending(p)
+                else:
+                    self._handshake(p)
+                continue
+            c = self.clients.get(s)
+            if c is None:
+                continue
+            if ev & (select.POLLHUP | select.POLLERR):
+                self._drop(c)
+                continue
+            if ev & select.POLLOUT:
+                self._flush(c)
+            if ev & select.POLLIN:
+                self._receive(c)
+        if self._pending:
+            now = time.ticks_ms()
+            for p in list(self._pending.values()):
+                if time.ticks_diff(now, p.deadline) >= 0:
+                    self._drop_pending(p)
+        if self._dirty:
+            self._push()
+
+    # Next message received from any controller, decoded from JSON
     def read(self):
-        if self.ws == None:
-            return None
-        recv = self.ws.read()
-        if recv != None and recv != b"":
-            recv = recv.decode()
-            # print("accept_conn: %s" % recv)
-            try:
-                recv=json.loads(recv)
-                return recv
-            except ValueError:
-                pass
+        if not self._inbox:
+            self.poll()
+        if self._inbox:
+            return self._inbox.pop(0)
         return None
 
     def transfer(self):
@@ -82,24 +366,71 @@ class WS_Server():
             status = True
             self.write()
         else:
-            status = False    
+            status = False
         return status,result
 
+    # Broadcast send_dict to every client, subject to delta and
+    # min_interval_ms; it is encoded once for all of them
     def write(self):
-        try:
-            value=json.dumps(self.send_dict)
-            value = value.encode(value)
-            self.ws.write(value)
-        except AttributeError:
-            pass
-            
+        self._dirty = True
+        self._push()
+
+    def _push(self):
+        if not self.clients:
+            return
+        now = time.ticks_ms()
+        if self.min_interval_ms and time.ticks_diff(now, self._last_push) < self.min_interval_ms:
+            return
+        self._dirty = False
+        changes = None
+        if self.delta:
+            sent = self._sent
+            changes = {}
+            for k, v in self.send_dict.items():
+                if k not in sent or sent[k] != v:
+                    changes[k] = v
+                    sent[k] = v
+            if not changes:
+                return
+        self._last_push = now
+        # Encoded at most once per kind: (full or delta) x (JSON or binary);
+        # compressed per client, as each has its own deflate window
+        msgs = [None, None, None, None]
+        frames = [None, None, None, None]
+        for c in list(self.clients.values()):
+            # An update that replaces a queued one (LATEST) must carry
+            # what that one did as well
+            full = c.stale or changes is None or self.policy == LATEST and self._queued_state(c)
+            i = full << 1 | c.binary
+            if msgs[i] is None:
+                msgs[i] = self._encode(self.send_dict if full else changes, c.binary)
+            if c.deflate:
+                item = msgs[i]
+            else:
+                if frames[i] is None:
+                    frames[i] = self._frame(c, msgs[i])
+                item = frames[i]
+            if not self._send(c, item, True):
+                c.stale = self.delta
+            elif full:
+                c.stale = False
+
+    def _queued_state(self, c):
+        for e in c.queue:
+            if e[0]:
+                return True
+        return False
 
     def stop(self):
-        if self.client_s:
-            self.client_s.close()
+        for c in list(self.clients.values()):
+            self._drop(c)
+        for p in list(self._pending.values()):
+            self._drop_pending(p)
         if self.listen_s:
             self.listen_s.close()
-        self.wlan.active(False)
+            self.listen_s = None
+        if self.wlan:
+            self.wlan.active(False)
 
     def start(self):
         # self.stop()
@@ -119,9 +450,9 @@ class WS_Server():
                 time.sleep(1)
             if not self.wlan.isconnected():
                 print("wifi connected fail ")
-        self.setup_conn(self.accept_conn)
+        self.setup_conn()
 
+    # Serve without Wi-Fi setup, e.g. on a host or an already connected board
     def start_foreground(self):
         self.stop()
-        s = self.setup_conn(None)
-        self.accept_conn(s)
+        self.setup_conn()
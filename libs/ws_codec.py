@@ -0,0 +1,178 @@
+# Compact binary encoding of WS_Server messages (send_dict updates and
+# controller input), used in place of JSON by WebSocket clients that ask
+# for the PROTOCOL subprotocol at connect, when WS_Server is created with
+# binary=True. The SunFounder Controller app never asks, so it keeps
+# getting JSON.
+#
+# A message is a run of entries, each
+#   key length (1 byte), key (utf-8), tag (1 byte), value
+# where the tag says how the value is packed (little endian). Ints take
+# the smallest of 1, 2, 4 or 8 bytes, and any larger go as floats;
+# floats are sent as float32, which is plenty for sensor readings; lists
+# (joystick x/y) hold up to 255 values.
+#
+#   payload = ws_codec.encode({'G': 24, 'H': 61, 'P': 31022})
+#   d = ws_codec.decode(payload)
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+# ustruct reports a short buffer as ValueError itself
+_struct_error = getattr(struct, "error", ValueError)
+
+PROTOCOL = b"sfc.bin1"
+
+T_NONE = const(0)
+T_FALSE = const(1)
+T_TRUE = const(2)
+T_I8 = const(3)
+T_I16 = const(4)
+T_I32 = const(5)
+T_F32 = const(6)
+T_STR = const(7)
+T_LIST = const(8)
+T_I64 = const(9)
+
+_buf = bytearray(128)
+# Encoded key prefixes (length byte and key); widget ids repeat forever
+_keys = {}
+
+
+def _room(n, extra):
+    global _buf
+    if n + extra > len(_buf):
+        b = bytearray(2 * (n + extra))
+        b[:n] = _buf[:n]
+        _buf = b
+    return _buf
+
+
+def _put(n, v):
+    if v is None or v is False or v is True:
+        b = _room(n, 1)
+        b[n] = T_NONE if v is None else T_TRUE if v else T_FALSE
+        return n + 1
+    if isinstance(v, int):
+        b = _room(n, 9)
+        if -128 <= v < 128:
+            b[n] = T_I8
+            struct.pack_into("<b", b, n + 1, v)
+            return n + 2
+        if -32768 <= v < 32768:
+            b[n] = T_I16
+            struct.pack_into("<h", b, n + 1, v)
+            return n + 3
+        if -2147483648 <= v < 2147483648:
+            b[n] = T_I32
+            struct.pack_into("<i", b, n + 1, v)
+            return n + 5
+        if -9223372036854775808 <= v < 9223372036854775808:
+            b[n] = T_I64
+            struct.pack_into("<q", b, n + 1, v)
+            return n + 9
+        v = float(v)
+    if isinstance(v, float):
+        b = _room(n, 5)
+        b[n] = T_F32
+        struct.pack_into("<f", b, n + 1, v)
+        return n + 5
+    if isinstance(v, str):
+        s = v.encode()
+        if len(s) > 255:
+            raise ValueError("string too long")
+        b = _room(n, 2 + len(s))
+        b[n] = T_STR
+        b[n + 1] = len(s)
+        b[n + 2 : n + 2 + len(s)] = s
+        return n + 2 + len(s)
+    if isinstance(v, (list, tuple)):
+        if len(v) > 255:
+            raise ValueError("list too long")
+        b = _room(n, 2)
+        b[n] = T_LIST
+        b[n + 1] = len(v)
+        n += 2
+        for x in v:
+            n = _put(n, x)
+        return n
+    raise ValueError("cannot encode %r" % (v,))
+
+
+# Encode a dict of str keys. Returns a view of a module buffer that the
+# next encode() overwrites.
+def encode(d):
+    n = 0
+    for k, v in d.items():
+        p = _keys.get(k)
+        if p is None:
+            p = k.encode()
+            p = _keys[k] = bytes((len(p),)) + p
+        b = _room(n, len(p))
+        b[n : n + len(p)] = p
+        n = _put(n + len(p), v)
+    return memoryview(_buf)[:n]
+
+
+# Offset j, if b holds everything before it. Each read checks first, as
+# slicing past the end would quietly give a shorter value.
+def _end(b, j):
+    if j > len(b):
+        raise ValueError("truncated message")
+    return j
+
+
+def _get(b, i):
+    t = b[i]
+    i += 1
+    if t <= T_TRUE:
+        return (None, False, True)[t], i
+    if t == T_I8:
+        j = _end(b, i + 1)
+        return struct.unpack_from("<b", b, i)[0], j
+    if t == T_I16:
+        j = _end(b, i + 2)
+        return struct.unpack_from("<h", b, i)[0], j
+    if t == T_I32:
+        j = _end(b, i + 4)
+        return struct.unpack_from("<i", b, i)[0], j
+    if t == T_I64:
+        j = _end(b, i + 8)
+        return struct.unpack_from("<q", b, i)[0], j
+    if t == T_F32:
+        j = _end(b, i + 4)
+        return struct.unpack_from("<f", b, i)[0], j
+    if t == T_STR:
+        j = _end(b, i + 1 + b[i])
+        return str(bytes(b[i + 1 : j]), "utf-8"), j
+    if t == T_LIST:
+        v = []
+        i += 1
+        for _ in range(b[i - 1]):
+            x, i = _get(b, i)
+            v.append(x)
+        return v, i
+    raise ValueError("bad tag %d" % t)
+
+
+# Raises ValueError on a message that is malformed or cut short
+def decode(b):
+    d = {}
+    i = 0
+    n = len(b)
+    try:
+        while i < n:
+            k = b[i]
+            j = _end(b, i + 1 + k)
+            if k == 1 and b[i + 1] < 128:
+                key = chr(b[i + 1])
+            else:
+                key = str(bytes(b[i + 1 : j]), "utf-8")
+            d[key], i = _get(b, j)
+    except (IndexError, _struct_error):
+        raise ValueError("truncated message")
+    return d
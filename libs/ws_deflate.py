@@ -0,0 +1,143 @@
+# permessage-deflate (RFC 7692) compression for one WebSocket connection.
+#
+# websocket_helper.server_handshake negotiates the parameters; WS_Server
+# compresses outgoing messages and inflates incoming ones with a
+# PerMessageDeflate per connection. Memory is bounded by the window:
+# messages are compressed with at most 2**bits bytes of history, and
+# clients are held to the same window, or to no history at all when
+# they do not let the server choose.
+#
+# With a zlib that has compressobj (CPython on the host) the window is
+# kept across messages, so a message can refer back to the previous
+# ones. MicroPython's deflate module cannot flush mid-stream, so there
+# every message is compressed on its own (the handshake then asks for
+# no context takeover in both directions).
+try:
+    import zlib
+
+    zlib.compressobj
+except (ImportError, AttributeError):
+    zlib = None
+    import io
+    import deflate
+
+EXTENSION = b"permessage-deflate"
+# Whether the window can be kept across messages here
+TAKEOVER = zlib is not None
+
+_TAIL = b"\x00\x00\xff\xff"
+# An empty final block, so a lone message is a complete deflate stream
+_END = b"\x03\x00"
+
+
+class PerMessageDeflate:
+    # bits: our window; takeover: keep our window across messages.
+    # client_bits/client_takeover: the same for what the client sends.
+    def __init__(self, bits, takeover, client_bits, client_takeover, max_size=4096):
+        self.bits = bits
+        self.takeover = takeover and TAKEOVER
+        self.client_bits = client_bits
+        self.client_takeover = client_takeover and TAKEOVER
+        self.max_size = max_size
+        if not self.client_takeover:
+            # Back references cannot reach past the start of the message
+            while client_bits > 9 and 1 << (client_bits - 1) >= max_size:
+                client_bits -= 1
+        self._inflate_bits = client_bits
+        self.raw = 0
+        self.sent = 0
+        self._c = None
+        self._d = None
+
+    # Compressed message body, or None when it is better sent as it is:
+    # a message compressed on its own (no window kept) that does not
+    # shrink. With the window kept, every message has to go through it.
+    def compress(self, data):
+        self.raw += len(data)
+        if zlib is None:
+            b = io.BytesIO()
+            f = deflate.DeflateIO(b, deflate.RAW, self.bits)
+            f.write(data)
+            f.close()
+            out = b.getvalue()
+        else:
+            if self._c is None or not self.takeover:
+                # memLevel 2: a 2 KB hash table instead of zlib's 128 KB
+                self._c = zlib.compressobj(6, zlib.DEFLATED, -self.bits, 2)
+            out = self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+            if out[-4:] == _TAIL:
+                out = out[:-4]
+        if not self.takeover and len(out) >= len(data):
+            self.sent += len(data)
+            return None
+        self.sent += len(out)
+        return out
+
+    # Inflate one message; raises OSError past max_size bytes
+    def decompress(self, data):
+        if zlib is None:
+            f = deflate.DeflateIO(io.BytesIO(bytes(data) + _TAIL + _END), deflate.RAW, self._inflate_bits)
+            out = f.read(self.max_size + 1)
+        else:
+            if self._d is None or not self.client_takeover:
+                self._d = zlib.decompressobj(-self._inflate_bits)
+            try:
+                out = self._d.decompress(bytes(data) + _TAIL, self.max_size + 1)
+            except zlib.error:
+                raise OSError("bad deflate data")
+        if len(out) > self.max_size:
+            raise OSError("websocket message too large")
+        return out
+
+    def ratio(self):
+        return self.sent / self.raw if self.raw else 1.0
+
+
+# Accept the first permessage-deflate offer in a Sec-WebSocket-Extensions
+# value that fits a window of at most bits. Returns (response value,
+# PerMessageDeflate), or None when no offer fits.
+def negotiate(offers, bits, max_size=4096):
+    for offer in offers.split(b","):
+        params = [p.strip() for p in offer.split(b";")]
+        if params[0] != EXTENSION:
+            continue
+        ours = bits
+        client_bits = None
+        takeover = client_takeover = TAKEOVER
+        ok = True
+        try:
+            for p in params[1:]:
+                kv = p.split(b"=", 1)
+                k = kv[0].strip()
+                v = kv[1].strip().strip(b'"') if len(kv) > 1 else b""
+                if k == b"server_no_context_takeover":
+                    takeover = False
+                elif k == b"client_no_context_takeover":
+                    client_takeover = False
+                elif k == b"server_max_window_bits":
+                    ours = min(ours, int(v))
+                elif k == b"client_max_window_bits":
+                    client_bits = min(bits, int(v)) if v else bits
+                else:
+                    ok = False
+        except ValueError:
+            ok = False
+        # zlib cannot produce 8 bit windows
+        if not ok or ours < 9:
+            continue
+        resp = EXTENSION + b"; server_max_window_bits=" + str(ours).encode()
+        if not takeover:
+            resp += b"; server_no_context_takeover"
+        if client_bits is None:
+            # The client will use a full 32 KB window: only accept it
+            # one message at a time, which max_size bounds
+            client_bits = 15
+            client_takeover = False
+        elif client_bits < 9:
+            continue
+        else:
+            resp += b"; client_max_window_bits=" + str(client_bits).encode()
+        if not client_takeover:
+            resp += b"; client_no_context_takeover"
+        return resp, PerMessageDeflate(ours, takeover, client_bits, client_takeover, max_size)
+    return None
@@ -0,0 +1,32 @@
+# WebSocket payload masking (RFC 6455 5.3) for websocket_helper, in viper.
+#
+# Kept apart from websocket_helper because a port built without the
+# native emitters cannot compile @micropython.viper at all: the import
+# then fails and websocket_helper falls back to its pure-Python loop.
+import micropython
+
+
+# XOR buf in place with the repeating 4 byte key, a 32-bit word at a
+# time. Bytes up to the first word boundary and after the last one go
+# singly: the Cortex-M0+ in the RP2040 faults on unaligned word access.
+@micropython.viper
+def unmask(buf, key):
+    n = int(len(buf))
+    p = ptr8(buf)
+    k = ptr8(key)
+    a = int(p)
+    i = 0
+    while i < n and (a + i) & 3:
+        p[i] = p[i] ^ k[i & 3]
+        i += 1
+    kw = k[i & 3] | k[(i + 1) & 3] << 8 | k[(i + 2) & 3] << 16 | k[(i + 3) & 3] << 24
+    w = ptr32(a + i)
+    m = (n - i) >> 2
+    j = 0
+    while j < m:
+        w[j] = w[j] ^ kw
+        j += 1
+    i += m << 2
+    while i < n:
+        p[i] = p[i] ^ k[i & 3]
+        i += 1
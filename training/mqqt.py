@@ -35,7 +35,7 @@ def sub_cb(topic, msg):
 
 def sub_loop(c:MQTTClient, topic:bytes = b"topic"):
     try:
-        c.set_callback(sub_cb)
+        c.set_callback(sub_cb, copy=True)
         c.connect()
         print("Connection succefull")
         print(f"Connected to Brocker at {c.server}: {1883} (Mosquitto) ....")
@@ -80,8 +80,13 @@ def getRoute(serverAddress:str="localhost"):
     data = json.loads(response.text)
     return data
 
-def publishRoute(c:MQTTClient, topic:bytes = b"topic", serverAddress:str="localhost", clientId:bytes=b"umqtt_client"):
+# binary=True sends each fix as a 25 byte telemetry.GPS_FIX record instead
+# of JSON; decode on the receiving side with telemetry.decode(). The record
+# holds clientId as the fleet number, so it must be at most 16 bytes
+# (ValueError otherwise).
+def publishRoute(c:MQTTClient, topic:bytes = b"topic", serverAddress:str="localhost", clientId:bytes=b"umqtt_client", binary:bool=False):
     import ujson as json
+    from telemetry import GPS_FIX
     try:
         print("Getting route data ...")
         data = getRoute(serverAddress)
@@ -92,8 +97,11 @@ def publishRoute(c:MQTTClient, topic:bytes = b"topic", serverAddress:str="localh
         while True:
             for routestage in routeStages:
                 stage = routestage["stage"]
-                payload = json.dumps({"fleetNo": clientId, "latitude": float(stage["latitude"]), "longitude": float(stage["longitude"])})
-                c.publish(topic, payload.encode())
+                if binary:
+                    payload = GPS_FIX.encode(clientId, float(stage["latitude"]), float(stage["longitude"]))
+                else:
+                    payload = json.dumps({"fleetNo": clientId, "latitude": float(stage["latitude"]), "longitude": float(stage["longitude"])}).encode()
+                c.publish(topic, payload)
                 print(f"Published: {payload} for {clientId}-{stage['name']}")
                 time.sleep_ms(60000)
             time.sleep_ms(2000)
@@ -2,6 +2,8 @@ import network
 import urequests
 import utime
 import usocket as socket
+import uasyncio as asyncio
+from http_server import HTTPServer
 
 ssid = "ssid"
 password = "password"
@@ -63,20 +65,20 @@ def setUpWebServer(setUpAccessPoint:bool = False):
             setUpWirelesAccesspoint()
         else: 
             connectToMyWifi()
-        s = open_socket()
-        while True: 
-            clientSockConnection, clieAddress = s.accept()
-            print(f"Connected succesfully from {clieAddress[0]}:{clieAddress[1]}", )
-            req = clientSockConnection.recv(1024).decode()
-            # Send headers
-            # send html body
-            # Close connection
-            clientSockConnection.send('Thank you for connecting'.encode())
-            print(req)
-            clientSockConnection.close()
+        # Serves any number of clients at once, answering every path;
+        # see libs/http_server.py for routes per path
+        app = HTTPServer()
+
+        def thankYou(req):
+            print(f"Connected succesfully from {req.remote[0]}:{req.remote[1]}", )
+            print(req.method, req.path, req.headers)
+            return 'Thank you for connecting'
+
+        app.add("/*", thankYou)
+        print(f"Listing for incoming connections ...")
+        asyncio.run(app.serve("0.0.0.0", 80, backlog=3))
 
     except Exception as e:
-        clientSockConnection.close()
         print("Error", e)
 
 